@@ -1,33 +1,3122 @@
 import pandas as pd
 import tkinter as tk
+import argparse
+import codecs
+import contextlib
+import cProfile
 import datetime
+import fnmatch
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import posixpath
+import pstats
+import queue
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unicodedata
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from decimal import Decimal
-from tkinter import filedialog, messagebox
+from openpyxl.cell.text import Text
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import column_index_from_string
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_ISO8601, from_excel
+from pandas.io.parsers import TextParser
+from pandas.io.parsers.readers import STR_NA_VALUES
+from tkinter import filedialog, messagebox, simpledialog
+from tkinter import font as tkfont
+
+try:
+    # Opcional: leitor de CSV multithread e arquivo histórico em Parquet.
+    # Sem ele, o CSV é lido pelo pandas e o arquivo histórico fica desligado.
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pa_pq
+except ImportError:
+    pa = None
+
+# ==============================================================================
+#  LEIAUTES DE SAÍDA (Banrisul e CNAB 240)
+# ==============================================================================
+
+BANCO_BANRISUL = '041'
+
+# Campos do leiaute Banrisul (nome, largura), na ordem do registro.
+CAMPOS_BANRISUL = [
+    ('NOME', 46), ('CPF', 11), ('BCO', 3), ('AG', 4), ('CONTA', 10),
+    ('MATRICULA', 15), ('VALOR', 15), ('VALOR', 15), ('OC', 2),
+    ('DESCR. OCORRENCIA', 82), ('DT AGEND', 8), ('DT PGTO', 8), ('T', 1),
+    ('CNPJ PAGADOR', 14),
+]
+TAMANHO_REGISTRO_BANRISUL = sum(largura for _, largura in CAMPOS_BANRISUL)
+
+# Fim de cada registro: o mesmo que a gravação em modo texto sempre produziu
+# (CRLF no Windows, LF nos demais). Todos os escritores, inclusive o
+# posicional, gravam este terminador, e as contas em bytes usam o seu tamanho.
+FIM_DE_REGISTRO = os.linesep
+
+
+def bytes_por_registro(caminho, tamanho_registro=TAMANHO_REGISTRO_BANRISUL):
+    """Bytes de cada registro de um arquivo já gerado, com o terminador do primeiro registro (LF ou CRLF)."""
+    with open(caminho, 'rb') as f:
+        inicio = f.read(tamanho_registro + 2)
+    return tamanho_registro + (2 if inicio[tamanho_registro:] == b'\r\n' else 1)
+
+# Os arquivos do banco têm um byte por caractere: a largura dos campos em
+# bytes é a mesma em caracteres. Nomes são convertidos para CARACTERES_BANCO.
+CODIFICACAO_SAIDA = 'latin-1'
+CARACTERES_BANCO = "A-Z0-9 .,'/-"
+
+
+def _tabela_caracteres_banco():
+    """Tabela para str.translate: letras acentuadas e símbolos comuns -> equivalente ASCII em maiúsculas."""
+    tabela = {}
+    for codigo in range(0x80, 0x250):  # Latin-1 e Latin Extended-A/B
+        base = unicodedata.normalize('NFKD', chr(codigo)).encode('ascii', 'ignore').decode('ascii')
+        if base.strip():
+            tabela[codigo] = base.upper()
+    tabela.update(str.maketrans({
+        'Æ': 'AE', 'Ø': 'O', 'Đ': 'D', 'Ð': 'D', 'Ł': 'L', 'Þ': 'TH', 'Œ': 'OE',
+        '´': "'", '`': "'", '‘': "'", '’': "'", '\t': ' ',
+    }))
+    return tabela
+
+
+TABELA_CARACTERES_BANCO = _tabela_caracteres_banco()
+
+
+def normalizar_nomes_banco(nomes):
+    """
+    Converte a coluna de nomes inteira para o conjunto de caracteres do banco:
+    maiúsculas sem acento ('João' -> 'JOAO'), e o que não tiver equivalente
+    vira espaço. Nomes vazios continuam vazios.
+    """
+    return (nomes.map(str, na_action='ignore').str.upper()
+            .str.translate(TABELA_CARACTERES_BANCO)
+            .str.replace(f"[^{CARACTERES_BANCO}]", ' ', regex=True))
+
+
+def posicao_campo(nome, campos=CAMPOS_BANRISUL):
+    """Retorna (início, fim) do primeiro campo com esse nome dentro do registro."""
+    inicio = 0
+    for nome_campo, largura in campos:
+        if nome_campo == nome:
+            return inicio, inicio + largura
+        inicio += largura
+    raise KeyError(nome)
+
+# --- CNAB 240 (FEBRABAN) ---
+# Banco que recebe a remessa CNAB 240 (campo 'código do banco' de todos os registros).
+CNAB240_BANCO_REMESSA = '041'
+CNAB240_CAMARA_TED = '018'
+CNAB240_FINALIDADE_TED = '00004'  # Pagamento de salários
+CNAB240_TIPO_SERVICO = '30'       # Pagamento de salários
+CNAB240_FORMA_LANCAMENTO = '41'   # TED outra titularidade
+# Dados da empresa pagadora e NSA: configuráveis (ver carregar_empresa_cnab240 e SequenciaCnab240)
+CNAB240_NOME_BANCO = 'BANRISUL'
+TAMANHO_REGISTRO_CNAB240 = 240
+
+
+def formatar_centavos(centavos):
+    """Formata um total em centavos como 'R$ 1.234,56'."""
+    reais, cents = divmod(int(centavos), 100)
+    return f"R$ {reais:,}".replace(',', '.') + f",{cents:02d}"
+
+
+def extrair_campos(linha):
+    """
+    Normaliza os campos de uma linha do DataFrame final (nome, cpf, matrícula,
+    salário e dados bancários). As regras de exclusão de contas já foram
+    aplicadas ao DataFrame inteiro (aplicar_regras_contas).
+    """
+    # Dados do Funcionário (Sempre existem agora)
+    nome = str(linha['nome'])
+    cpf = str(linha['cpf'])
+    if pd.isna(linha['matricula']):
+        matricula = '0'
+    elif type(linha['matricula']) == float:
+        matricula = str(int(linha['matricula']))
+    else:
+        matricula = str(linha['matricula'])
+    # Salário
+    salario_val = 0.0 if pd.isna(linha['salario']) else float(linha['salario'])
+
+    # Dados Bancários (já com as regras de exclusão aplicadas)
+    conta = str(linha['conta']).strip()
+    banco = str(linha['banco']).strip()
+    agencia = str(linha['agencia']).strip()
+
+    return {
+        'nome': nome,
+        'cpf': cpf,
+        'banco': banco,
+        'agencia': agencia,
+        'conta': conta,
+        'matricula': matricula,
+        'salario': int(salario_val),
+    }
+
+
+def _texto_matricula(serie):
+    """Versão vetorizada da regra de matrícula de extrair_campos (NaN -> '0', float -> inteiro)."""
+    if pd.api.types.is_float_dtype(serie):
+        return pd.Series(np.where(serie.isna(), '0', serie.fillna(0).astype('int64').astype(str)),
+                         index=serie.index, dtype=object)
+    if pd.api.types.is_integer_dtype(serie):
+        return serie.astype(str).astype(object)
+    return serie.map(lambda valor: '0' if pd.isna(valor)
+                     else str(int(valor)) if type(valor) == float else str(valor))
+
+
+def extrair_campos_vetorizado(df):
+    """
+    Mesmo resultado de extrair_campos, mas para o DataFrame inteiro de uma vez:
+    devolve um DataFrame com as colunas nome, cpf, banco, agencia, conta,
+    matricula (texto) e salario (inteiro).
+    """
+    salario = pd.to_numeric(df['salario'].astype(float)).fillna(0.0)
+    return pd.DataFrame({
+        'nome': df['nome'].map(str),
+        'cpf': df['cpf'].map(str),
+        'banco': df['banco'].map(str).str.strip(),
+        'agencia': df['agencia'].map(str).str.strip(),
+        'conta': df['conta'].map(str).str.strip(),
+        'matricula': _texto_matricula(df['matricula']),
+        'salario': np.trunc(salario.to_numpy()).astype('int64'),
+    }, index=df.index)
+
+
+def formatar_registros_banrisul(campos, constantes):
+    """
+    Formata os registros Banrisul de um DataFrame de campos (extrair_campos_vetorizado)
+    com operações de coluna; idêntico a EscritorBanrisul.formatar linha a linha.
+    Retorna uma lista de strings sem a quebra de linha.
+    """
+    c = constantes
+    valor_salario_fmt = campos['salario'].astype(str).str.rjust(15, '0')
+    sufixo = (f"{c['COD_OCORRENCIA']}{c['DESC_OCORRENCIA']}{c['DATA_AGENDAMENTO']}"
+              f"{c['DATA_PAGAMENTO']}{c['TIPO_EMPREGO']}{c['CNPJ_PAGADOR']}")
+    registros = (
+        campos['nome'].str[:46].str.ljust(46, ' ')
+        + campos['cpf'].str.rjust(11, '0')
+        + campos['banco'].str.rjust(3, '0')
+        + campos['agencia'].str.rjust(4, '0')
+        + campos['conta'].str.rjust(10, '0')
+        + campos['matricula'].str.rjust(15, '0')
+        + valor_salario_fmt
+        + valor_salario_fmt
+        + sufixo
+    )
+    return registros.tolist()
+
+
+def rotear_banrisul(df):
+    """
+    Retorna uma máscara booleana com as linhas que vão para o leiaute Banrisul:
+    banco 041, o que inclui as contas zeradas pelas regras de exclusão.
+    """
+    banco = df['banco'].map(str).str.strip().str.rjust(3, '0')
+    return banco == BANCO_BANRISUL
+
+
+# Registros gravados entre dois checkpoints (flush + fsync + linha no histórico)
+REGISTROS_POR_CHECKPOINT = 10000
+
+
+def caminho_parte(caminho_saida, numero):
+    """'<saida>_parteNNN.txt': uma parte de uma saída dividida (EscritorEmPartes)."""
+    base, extensao = os.path.splitext(caminho_saida)
+    return f"{base}_parte{numero:03d}{extensao}"
+
+
+def caminho_manifesto(caminho_saida):
+    return os.path.splitext(caminho_saida)[0] + '_manifesto.csv'
+
+
+def atualizar_manifesto(caminho, sha256):
+    """
+    Troca o SHA-256 e os bytes de um arquivo no manifesto que o lista (o da
+    própria saída, ou o da saída dividida de que ele é uma parte), depois de
+    alterado no lugar (redatar_arquivo). Retorna o manifesto, ou None se o
+    arquivo não está em nenhum.
+    """
+    base, extensao = os.path.splitext(caminho)
+    candidatos = [caminho_manifesto(caminho)]
+    parte = re.fullmatch(r'(.*)_parte\d{3}', base)
+    if parte:
+        candidatos.append(caminho_manifesto(parte.group(1) + extensao))
+    nome = os.path.basename(caminho)
+    for manifesto in candidatos:
+        if not os.path.exists(manifesto):
+            continue
+        linhas = pd.read_csv(manifesto, sep=';', dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        do_arquivo = linhas['arquivo'] == nome
+        if not do_arquivo.any():
+            continue
+        linhas.loc[do_arquivo, 'sha256'] = sha256
+        linhas.loc[do_arquivo, 'bytes'] = str(os.path.getsize(caminho))
+        linhas.to_csv(manifesto + '.parcial', sep=';', index=False, encoding='utf-8-sig')
+        os.replace(manifesto + '.parcial', manifesto)
+        return manifesto
+    return None
+
+
+def remover_partes(caminho_saida, a_partir_de=1):
+    """
+    Apaga as partes de uma gravação anterior dividida, a partir da parte
+    `a_partir_de` (com os índices); a partir da primeira, também o manifesto.
+    Evita que partes velhas fiquem junto da saída nova e sejam enviadas ao banco.
+    """
+    numero = a_partir_de
+    while os.path.exists(caminho_parte(caminho_saida, numero)):
+        os.remove(caminho_parte(caminho_saida, numero))
+        if os.path.exists(caminho_indice(caminho_parte(caminho_saida, numero))):
+            os.remove(caminho_indice(caminho_parte(caminho_saida, numero)))
+        numero += 1
+    if a_partir_de == 1 and os.path.exists(caminho_manifesto(caminho_saida)):
+        os.remove(caminho_manifesto(caminho_saida))
+
+
+class ArquivoComResumo(io.FileIO):
+    """Arquivo binário que atualiza um SHA-256 com cada byte gravado nele, na ordem do arquivo."""
+
+    def __init__(self, caminho, modo, resumo):
+        super().__init__(caminho, modo)
+        self.resumo = resumo
+
+    def write(self, dados):
+        gravados = super().write(dados)
+        self.resumo.update(memoryview(dados)[:gravados])
+        return gravados
+
+
+def sha256_arquivo(caminho):
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            resumo.update(bloco)
+    return resumo
+
+
+class EscritorRegistros:
+    """
+    Base dos escritores de saída. A gravação é feita em '<caminho>.parcial' e o
+    arquivo só recebe o nome final quando termina, então uma saída pela metade
+    nunca se passa por completa.
+
+    A cada REGISTROS_POR_CHECKPOINT registros o arquivo é descarregado em disco e
+    o estado dos contadores (CONTADORES + bytes gravados) é entregue ao callback
+    de checkpoint. Com esse estado, gravar() retoma do último checkpoint: trunca
+    o parcial no byte salvo e pula os registros já gravados.
+
+    O SHA-256 do arquivo (sha256) é calculado durante a gravação, sobre os
+    bytes que vão para o disco (ArquivoComResumo), para o manifesto das saídas
+    divididas não precisar reler as partes.
+    """
+
+    CONTADORES = ('registros', 'total_centavos')
+    # Bytes de cada registro e do que o arquivo tem além deles (headers e trailers),
+    # usados para saber quantos registros cabem em um limite de tamanho
+    BYTES_POR_REGISTRO = TAMANHO_REGISTRO_BANRISUL + len(FIM_DE_REGISTRO)
+    BYTES_FIXOS = 0
+
+    def __init__(self, caminho, constantes):
+        self.caminho = caminho
+        self.caminho_parcial = caminho + '.parcial'
+        self.constantes = constantes
+        self.registros = 0
+        self.total_centavos = 0
+        self.sha256 = None
+        self._arquivo = None
+
+    def _abrir_parcial(self, modo):
+        arquivo = ArquivoComResumo(self.caminho_parcial, modo, self.sha256)
+        return io.TextIOWrapper(io.BufferedWriter(arquivo), encoding=CODIFICACAO_SAIDA, errors='replace',
+                                newline=FIM_DE_REGISTRO)
+
+    def estado(self):
+        """Contadores + posição em bytes do arquivo parcial, já descarregado em disco."""
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+        estado = {nome: getattr(self, nome) for nome in self.CONTADORES}
+        estado['bytes'] = self._arquivo.tell()
+        return estado
+
+    def abrir(self, estado=None):
+        if estado and os.path.exists(self.caminho_parcial):
+            # Retomada: descarta o que foi gravado depois do último checkpoint
+            os.truncate(self.caminho_parcial, estado['bytes'])
+            for nome in self.CONTADORES:
+                setattr(self, nome, estado[nome])
+            # O resumo continua de onde o checkpoint parou
+            self.sha256 = sha256_arquivo(self.caminho_parcial)
+            self._arquivo = self._abrir_parcial('a')
+            return True
+        self.sha256 = hashlib.sha256()
+        self._arquivo = self._abrir_parcial('w')
+        return False
+
+    def escrever(self, campos):
+        raise NotImplementedError
+
+    def fechar(self):
+        self._arquivo.close()
+        self._arquivo = None
+        os.replace(self.caminho_parcial, self.caminho)
+        remover_partes(self.caminho)
+
+    def abandonar(self):
+        """Fecha o parcial sem finalizar (erro no meio da gravação)."""
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+    @property
+    def arquivos(self):
+        """Arquivos gravados por este escritor."""
+        return [self.caminho]
+
+    @classmethod
+    def capacidade(cls, limite_registros=None, limite_bytes=None):
+        """Registros que cabem em um arquivo dentro dos limites (None: sem limite)."""
+        capacidade = limite_registros or sys.maxsize
+        if limite_bytes:
+            capacidade = min(capacidade, (limite_bytes - cls.BYTES_FIXOS) // cls.BYTES_POR_REGISTRO)
+        if capacidade < 1:
+            raise ValueError(f"Limite pequeno demais: um arquivo precisa de pelo menos "
+                             f"{cls.BYTES_FIXOS + cls.BYTES_POR_REGISTRO} bytes.")
+        return capacidade
+
+    def gravar_bloco(self, df):
+        """Grava um bloco de linhas (arquivo já aberto); usado pelo modo fora da memória."""
+        for indice, linha in df.iterrows():
+            self.escrever(extrair_campos(linha))
+
+    def gravar(self, df, estado=None, checkpoint=None):
+        """
+        Grava todas as linhas do DataFrame e retorna o número de registros.
+        `estado` é o último checkpoint de uma gravação interrompida;
+        `checkpoint(escritor, estado)` é chamado a cada bloco concluído e ao final.
+        """
+        if estado and estado.get('concluido') and os.path.exists(self.caminho):
+            # Este arquivo já tinha terminado antes da interrupção
+            for nome in self.CONTADORES:
+                setattr(self, nome, estado[nome])
+            return self.registros
+        self.abrir(estado)
+        try:
+            for indice, linha in df.iloc[self.registros:].iterrows():
+                self.escrever(extrair_campos(linha))
+                if checkpoint is not None and self.registros % REGISTROS_POR_CHECKPOINT == 0:
+                    checkpoint(self, self.estado())
+        except BaseException:
+            self.abandonar()
+            raise
+        self.fechar()
+        if checkpoint is not None:
+            estado_final = {nome: getattr(self, nome) for nome in self.CONTADORES}
+            estado_final['concluido'] = True
+            checkpoint(self, estado_final)
+        return self.registros
+
+
+class EscritorBanrisul(EscritorRegistros):
+    """
+    Grava o leiaute de largura fixa do Banrisul. O leiaute só tem registros de
+    detalhe, mas o escritor mantém os contadores de registros e de centavos
+    durante a gravação para o resumo do processamento. Ao final grava também
+    o índice '<saida>.idx' (cpf/matrícula -> número do registro).
+    """
+
+    def gravar(self, df, estado=None, checkpoint=None):
+        total = super().gravar(df, estado, checkpoint)
+        gravar_indice(self.caminho, df)
+        return total
+
+    def gravar_bloco(self, df):
+        # Formatação vetorizada do bloco; o índice é acrescentado a cada bloco
+        campos = extrair_campos_vetorizado(df)
+        self._arquivo.writelines(registro + '\n' for registro in formatar_registros_banrisul(campos, self.constantes))
+        acrescentar_indice(self.caminho, df, self.registros)
+        self.registros += len(campos)
+        self.total_centavos += int(campos['salario'].sum())
+
+    def fechar(self):
+        super().fechar()
+        concluir_indice(self.caminho)
+
+    def formatar(self, campos):
+        c = self.constantes
+        # Aplica a máscara/padding
+        nome_fmt = campos['nome'][:46].ljust(46, ' ')
+        cpf_fmt = campos['cpf'].rjust(11, '0')
+        banco_fmt = campos['banco'].rjust(3, '0')
+        agencia_fmt = campos['agencia'].rjust(4, '0')
+        conta_fmt = campos['conta'].rjust(10, '0')
+        matricula_fmt = campos['matricula'].rjust(15, '0')
+        valor_salario_fmt = str(campos['salario']).rjust(15, '0')
+
+        return (
+            f"{nome_fmt}{cpf_fmt}{banco_fmt}{agencia_fmt}{conta_fmt}"
+            f"{matricula_fmt}{valor_salario_fmt}{valor_salario_fmt}"
+            f"{c['COD_OCORRENCIA']}{c['DESC_OCORRENCIA']}{c['DATA_AGENDAMENTO']}"
+            f"{c['DATA_PAGAMENTO']}{c['TIPO_EMPREGO']}{c['CNPJ_PAGADOR']}"
+        )
+
+    def escrever(self, campos):
+        self._arquivo.write(self.formatar(campos) + '\n')
+        self.registros += 1
+        self.total_centavos += campos['salario']
+
+
+class TamanhoRegistroInvalido(ValueError):
+    """Um registro formatado não tem o tamanho fixo do leiaute (em bytes)."""
+
+
+class EscritorBanrisulPosicional(EscritorBanrisul):
+    """
+    Gravação posicional do leiaute Banrisul. Como todo registro tem o mesmo
+    tamanho, o registro i começa no byte i * (TAMANHO_REGISTRO_BANRISUL + len(FIM_DE_REGISTRO)):
+    o arquivo é pré-alocado no tamanho final, mapeado em memória, e cada
+    thread formata um bloco de linhas (de forma vetorizada) e o copia direto
+    para a sua posição, sem juntar a saída inteira em uma string e sem ordem
+    de gravação entre os blocos. O arquivo só recebe o nome final no fim.
+
+    Se algum registro não tiver exatamente o tamanho do leiaute (campo maior
+    que a largura), a gravação volta para o modo sequencial. Não há checkpoints: uma gravação interrompida
+    recomeça do zero.
+    """
+
+    def __init__(self, caminho, constantes, trabalhadores=None, registros_por_bloco=50000):
+        super().__init__(caminho, constantes)
+        self.trabalhadores = trabalhadores or min(8, os.cpu_count() or 1)
+        self.registros_por_bloco = registros_por_bloco
+        self._trava = threading.Lock()
+
+    def _gravar_bloco(self, mapa, df, inicio):
+        tamanho = TAMANHO_REGISTRO_BANRISUL + len(FIM_DE_REGISTRO)
+        campos = extrair_campos_vetorizado(df.iloc[inicio:inicio + self.registros_por_bloco])
+        dados = "".join(registro + FIM_DE_REGISTRO for registro in formatar_registros_banrisul(campos, self.constantes))
+        dados = dados.encode(CODIFICACAO_SAIDA, errors='replace')
+        if len(dados) != len(campos) * tamanho:
+            raise TamanhoRegistroInvalido(f"bloco iniciado no registro {inicio + 1}")
+        mapa[inicio * tamanho:inicio * tamanho + len(dados)] = dados
+        with self._trava:
+            self.registros += len(campos)
+            self.total_centavos += int(campos['salario'].sum())
+
+    def gravar(self, df, estado=None, checkpoint=None):
+        total = len(df)
+        self.sha256 = hashlib.sha256()
+        with open(self.caminho_parcial, 'wb') as f:
+            f.truncate(total * (TAMANHO_REGISTRO_BANRISUL + len(FIM_DE_REGISTRO)))
+        if total:
+            try:
+                tamanho = TAMANHO_REGISTRO_BANRISUL + len(FIM_DE_REGISTRO)
+                with open(self.caminho_parcial, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mapa:
+                    with ThreadPoolExecutor(max_workers=self.trabalhadores) as executor, memoryview(mapa) as visao:
+                        futuros = [(inicio, executor.submit(self._gravar_bloco, mapa, df, inicio))
+                                   for inicio in range(0, total, self.registros_por_bloco)]
+                        # Resumo na ordem do arquivo: cada bloco entra assim que fica pronto
+                        for inicio, futuro in futuros:
+                            futuro.result()
+                            self.sha256.update(visao[inicio * tamanho:(inicio + self.registros_por_bloco) * tamanho])
+                    mapa.flush()
+            except TamanhoRegistroInvalido:
+                # Registros de tamanho variável: grava em sequência
+                self.registros = 0
+                self.total_centavos = 0
+                return super().gravar(df)
+        os.replace(self.caminho_parcial, self.caminho)
+        remover_partes(self.caminho)
+        gravar_indice(self.caminho, df)
+        return self.registros
+
+
+class EscritorCnab240(EscritorRegistros):
+    """
+    Grava os pagamentos no padrão FEBRABAN CNAB 240, um segmento A
+    (dados do crédito) e um segmento B (CPF do favorecido) por servidor, em um
+    único lote. Agência e conta vão sem dígito verificador (DV em branco).
+
+    Os headers são gravados na abertura e os trailers no fechamento, a partir
+    dos contadores mantidos durante a gravação dos detalhes (sem reler o
+    arquivo nem agregar o DataFrame de novo).
+    """
+
+    CONTADORES = EscritorRegistros.CONTADORES + ('sequencial', 'registros_lote', 'registros_arquivo', 'lotes')
+    # Segmentos A e B por registro; headers e trailers de arquivo e de lote
+    BYTES_POR_REGISTRO = 2 * (TAMANHO_REGISTRO_CNAB240 + len(FIM_DE_REGISTRO))
+    BYTES_FIXOS = 4 * (TAMANHO_REGISTRO_CNAB240 + len(FIM_DE_REGISTRO))
+
+    def __init__(self, caminho, constantes):
+        super().__init__(caminho, constantes)
+        self.empresa = validar_empresa_cnab240(constantes.get('EMPRESA_CNAB240') or {})
+        self.nsa = None  # Reservado na abertura (SequenciaCnab240)
+        # AAAAMMDD -> DDMMAAAA
+        data = constantes['DATA_PAGAMENTO']
+        self.data_cnab = f"{data[6:8]}{data[4:6]}{data[0:4]}"
+        self.lote = 1
+        self.sequencial = 0
+        # Contadores corridos (self.registros conta servidores, i.e. pares A/B)
+        self.registros_lote = 0       # Header + detalhes + trailer do lote
+        self.registros_arquivo = 0    # Todos os registros do arquivo
+        self.lotes = 0
+
+    def _gravar_registro(self, registro):
+        self._arquivo.write(registro + '\n')
+        self.registros_arquivo += 1
+
+    def _dados_empresa(self):
+        return (
+            f"2"                                              # Tipo de inscrição (CNPJ)
+            f"{self.constantes['CNPJ_PAGADOR'].rjust(14, '0')}"
+            f"{self.empresa['convenio'][:20].ljust(20, ' ')}"
+            f"{self.empresa['agencia'].rjust(5, '0')} "       # Agência + DV
+            f"{self.empresa['conta'].rjust(12, '0')}  "       # Conta + DV + DV ag/conta
+            f"{self.empresa['nome'][:30].ljust(30, ' ')}"
+        )
+
+    def formatar_header_arquivo(self):
+        agora = datetime.datetime.now()
+        return (
+            f"{CNAB240_BANCO_REMESSA}0000"
+            f"0"
+            f"{' ' * 9}"
+            f"{self._dados_empresa()}"
+            f"{CNAB240_NOME_BANCO[:30].ljust(30, ' ')}"
+            f"{' ' * 10}"
+            f"1"                                      # Código remessa
+            f"{agora.strftime('%d%m%Y%H%M%S')}"
+            f"{self.nsa:06d}"
+            f"089"                                    # Versão do leiaute do arquivo
+            f"00000"                                  # Densidade
+            f"{' ' * 20}{' ' * 20}{' ' * 29}"
+        )
+
+    def formatar_header_lote(self):
+        return (
+            f"{CNAB240_BANCO_REMESSA}{self.lote:04d}"
+            f"1"
+            f"C"                                      # Operação (crédito)
+            f"{CNAB240_TIPO_SERVICO}"
+            f"{CNAB240_FORMA_LANCAMENTO}"
+            f"045"                                    # Versão do leiaute do lote
+            f" "
+            f"{self._dados_empresa()}"
+            f"{' ' * 40}"                             # Mensagem
+            f"{' ' * 30}{' ' * 5}{' ' * 15}{' ' * 20}"  # Endereço da empresa
+            f"{' ' * 5}{' ' * 3}{' ' * 2}"            # CEP + UF
+            f"{' ' * 2}"                              # Forma de pagamento
+            f"{' ' * 6}"
+            f"{' ' * 10}"                             # Ocorrências
+        )
+
+    def formatar_trailer_lote(self):
+        return (
+            f"{CNAB240_BANCO_REMESSA}{self.lote:04d}"
+            f"5"
+            f"{' ' * 9}"
+            f"{self.registros_lote:06d}"
+            f"{self.total_centavos:018d}"
+            f"{'0' * 18}"                             # Somatória de quantidade de moedas
+            f"{'0' * 6}"                              # Número aviso de débito
+            f"{' ' * 165}"
+            f"{' ' * 10}"                             # Ocorrências
+        )
+
+    def formatar_trailer_arquivo(self):
+        return (
+            f"{CNAB240_BANCO_REMESSA}9999"
+            f"9"
+            f"{' ' * 9}"
+            f"{self.lotes:06d}"
+            f"{self.registros_arquivo:06d}"
+            f"{'0' * 6}"                              # Contas para conciliação
+            f"{' ' * 205}"
+        )
+
+    def _prefixo(self, segmento):
+        self.sequencial += 1
+        return f"{CNAB240_BANCO_REMESSA}{self.lote:04d}3{self.sequencial:05d}{segmento}"
+
+    def formatar_segmento_a(self, campos):
+        valor_fmt = str(campos['salario']).rjust(15, '0')
+        return (
+            f"{self._prefixo('A')}"
+            f"0"                                      # Tipo de movimento (inclusão)
+            f"00"                                     # Código da instrução
+            f"{CNAB240_CAMARA_TED}"
+            f"{campos['banco'].rjust(3, '0')}"
+            f"{campos['agencia'].rjust(5, '0')} "     # Agência + DV
+            f"{campos['conta'].rjust(12, '0')}  "     # Conta + DV + DV ag/conta
+            f"{campos['nome'][:30].ljust(30, ' ')}"
+            f"{campos['matricula'][:20].ljust(20, ' ')}"  # Seu número
+            f"{self.data_cnab}"
+            f"BRL"
+            f"{'0' * 15}"                             # Quantidade de moeda
+            f"{valor_fmt}"
+            f"{' ' * 20}"                             # Nosso número
+            f"{'0' * 8}"                              # Data real
+            f"{'0' * 15}"                             # Valor real
+            f"{' ' * 40}"                             # Outras informações
+            f"  "                                     # Compl. tipo de serviço
+            f"{CNAB240_FINALIDADE_TED}"
+            f"  "                                     # Finalidade complementar
+            f"{' ' * 3}"
+            f"0"                                      # Aviso ao favorecido
+            f"{' ' * 10}"                             # Ocorrências
+        )
+
+    def formatar_segmento_b(self, campos):
+        return (
+            f"{self._prefixo('B')}"
+            f"{' ' * 3}"
+            f"1"                                      # Tipo de inscrição (CPF)
+            f"{campos['cpf'].rjust(14, '0')}"
+            f"{' ' * 30}{' ' * 5}{' ' * 15}{' ' * 15}{' ' * 20}"  # Endereço
+            f"{' ' * 5}{' ' * 3}{' ' * 2}"            # CEP + UF
+            f"{self.data_cnab}"                       # Data de vencimento
+            f"{str(campos['salario']).rjust(15, '0')}"  # Valor do documento
+            f"{'0' * 15 * 4}"                         # Abatimento/desconto/mora/multa
+            f"{' ' * 15}"                             # Código documento favorecido
+            f"0"                                      # Aviso ao favorecido
+            f"{' ' * 6}"                              # Código UG (SIAPE)
+            f"{' ' * 8}"                              # ISPB
+        )
+
+    def abrir(self, estado=None):
+        if super().abrir(estado):
+            return True  # Headers já estão no parcial
+        # Um número por arquivo gerado, inclusive por parte (EscritorEmPartes)
+        self.nsa = SequenciaCnab240().proximo(self.constantes['CNPJ_PAGADOR'], self.empresa['nsa_inicial'])
+        self._gravar_registro(self.formatar_header_arquivo())
+        self._gravar_registro(self.formatar_header_lote())
+        self.lotes += 1
+        self.registros_lote = 1
+        return False
+
+    def escrever(self, campos):
+        self._gravar_registro(self.formatar_segmento_a(campos))
+        self._gravar_registro(self.formatar_segmento_b(campos))
+        self.registros_lote += 2
+        self.registros += 1
+        self.total_centavos += campos['salario']
+
+    def fechar(self):
+        self.registros_lote += 1  # O próprio trailer do lote
+        self._gravar_registro(self.formatar_trailer_lote())
+        self.registros_arquivo += 1  # O próprio trailer do arquivo
+        self._arquivo.write(self.formatar_trailer_arquivo() + '\n')
+        super().fechar()
+
+
+class EscritorEmPartes:
+    """
+    Divide a saída de um escritor em arquivos numerados ('<saida>_parte001.txt',
+    ...) para respeitar os limites do portal do banco. Como os registros têm
+    tamanho fixo, a capacidade de cada parte é conhecida antes de gravar: a
+    troca de parte acontece durante a própria gravação, sem segunda passada.
+    As partes seguem a ordem das linhas (nome) e cada uma é um arquivo completo
+    do leiaute (no CNAB 240, com os seus headers e trailers) com o seu índice.
+    Se tudo couber em uma parte, ela fica com o nome de sempre.
+
+    Ao final grava '<saida>_manifesto.csv' com registros, total em centavos,
+    bytes e SHA-256 de cada parte, para conferência após o upload.
+    """
+
+    def __init__(self, classe, caminho, constantes, limite_registros=None, limite_bytes=None):
+        self.classe = classe
+        self.caminho = caminho
+        self.constantes = constantes
+        self.capacidade = classe.capacidade(limite_registros, limite_bytes)
+        self.caminho_manifesto = caminho_manifesto(caminho)
+        self.partes = []
+        self._atual = None
+
+    @property
+    def registros(self):
+        return sum(parte.registros for parte in self.partes) + (self._atual.registros if self._atual else 0)
+
+    @property
+    def total_centavos(self):
+        return sum(parte.total_centavos for parte in self.partes) + (self._atual.total_centavos if self._atual else 0)
+
+    @property
+    def arquivos(self):
+        return [parte.caminho for parte in self.partes]
+
+    def _caminho_parte(self, numero):
+        return caminho_parte(self.caminho, numero)
+
+    def gravar(self, df, estado=None, checkpoint=None):
+        """Grava o DataFrame inteiro, uma fatia por parte; o checkpoint guarda o estado de cada parte."""
+        estados = dict((estado or {}).get('partes', {}))
+
+        def checkpoint_parte(parte, estado_parte):
+            estados[parte.caminho] = estado_parte
+            checkpoint(self, {'partes': dict(estados)})
+
+        for inicio in range(0, max(len(df), 1), self.capacidade):
+            parte = self.classe(self._caminho_parte(len(self.partes) + 1), self.constantes)
+            parte.gravar(df.iloc[inicio:inicio + self.capacidade], estados.get(parte.caminho),
+                         checkpoint_parte if checkpoint is not None else None)
+            self.partes.append(parte)
+        self._finalizar()
+        return self.registros
+
+    # Gravação em blocos (modo fora da memória)
+    def abrir(self, estado=None):
+        self._atual = self.classe(self._caminho_parte(len(self.partes) + 1), self.constantes)
+        self._atual.abrir()
+
+    def gravar_bloco(self, df):
+        while len(df):
+            livres = self.capacidade - self._atual.registros
+            if not livres:
+                # Parte cheia: só abre a próxima quando há registros para ela
+                self._atual.fechar()
+                self.partes.append(self._atual)
+                self.abrir()
+                continue
+            self._atual.gravar_bloco(df.iloc[:livres])
+            df = df.iloc[livres:]
+
+    def fechar(self):
+        self._atual.fechar()
+        self.partes.append(self._atual)
+        self._atual = None
+        self._finalizar()
+
+    def abandonar(self):
+        if self._atual is not None:
+            self._atual.abandonar()
+
+    def _finalizar(self):
+        if len(self.partes) == 1:
+            # Coube em uma parte: fica com o nome de sempre
+            parte = self.partes[0]
+            os.replace(parte.caminho, self.caminho)
+            if os.path.exists(caminho_indice(parte.caminho)):
+                os.replace(caminho_indice(parte.caminho), caminho_indice(self.caminho))
+            parte.caminho = self.caminho
+        else:
+            # Uma saída inteira de uma gravação anterior não pode ficar junto das partes
+            for caminho in (self.caminho, caminho_indice(self.caminho)):
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+        # Nem as partes a mais de uma gravação anterior maior
+        remover_partes(self.caminho, a_partir_de=len(self.partes) + 1)
+
+        linhas = []
+        for numero, parte in enumerate(self.partes, start=1):
+            # Calculado durante a gravação; só uma parte concluída antes de uma retomada é relida
+            resumo = parte.sha256 or sha256_arquivo(parte.caminho)
+            linhas.append({
+                'parte': numero,
+                'arquivo': os.path.basename(parte.caminho),
+                'registros': parte.registros,
+                'total_centavos': parte.total_centavos,
+                'total': formatar_centavos(parte.total_centavos),
+                'bytes': os.path.getsize(parte.caminho),
+                'sha256': resumo.hexdigest(),
+            })
+        pd.DataFrame(linhas).to_csv(self.caminho_manifesto, sep=';', index=False, encoding='utf-8-sig')
+
+# ==============================================================================
+#  PROGRESSO (atualizações limitadas, registros/s e ETA)
+# ==============================================================================
+
+def formatar_duracao(segundos):
+    """Formata uma duração como '1h02m03s', '2m05s' ou '12s'."""
+    segundos = int(round(segundos))
+    horas, resto = divmod(segundos, 3600)
+    minutos, segundos = divmod(resto, 60)
+    if horas:
+        return f"{horas}h{minutos:02d}m{segundos:02d}s"
+    if minutos:
+        return f"{minutos}m{segundos:02d}s"
+    return f"{segundos}s"
+
+
+def formatar_milhar(valor):
+    """Formata um número inteiro com separador de milhar brasileiro (12.345)."""
+    return f"{valor:,.0f}".replace(',', '.')
+
+
+class ReportadorProgresso:
+    """
+    Intermediário entre o processamento e o status_callback. As mensagens de
+    progresso de uma etapa saem no máximo `frequencia` vezes por segundo, para
+    que o redesenho do Tk (ou a escrita no console) não domine o tempo de
+    execução, e trazem registros/s e ETA quando o total é conhecido.
+
+    Só a thread que chama atualizar()/concluir() toca no callback; as threads
+    de gravação apenas mantêm os seus próprios contadores.
+    """
+
+    def __init__(self, callback, frequencia=10):
+        self.callback = callback
+        self.intervalo = 1.0 / frequencia
+        self.etapa = ''
+        self.total = None
+        self.feitos = 0
+        self.inicio = time.perf_counter()
+        self._ultima_publicacao = 0.0
+        self._trava = threading.Lock()
+
+    def iniciar(self, etapa, total=None):
+        self.etapa = etapa
+        self.total = total
+        self.feitos = 0
+        self.inicio = time.perf_counter()
+        self._ultima_publicacao = self.inicio
+        self.callback(f"{etapa}...")
+
+    def atualizar(self, feitos, forcar=False):
+        """Registra o total de itens já processados e publica se o intervalo permitir."""
+        with self._trava:
+            self.feitos = feitos
+            agora = time.perf_counter()
+            if not forcar and agora - self._ultima_publicacao < self.intervalo:
+                return
+            self._ultima_publicacao = agora
+        self.callback(self.descrever(agora))
+
+    def concluir(self, feitos=None):
+        if feitos is not None:
+            self.feitos = feitos
+        decorrido = time.perf_counter() - self.inicio
+        taxa = self.feitos / decorrido if decorrido > 0 else 0
+        self.callback(f"{self.etapa}: {self.feitos} registros em {formatar_duracao(decorrido)} ({formatar_milhar(taxa)} reg/s)")
+
+    def descrever(self, agora=None):
+        agora = agora if agora is not None else time.perf_counter()
+        decorrido = agora - self.inicio
+        taxa = self.feitos / decorrido if decorrido > 0 else 0
+        texto = f"{self.etapa}: {self.feitos}"
+        if self.total:
+            texto += f"/{self.total} ({self.feitos / self.total:.0%})"
+        texto += f" - {formatar_milhar(taxa)} reg/s"
+        if self.total and taxa > 0:
+            texto += f" - ETA {formatar_duracao((self.total - self.feitos) / taxa)}"
+        return texto
+
+
+# ==============================================================================
+#  REGRAS DE EXCLUSÃO / SUBSTITUIÇÃO DE CONTAS (configuráveis)
+# ==============================================================================
+
+ARQUIVO_REGRAS_CONTAS = 'regras_contas.json'
+
+# Regras usadas quando não há arquivo de configuração: as do leiaute Banrisul.
+REGRAS_CONTAS_PADRAO = [
+    {'nome': 'sem_conta', 'descricao': 'servidor sem conta no arquivo de contas',
+     'conta_igual': ['0'], 'acao': 'zerar'},
+    {'nome': 'conta_38_39', 'descricao': 'conta iniciada por 38 ou 39',
+     'conta_prefixos': ['38', '39'], 'acao': 'zerar'},
+]
+
+DADOS_BANCARIOS_ZERADOS = {'banco': BANCO_BANRISUL, 'agencia': '0000', 'conta': '0000000000'}
+
+
+class RegraConta:
+    """
+    Uma regra compilada. Os critérios presentes são combinados com E:
+      conta_igual     lista de contas
+      conta_prefixos  lista de prefixos de conta
+      bancos          lista de códigos de banco
+      agencia_faixa   [mínima, máxima] (inclusive, numérica)
+      cpfs            lista de CPFs
+      cpfs_arquivo    arquivo texto com um CPF por linha
+    A ação 'zerar' troca os dados por banco 041, agência 0000 e conta
+    0000000000; 'substituir' usa os valores de 'banco', 'agencia' e/ou 'conta'
+    da própria regra.
+    """
+
+    CRITERIOS = ('conta_igual', 'conta_prefixos', 'bancos', 'agencia_faixa', 'cpfs', 'cpfs_arquivo')
+
+    def __init__(self, definicao):
+        self.nome = definicao.get('nome') or 'regra'
+        self.descricao = definicao.get('descricao', self.nome)
+        if not any(criterio in definicao for criterio in self.CRITERIOS):
+            raise ValueError(f"Regra '{self.nome}' sem critério ({', '.join(self.CRITERIOS)}).")
+
+        self.conta_igual = set(map(str, definicao.get('conta_igual', []))) or None
+        self.conta_prefixos = tuple(map(str, definicao.get('conta_prefixos', []))) or None
+        self.bancos = {str(banco).rjust(3, '0') for banco in definicao.get('bancos', [])} or None
+        self.agencia_faixa = tuple(definicao['agencia_faixa']) if 'agencia_faixa' in definicao else None
+        cpfs = [str(cpf) for cpf in definicao.get('cpfs', [])]
+        if 'cpfs_arquivo' in definicao:
+            with open(definicao['cpfs_arquivo'], encoding='utf-8') as f:
+                cpfs += [linha.strip() for linha in f if linha.strip()]
+        self.cpfs = set(_normalizar_cpfs(cpfs)) if cpfs else None
+
+        acao = definicao.get('acao', 'zerar')
+        if acao == 'zerar':
+            self.substituicoes = DADOS_BANCARIOS_ZERADOS
+        elif acao == 'substituir':
+            self.substituicoes = {campo: str(definicao[campo]) for campo in ('banco', 'agencia', 'conta')
+                                  if campo in definicao}
+            if not self.substituicoes:
+                raise ValueError(f"Regra '{self.nome}': 'substituir' sem banco/agencia/conta.")
+        else:
+            raise ValueError(f"Regra '{self.nome}': ação desconhecida '{acao}' (use 'zerar' ou 'substituir').")
+
+    def mascara(self, campos):
+        """Máscara booleana das linhas que casam com a regra (campos: Series normalizadas)."""
+        mascara = pd.Series(True, index=campos['conta'].index)
+        if self.conta_igual is not None:
+            mascara &= campos['conta'].isin(self.conta_igual)
+        if self.conta_prefixos is not None:
+            mascara &= campos['conta'].str.startswith(self.conta_prefixos)
+        if self.bancos is not None:
+            mascara &= campos['banco'].str.rjust(3, '0').isin(self.bancos)
+        if self.agencia_faixa is not None:
+            agencia = pd.to_numeric(campos['agencia'], errors='coerce')
+            mascara &= agencia.between(*self.agencia_faixa)
+        if self.cpfs is not None:
+            mascara &= campos['cpf'].isin(self.cpfs)
+        return mascara
+
+
+def localizar_configuracao(caminho, variavel, nome_arquivo):
+    """
+    Arquivo de configuração: o caminho informado, senão o da variável de
+    ambiente `variavel`, senão `nome_arquivo` ao lado do programa (ou do
+    executável), se existir. None quando não há nenhum.
+    """
+    if caminho is None:
+        caminho = os.environ.get(variavel)
+    if caminho is None:
+        pasta_programa = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
+        candidato = os.path.join(pasta_programa, nome_arquivo)
+        caminho = candidato if os.path.exists(candidato) else None
+    return caminho
+
+
+def carregar_regras_contas(caminho=None):
+    """
+    Lê e compila as regras de contas. Procura, nesta ordem: o caminho
+    informado, a variável LEOPOLDO_REGRAS e 'regras_contas.json' ao lado do
+    programa; sem arquivo, usa REGRAS_CONTAS_PADRAO. O arquivo é um JSON
+    {"regras": [...]} com definições no formato de RegraConta; vale a
+    primeira regra que casar com cada linha.
+    """
+    caminho = localizar_configuracao(caminho, 'LEOPOLDO_REGRAS', ARQUIVO_REGRAS_CONTAS)
+    if caminho is None:
+        definicoes = REGRAS_CONTAS_PADRAO
+    else:
+        with open(caminho, encoding='utf-8') as f:
+            definicoes = json.load(f)['regras']
+    return [RegraConta(definicao) for definicao in definicoes]
+
+
+def aplicar_regras_contas(df, regras):
+    """
+    Aplica as regras compiladas ao DataFrame inteiro (uma máscara por regra).
+    Retorna (cópia com banco/agencia/conta normalizados e já substituídos, mais
+    a coluna 'regra_conta' com o nome da regra aplicada; {regra: linhas}).
+    """
+    campos = {
+        'banco': df['banco'].map(str).str.strip(),
+        'agencia': df['agencia'].map(str).str.strip(),
+        'conta': df['conta'].map(str).str.strip(),
+        'cpf': df['cpf'].map(str).str.replace(r'\D', '', regex=True).str.zfill(11),
+    }
+    resultado = df.copy()
+    for campo in ('banco', 'agencia', 'conta'):
+        resultado[campo] = campos[campo]
+    regra_aplicada = pd.Series('', index=df.index, dtype=object)
+    livres = pd.Series(True, index=df.index)
+    contagens = {}
+    for regra in regras:
+        mascara = regra.mascara(campos) & livres
+        contagens[regra.nome] = int(mascara.sum())
+        if contagens[regra.nome]:
+            for campo, valor in regra.substituicoes.items():
+                resultado[campo] = resultado[campo].mask(mascara, valor)
+            regra_aplicada = regra_aplicada.mask(mascara, regra.nome)
+            livres &= ~mascara
+    resultado['regra_conta'] = regra_aplicada
+    return resultado, contagens
+
+
+# ==============================================================================
+#  CNPJ PAGADOR POR LINHA (coluna da planilha ou mapa por origem)
+# ==============================================================================
+
+CNPJ_PAGADOR_PADRAO = '88131164000107'
+
+
+def carregar_mapa_cnpj(caminho=None):
+    """
+    Mapa {padrão de origem: CNPJ} de um JSON, na ordem do arquivo. O padrão é
+    comparado (fnmatch) com a origem do servidor, 'arquivo.xlsx::Aba' ou
+    'arquivo.csv': {"fundacao.xlsx::*": "...", "*::Autarquia": "..."}.
+    """
+    if caminho is None:
+        return {}
+    with open(caminho, encoding='utf-8') as f:
+        return {str(padrao): str(cnpj) for padrao, cnpj in json.load(f).items()}
+
+
+def resolver_cnpj_pagador(df, padrao=CNPJ_PAGADOR_PADRAO, mapa_cnpj=None):
+    """
+    CNPJ pagador de cada linha: o da coluna cnpj_pagador da planilha de
+    servidores, se preenchido; senão o do primeiro padrão do mapa_cnpj que
+    casar com a origem; senão o padrão. Pontuação é removida e os zeros à
+    esquerda completados até 14 dígitos; o que sobrar inválido vai para a
+    validação (e impede a gravação, ver escritores_por_cnpj).
+    """
+    cnpj = df['cnpj_pagador'] if 'cnpj_pagador' in df else pd.Series(np.nan, index=df.index)
+    # Vazios continuam NaN (astype(str) os transformaria em 'nan' em algumas versões do pandas)
+    cnpj = cnpj.map(str, na_action='ignore').astype(object)
+    cnpj = cnpj.where(cnpj.str.strip() != '')
+    if mapa_cnpj and 'origem_servidor' in df:
+        origem = df['origem_servidor'].map(str)
+        por_origem = {}
+        for valor in origem.unique():
+            por_origem[valor] = next((cnpj_mapa for padrao_mapa, cnpj_mapa in mapa_cnpj.items()
+                                      if fnmatch.fnmatchcase(valor, padrao_mapa)), None)
+        cnpj = cnpj.fillna(origem.map(por_origem))
+    return cnpj.fillna(padrao).str.replace(r'[\s./-]', '', regex=True).str.zfill(14)
+
+
+def caminho_por_cnpj(caminho_saida, cnpj):
+    base, extensao = os.path.splitext(caminho_saida)
+    # escritores_por_cnpj só aceita 14 dígitos; a troca protege os outros usos
+    return f"{base}_{re.sub(r'[^0-9A-Za-z]', '_', cnpj)}{extensao}"
+
+
+def escritores_por_cnpj(caminho_saida, constantes, cnpjs, gerar_cnab240, classe_banrisul=EscritorBanrisul,
+                        limite_registros=None, limite_bytes=None):
+    """
+    {cnpj: [escritor Banrisul, escritor CNAB 240 (com gerar_cnab240)]}, cada
+    um com o CNPJ nas constantes. Com um só CNPJ os arquivos têm os nomes de
+    sempre; com vários, '<saida>_<cnpj>.txt' (e '<saida>_<cnpj>_cnab240.txt').
+    Com limite de registros ou de bytes, cada saída é dividida em partes (EscritorEmPartes).
+    Um CNPJ que não tenha exatamente 14 dígitos não cabe no campo do leiaute: ValueError.
+    """
+    invalidos = [cnpj for cnpj in cnpjs if not re.fullmatch(r'\d{14}', cnpj)]
+    if invalidos:
+        raise ValueError(f"CNPJ pagador inválido (precisa ter 14 dígitos): {', '.join(invalidos)}")
+
+    def escritor(classe, caminho, constantes_cnpj):
+        if limite_registros or limite_bytes:
+            return EscritorEmPartes(classe, caminho, constantes_cnpj, limite_registros, limite_bytes)
+        return classe(caminho, constantes_cnpj)
+
+    escritores = {}
+    for cnpj in cnpjs:
+        caminho = caminho_saida if len(cnpjs) == 1 else caminho_por_cnpj(caminho_saida, cnpj)
+        constantes_cnpj = {**constantes, 'CNPJ_PAGADOR': cnpj}
+        escritores[cnpj] = [escritor(classe_banrisul, caminho, constantes_cnpj)]
+        if gerar_cnab240:
+            escritores[cnpj].append(escritor(EscritorCnab240, os.path.splitext(caminho)[0] + '_cnab240.txt',
+                                             constantes_cnpj))
+    return escritores
+
+
+# ==============================================================================
+#  EMPRESA PAGADORA E NSA DO CNAB 240 (configuráveis)
+# ==============================================================================
+
+ARQUIVO_EMPRESA_CNAB240 = 'empresa_cnab240.json'
+# Campos obrigatórios e tamanho máximo no header (agência e conta só com dígitos)
+CAMPOS_EMPRESA_CNAB240 = {'convenio': 20, 'agencia': 5, 'conta': 12, 'nome': 30}
+NSA_MAXIMO = 999999  # Campo de 6 dígitos: depois dele a numeração recomeça em 1
+
+
+def validar_empresa_cnab240(dados):
+    """
+    Normaliza os dados da empresa pagadora ({campo: texto}, mais 'nsa_inicial').
+    Levanta ValueError com os campos vazios ou inválidos: uma remessa com a
+    empresa em branco é recusada pelo banco.
+    """
+    empresa = {campo: str(dados.get(campo) or '').strip() for campo in CAMPOS_EMPRESA_CNAB240}
+    problemas = [campo for campo, valor in empresa.items() if not valor]
+    problemas += [campo for campo in ('agencia', 'conta')
+                  if empresa[campo] and not (empresa[campo].isdigit()
+                                             and len(empresa[campo]) <= CAMPOS_EMPRESA_CNAB240[campo])]
+    problemas += [campo for campo in ('convenio', 'nome') if len(empresa[campo]) > CAMPOS_EMPRESA_CNAB240[campo]]
+    try:
+        empresa['nsa_inicial'] = int(dados.get('nsa_inicial', 1))
+    except (TypeError, ValueError):
+        empresa['nsa_inicial'] = 0
+    if not 1 <= empresa['nsa_inicial'] <= NSA_MAXIMO:
+        problemas.append('nsa_inicial')
+    if problemas:
+        raise ValueError(f"CNAB 240: dados da empresa pagadora ausentes ou inválidos ({', '.join(problemas)}); "
+                         f"configure-os em '{ARQUIVO_EMPRESA_CNAB240}' (ver carregar_empresa_cnab240).")
+    return empresa
+
+
+def carregar_empresa_cnab240(caminho=None):
+    """
+    Lê os dados da empresa pagadora no banco da remessa CNAB 240 (fornecidos
+    pelo banco). Procura, nesta ordem: o caminho informado, a variável
+    LEOPOLDO_EMPRESA_CNAB240 e 'empresa_cnab240.json' ao lado do programa.
+    O arquivo é um JSON {"convenio": ..., "agencia": ..., "conta": ...,
+    "nome": ..., "nsa_inicial": 1}; sem arquivo, ValueError (validar_empresa_cnab240).
+    """
+    caminho = localizar_configuracao(caminho, 'LEOPOLDO_EMPRESA_CNAB240', ARQUIVO_EMPRESA_CNAB240)
+    if caminho is None:
+        return validar_empresa_cnab240({})
+    with open(caminho, encoding='utf-8') as f:
+        return validar_empresa_cnab240(json.load(f))
+
+
+class SequenciaCnab240:
+    """
+    Número sequencial do arquivo (NSA) CNAB 240, por CNPJ pagador, guardado
+    no banco SQLite do histórico. Cada arquivo gerado reserva o seu número na
+    abertura, mesmo com o histórico de processamentos desligado: o banco
+    recusa uma remessa com NSA repetido, e um número reservado por um
+    processamento que falhou só deixa um salto na sequência.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or caminho_historico()
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute("CREATE TABLE IF NOT EXISTS nsa_cnab240 (cnpj TEXT PRIMARY KEY, ultimo INTEGER NOT NULL)")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def ultimo(self, cnpj):
+        with self._conectar() as conexao:
+            linha = conexao.execute("SELECT ultimo FROM nsa_cnab240 WHERE cnpj = ?", (cnpj,)).fetchone()
+        return linha[0] if linha else None
+
+    def proximo(self, cnpj, inicial=1):
+        """Reserva e retorna o próximo NSA do CNPJ (o primeiro é `inicial`)."""
+        with self._conectar() as conexao:
+            # Uma transação só: dois processamentos ao mesmo tempo não recebem o mesmo número
+            conexao.execute(
+                "INSERT INTO nsa_cnab240 (cnpj, ultimo) VALUES (?, ?)"
+                " ON CONFLICT (cnpj) DO UPDATE SET ultimo = ultimo % ? + 1",
+                (cnpj, inicial, NSA_MAXIMO))
+            return conexao.execute("SELECT ultimo FROM nsa_cnab240 WHERE cnpj = ?", (cnpj,)).fetchone()[0]
+
+
+# ==============================================================================
+#  VALIDAÇÃO PRÉVIA (máscaras sobre o DataFrame inteiro)
+# ==============================================================================
+
+# Caracteres aceitos pelo banco no nome
+PADRAO_CARACTERES_NOME = f"[{CARACTERES_BANCO}]*"
+LARGURAS_BANCARIAS = {'banco': 3, 'agencia': 4, 'conta': 10}
+
+
+def validar_dados(df, data_pagamento, regras=(), primeiro_registro=1):
+    """
+    Confere largura, conjunto de caracteres e restrições numéricas de todos os
+    campos do DataFrame final, uma máscara booleana por regra sobre a coluna
+    inteira. Retorna um DataFrame com uma linha por problema: severidade
+    ('erro' ou 'aviso'), campo, problema, registro (posição na saída, a partir
+    de 1), cpf, nome, valor e origem (planilha::aba de onde veio o servidor).
+
+    Para validar em blocos, primeiro_registro é a posição da primeira linha do
+    bloco; a data do pagamento só é conferida no primeiro bloco.
+    """
+    registro = pd.Series(np.arange(primeiro_registro, primeiro_registro + len(df)), index=df.index)
+    origem = df['origem_servidor'] if 'origem_servidor' in df else pd.Series('', index=df.index)
+    nome = df['nome'].map(str)
+    cpf = df['cpf'].map(str).str.strip()
+    problemas = []
+
+    def registrar(mascara, severidade, campo, problema, valores):
+        if mascara.any():
+            problemas.append(pd.DataFrame({
+                'severidade': severidade,
+                'campo': campo,
+                'problema': problema,
+                'registro': registro[mascara],
+                'cpf': cpf[mascara],
+                'nome': nome[mascara],
+                'valor': valores[mascara].map(str),
+                'origem': origem[mascara],
+            }))
+
+    # --- Data do pagamento (vale para o arquivo inteiro) ---
+    if primeiro_registro == 1 and (pd.isna(pd.to_datetime(data_pagamento, format='%Y%m%d', errors='coerce'))
+                                   or len(data_pagamento) != 8):
+        problemas.append(pd.DataFrame([{
+            'severidade': 'erro', 'campo': 'data_pagamento', 'problema': 'data inválida (esperado AAAAMMDD)',
+            'registro': 0, 'cpf': '', 'nome': '', 'valor': data_pagamento, 'origem': '',
+        }]))
+
+    # --- Nome ---
+    registrar(df['nome'].isna(), 'erro', 'nome', 'nome vazio', nome)
+    registrar(nome.str.len() > 46, 'aviso', 'nome', 'maior que 46 caracteres (será truncado)', nome)
+    registrar(df['nome'].notna() & ~nome.str.fullmatch(PADRAO_CARACTERES_NOME), 'aviso', 'nome',
+              'caracteres fora do padrão do banco (acentos, minúsculas ou símbolos; serão convertidos)', nome)
+
+    # --- CPF ---
+    registrar(~cpf.str.fullmatch(r'\d{1,11}'), 'erro', 'cpf', 'não numérico ou maior que 11 dígitos', cpf)
+
+    # --- Dados bancários (já com as regras de contas aplicadas) ---
+    if 'regra_conta' in df:
+        conta = df['conta'].map(str)
+        for regra in regras:
+            registrar(df['regra_conta'] == regra.nome, 'aviso', 'conta',
+                      f"regra '{regra.nome}': {regra.descricao}", conta)
+    for campo, largura in LARGURAS_BANCARIAS.items():
+        valores = df[campo].map(str).str.strip()
+        registrar(~valores.str.fullmatch(r'\d+'), 'erro', campo, 'não numérico', valores)
+        registrar(valores.str.len() > largura, 'erro', campo, f'maior que {largura} dígitos', valores)
+
+    # --- CNPJ pagador (por linha, ver resolver_cnpj_pagador) ---
+    if 'cnpj_pagador' in df:
+        cnpj_pagador = df['cnpj_pagador'].map(str)
+        registrar(~cnpj_pagador.str.fullmatch(r'\d{14}'), 'erro', 'cnpj_pagador', 'não numérico ou diferente de 14 dígitos',
+                  cnpj_pagador)
+
+    # --- Matrícula ---
+    matricula = _texto_matricula(df['matricula'])
+    registrar(df['matricula'].isna(), 'aviso', 'matricula', 'matrícula vazia (gravada como 0)', matricula)
+    registrar(~matricula.str.fullmatch(r'\d+'), 'erro', 'matricula', 'não numérica', matricula)
+    registrar(matricula.str.len() > 15, 'erro', 'matricula', 'maior que 15 dígitos', matricula)
+
+    # --- Salário ---
+    salario = pd.to_numeric(df['salario'], errors='coerce')
+    registrar(df['salario'].isna(), 'aviso', 'salario', 'salário vazio (gravado como zero)', df['salario'])
+    registrar(df['salario'].notna() & salario.isna(), 'erro', 'salario', 'não numérico', df['salario'])
+    registrar(salario < 0, 'erro', 'salario', 'valor negativo', salario)
+    registrar(salario.abs() >= 10 ** 15, 'erro', 'salario', 'maior que 15 dígitos', salario)
+    registrar(salario.notna() & (salario != np.trunc(salario)), 'aviso', 'salario',
+              'valor com casas decimais (parte fracionária descartada)', salario)
+
+    colunas = ['severidade', 'campo', 'problema', 'registro', 'cpf', 'nome', 'valor', 'origem']
+    if not problemas:
+        return pd.DataFrame(columns=colunas)
+    relatorio = pd.concat(problemas, ignore_index=True)[colunas]
+    relatorio['severidade'] = pd.Categorical(relatorio['severidade'], categories=['erro', 'aviso'], ordered=True)
+    return relatorio.sort_values(['severidade', 'registro'], kind='stable', ignore_index=True)
+
+
+def registrar_validacao(relatorio, caminho_saida, status_callback, interativo, bloquear_em_erro):
+    """
+    Grava o relatório em '<saida>_validacao.csv' e publica o resumo. Havendo
+    erros, pergunta se deve continuar (ou usa bloquear_em_erro sem interface).
+    Retorna a mensagem de falha se a geração deve parar, senão None.
+    """
+    if relatorio.empty:
+        return None
+    caminho_validacao = os.path.splitext(caminho_saida)[0] + '_validacao.csv'
+    relatorio.to_csv(caminho_validacao, sep=';', index=False, encoding='utf-8-sig')
+    erros = int((relatorio['severidade'] == 'erro').sum())
+    for linha in resumir_validacao(relatorio):
+        status_callback(linha)
+    status_callback(f"Validação: {erros} erro(s), {len(relatorio) - erros} aviso(s). "
+                    f"Relatório em {caminho_validacao}")
+    if erros:
+        if interativo:
+            prosseguir = messagebox.askyesno(
+                "Validação",
+                f"Foram encontrados {erros} erro(s) nos dados.\n"
+                f"Detalhes em:\n{caminho_validacao}\n\nGerar o arquivo mesmo assim?")
+        else:
+            prosseguir = not bloquear_em_erro
+        if not prosseguir:
+            falha = f"Geração bloqueada pela validação ({erros} erros)"
+            status_callback(falha + ".")
+            return falha
+    return None
+
+
+def resumir_validacao(relatorio):
+    """Uma linha por tipo de problema, com a contagem (erros primeiro)."""
+    contagem = relatorio.groupby(['severidade', 'campo', 'problema'], sort=True, observed=True).size()
+    return [f"{severidade.upper()} {campo}: {problema} ({quantidade})"
+            for (severidade, campo, problema), quantidade in contagem.items()]
+
+
+# ==============================================================================
+#  CONTAS NÃO ENCONTRADAS (sugestões por fragmentos de CPF e trigramas do nome)
+# ==============================================================================
+
+MAXIMO_SUGESTOES = 3            # Candidatos listados por servidor
+SEMELHANCA_MINIMA_NOME = 0.75   # Coeficiente de Dice entre os trigramas dos nomes
+CANDIDATOS_POR_NOME = 10        # Pares por servidor que passam para o cálculo exato da semelhança
+# Trigramas presentes em mais contas que isso (' DA', 'SIL'...) não selecionam candidatos
+FREQUENCIA_MAXIMA_TRIGRAMA = 1000
+LINHAS_POR_BLOCO_TRIGRAMAS = 50000
+POTENCIAS_CPF = 10 ** np.arange(10, -1, -1, dtype=np.int64)  # Peso de cada dígito do CPF, da esquerda
+
+
+def _cpfs_inteiros(cpfs):
+    """CPF como inteiro (só os dígitos, até 11); -1 quando não há CPF utilizável."""
+    digitos = cpfs.map(str, na_action='ignore').astype(object).str.replace(r'\D', '', regex=True)
+    digitos = digitos.where(digitos.str.len().between(1, 11))
+    return pd.to_numeric(digitos, errors='coerce').fillna(-1).astype(np.int64).to_numpy()
+
+
+def _chaves_sem_um_digito(cpfs):
+    """
+    11 chaves por CPF: o CPF com um dos dígitos zerado, combinado com a
+    posição. Dois CPFs diferentes só têm uma chave em comum quando diferem
+    em exatamente um dígito.
+    """
+    digitos = (cpfs[:, None] // POTENCIAS_CPF) % 10
+    return ((cpfs[:, None] - digitos * POTENCIAS_CPF) * 16 + np.arange(11)).ravel()
+
+
+def _cpfs_com_vizinhos_trocados(cpfs):
+    """(linha, cpf) de cada CPF com um par de dígitos vizinhos (diferentes) trocado."""
+    digitos = (cpfs[:, None] // POTENCIAS_CPF) % 10
+    esquerdo, direito = digitos[:, :-1], digitos[:, 1:]
+    trocados = cpfs[:, None] + (direito - esquerdo) * POTENCIAS_CPF[:-1] + (esquerdo - direito) * POTENCIAS_CPF[1:]
+    linhas = np.broadcast_to(np.arange(len(cpfs))[:, None], trocados.shape)
+    diferentes = esquerdo != direito
+    return linhas[diferentes], trocados[diferentes]
+
+
+def _nomes_comparaveis(nomes):
+    """Nomes no conjunto do banco, com um espaço no começo e no fim e sem espaços repetidos."""
+    return ' ' + normalizar_nomes_banco(nomes).fillna('').str.split().str.join(' ') + ' '
+
+
+def _trigramas(nomes, linhas=None):
+    """
+    DataFrame (linha, codigo) com os trigramas distintos de cada nome
+    (_nomes_comparaveis), cada trigrama codificado como um inteiro de 3 bytes.
+    `linhas` numera os nomes (padrão: posição).
+    """
+    linhas = np.arange(len(nomes)) if linhas is None else np.asarray(linhas)
+    textos = nomes.to_numpy(dtype=str).astype(np.bytes_)
+    largura = textos.dtype.itemsize
+    if not len(textos) or largura < 3:
+        return pd.DataFrame({'linha': np.empty(0, dtype=linhas.dtype), 'codigo': np.empty(0, dtype=np.int32)})
+    matriz = np.frombuffer(textos.tobytes(), dtype=np.uint8).reshape(len(textos), largura).astype(np.int32)
+    codigos = (matriz[:, :-2] << 16) | (matriz[:, 1:-1] << 8) | matriz[:, 2:]
+    presentes = matriz[:, 2:] != 0  # Os bytes nulos completam os nomes mais curtos
+    trigramas = pd.DataFrame({
+        'linha': np.broadcast_to(linhas[:, None], codigos.shape)[presentes],
+        'codigo': codigos[presentes],
+    })
+    return trigramas.drop_duplicates(ignore_index=True)
+
+
+def _semelhanca(nome, outro):
+    """Coeficiente de Dice entre os trigramas de dois nomes já comparáveis."""
+    a = {nome[i:i + 3] for i in range(len(nome) - 2)}
+    b = {outro[i:i + 3] for i in range(len(outro) - 2)}
+    return 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+
+
+def _pares_por_nome(nomes_servidores, nomes_contas):
+    """
+    Pares (linha_servidor, linha_conta) com nomes parecidos. O índice
+    invertido de trigramas seleciona os candidatos de todos os servidores
+    de uma vez: as contas são percorridas em blocos e só os trigramas que
+    aparecem em algum nome de servidor são guardados. Os trigramas comuns
+    demais são ignorados na seleção, e só os CANDIDATOS_POR_NOME pares com
+    mais trigramas em comum têm a semelhança (Dice) calculada.
+    """
+    servidores = _trigramas(nomes_servidores).rename(columns={'linha': 'linha_servidor'})
+    procurados = servidores['codigo'].unique()
+    total_servidores = np.bincount(servidores['linha_servidor'], minlength=len(nomes_servidores))
+    total_contas = np.zeros(len(nomes_contas), dtype=np.int64)
+    blocos = []
+    for inicio in range(0, len(nomes_contas), LINHAS_POR_BLOCO_TRIGRAMAS):
+        bloco = _trigramas(nomes_contas.iloc[inicio:inicio + LINHAS_POR_BLOCO_TRIGRAMAS],
+                           np.arange(inicio, min(inicio + LINHAS_POR_BLOCO_TRIGRAMAS, len(nomes_contas))))
+        total_contas += np.bincount(bloco['linha'], minlength=len(nomes_contas))
+        blocos.append(bloco[np.isin(bloco['codigo'].to_numpy(), procurados)])
+    contas = pd.concat(blocos, ignore_index=True).rename(columns={'linha': 'linha_conta'}) if blocos else \
+        pd.DataFrame(columns=['linha_conta', 'codigo'])
+    frequencia = contas['codigo'].value_counts()
+    comuns = frequencia.index[frequencia > FREQUENCIA_MAXIMA_TRIGRAMA]
+    pares = servidores[~servidores['codigo'].isin(comuns)].merge(contas[~contas['codigo'].isin(comuns)], on='codigo')
+    # Contagem por par sobre uma chave inteira única (servidor * contas + conta)
+    chaves, quantidades = np.unique(pares['linha_servidor'].to_numpy() * len(nomes_contas) + pares['linha_conta'].to_numpy(),
+                               return_counts=True)
+    pares = pd.DataFrame({'linha_servidor': chaves // len(nomes_contas), 'linha_conta': chaves % len(nomes_contas),
+                          'em_comum': quantidades})
+    pares = pares.sort_values(['linha_servidor', 'em_comum'], ascending=[True, False], kind='stable')
+    pares = pares.groupby('linha_servidor', sort=False).head(CANDIDATOS_POR_NOME)[['linha_servidor', 'linha_conta']]
+    # Semelhança exata dos pares escolhidos, agora contando também os trigramas comuns
+    em_comum = (pares.merge(servidores, on='linha_servidor').merge(contas, on=['linha_conta', 'codigo'])
+                .groupby(['linha_servidor', 'linha_conta'], sort=False).size().rename('em_comum').reset_index())
+    semelhanca = 2 * em_comum['em_comum'] / (total_servidores[em_comum['linha_servidor']]
+                                             + total_contas[em_comum['linha_conta']])
+    return em_comum.loc[semelhanca >= SEMELHANCA_MINIMA_NOME, ['linha_servidor', 'linha_conta']]
+
+
+def sugerir_contas(servidores, contas, maximo=MAXIMO_SUGESTOES):
+    """
+    Sugestões de conta para os servidores cujo CPF não está no arquivo de
+    contas. Os candidatos são as contas cujo CPF não é de nenhum servidor,
+    procurados em lote (junções sobre chaves inteiras, sem comparar todos
+    com todos):
+      - CPF com um dígito diferente (11 chaves por CPF, ver _chaves_sem_um_digito),
+        ou o mesmo número sem os zeros à esquerda;
+      - CPF com dois dígitos vizinhos trocados;
+      - nome parecido (trigramas), quando o arquivo de contas tem o nome do titular.
+    Retorna um DataFrame com uma linha por servidor sem conta e candidato
+    (até `maximo`, os melhores primeiro); quem não tem candidato aparece com
+    as colunas da conta vazias.
+    """
+    sem_conta = servidores.loc[~servidores['cpf'].isin(contas['cpf'])].reset_index(drop=True)
+    livres = contas.loc[~contas['cpf'].isin(servidores['cpf'])].reset_index(drop=True)
+    colunas_conta = ['cpf_conta', 'nome_conta', 'banco', 'agencia', 'conta', 'origem_conta']
+    colunas = ['cpf', 'nome', 'matricula', 'origem_servidor', *colunas_conta, 'motivo', 'semelhanca_nome']
+    if sem_conta.empty:
+        return pd.DataFrame(columns=colunas)
+
+    encontrados = []
+    cpfs_servidores, cpfs_contas = _cpfs_inteiros(sem_conta['cpf']), _cpfs_inteiros(livres['cpf'])
+    com_cpf_servidores, com_cpf_contas = np.flatnonzero(cpfs_servidores >= 0), np.flatnonzero(cpfs_contas >= 0)
+    if len(com_cpf_servidores) and len(com_cpf_contas):
+        chaves_servidores = pd.DataFrame({'linha_servidor': np.repeat(com_cpf_servidores, 11),
+                                          'chave': _chaves_sem_um_digito(cpfs_servidores[com_cpf_servidores])})
+        chaves_contas = pd.DataFrame({'linha_conta': np.repeat(com_cpf_contas, 11),
+                                      'chave': _chaves_sem_um_digito(cpfs_contas[com_cpf_contas])})
+        pares = chaves_servidores.merge(chaves_contas, on='chave')[['linha_servidor', 'linha_conta']].drop_duplicates()
+        # Todas as chaves iguais: o mesmo número, escrito de outro jeito (sem os zeros à esquerda)
+        iguais = cpfs_servidores[pares['linha_servidor'].to_numpy()] == cpfs_contas[pares['linha_conta'].to_numpy()]
+        encontrados.append(pares[iguais].assign(motivo='mesmo CPF com outra formatação'))
+        encontrados.append(pares[~iguais].assign(motivo='CPF com um dígito diferente'))
+        linhas, trocados = _cpfs_com_vizinhos_trocados(cpfs_servidores[com_cpf_servidores])
+        encontrados.append(
+            pd.DataFrame({'linha_servidor': com_cpf_servidores[linhas], 'cpf': trocados})
+            .merge(pd.DataFrame({'linha_conta': com_cpf_contas, 'cpf': cpfs_contas[com_cpf_contas]}), on='cpf')
+            [['linha_servidor', 'linha_conta']].assign(motivo='CPF com dígitos vizinhos trocados'))
+
+    tem_nomes = 'nome_conta' in livres and livres['nome_conta'].notna().any()
+    if tem_nomes:
+        nomes_servidores, nomes_contas = _nomes_comparaveis(sem_conta['nome']), _nomes_comparaveis(livres['nome_conta'])
+        encontrados.append(_pares_por_nome(nomes_servidores, nomes_contas).assign(motivo='nome parecido'))
+
+    encontrados = [parte for parte in encontrados if not parte.empty]
+    pares = pd.concat(encontrados, ignore_index=True) if encontrados else \
+        pd.DataFrame(columns=['linha_servidor', 'linha_conta', 'motivo'])
+    pares = pares.groupby(['linha_servidor', 'linha_conta'], sort=False)['motivo'].agg(' + '.join).reset_index()
+    if tem_nomes and not pares.empty:
+        pares['semelhanca_nome'] = [round(_semelhanca(nomes_servidores.iat[s], nomes_contas.iat[c]), 2)
+                                    for s, c in zip(pares['linha_servidor'], pares['linha_conta'])]
+    else:
+        pares['semelhanca_nome'] = np.nan
+    # CPF e nome juntos vêm antes; depois a maior semelhança do nome
+    pares['_pontos'] = (pares['motivo'].str.count('CPF') + pares['motivo'].str.contains('mesmo CPF')
+                        + pares['semelhanca_nome'].fillna(0))
+    pares = pares.sort_values(['linha_servidor', '_pontos'], ascending=[True, False], kind='stable')
+    pares = pares.groupby('linha_servidor', sort=False).head(maximo)
+
+    conta = livres.rename(columns={'cpf': 'cpf_conta'}).reindex(columns=colunas_conta)
+    sugestoes = pares.join(conta, on='linha_conta')
+    servidor = sem_conta.reindex(columns=['cpf', 'nome', 'matricula', 'origem_servidor'])
+    servidor['matricula'] = _texto_matricula(servidor['matricula'])
+    sugestoes = servidor.join(sugestoes.set_index('linha_servidor'), how='left')
+    sugestoes = sugestoes.sort_values(['nome', '_pontos'], ascending=[True, False], na_position='last', kind='stable')
+    return sugestoes.reindex(columns=colunas).reset_index(drop=True)
+
+
+def registrar_sugestoes(sugestoes, caminho_saida, status_callback):
+    """Grava as sugestões em '<saida>_sugestoes_contas.csv' e publica o resumo."""
+    if sugestoes.empty:
+        return None
+    caminho_sugestoes = os.path.splitext(caminho_saida)[0] + '_sugestoes_contas.csv'
+    sugestoes.to_csv(caminho_sugestoes, sep=';', index=False, encoding='utf-8-sig', decimal=',')
+    servidores = sugestoes.drop_duplicates(subset=['cpf', 'nome', 'matricula'])
+    com_sugestao = servidores['motivo'].notna().sum()
+    status_callback(f"Sem conta: {len(servidores)} servidor(es), {com_sugestao} com sugestão de conta. "
+                    f"Sugestões em {caminho_sugestoes}")
+    return caminho_sugestoes
+
+
+# ==============================================================================
+#  HISTÓRICO DE PROCESSAMENTOS (SQLite, checkpoints e retomada)
+# ==============================================================================
+
+def caminho_historico():
+    """Banco SQLite do histórico (LEOPOLDO_HISTORICO ou ~/.leopoldo/processamentos.db)."""
+    caminho = os.environ.get('LEOPOLDO_HISTORICO')
+    if caminho:
+        return caminho
+    return os.path.join(os.path.expanduser('~'), '.leopoldo', 'processamentos.db')
+
+
+def assinatura_entradas(*partes):
+    """
+    Identifica um processamento pelos parâmetros e pelo tamanho/data de
+    modificação dos arquivos de entrada: mesma assinatura, mesma saída.
+    """
+    hash_ = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, (list, tuple)):
+            hash_.update(assinatura_entradas(*parte).encode('ascii'))
+            continue
+        if isinstance(parte, str) and os.path.isfile(arquivo_fisico(parte)):
+            # Membro de .zip: vale o tamanho/data do pacote
+            estado = os.stat(arquivo_fisico(parte))
+            parte = f"{os.path.abspath(parte)}|{estado.st_size}|{estado.st_mtime_ns}"
+        hash_.update(repr(parte).encode('utf-8'))
+    return hash_.hexdigest()
+
+
+def conteudo_configuracao(caminho):
+    """
+    Resumo (sha256) do conteúdo de um arquivo de configuração pequeno (regras,
+    mapa de CNPJ) para a assinatura: mudar uma regra muda a saída, mesmo que o
+    arquivo tenha o mesmo tamanho e a mesma data.
+    """
+    if not caminho or not os.path.isfile(caminho):
+        return caminho
+    with open(caminho, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class HistoricoProcessamentos:
+    """
+    Tabela de processamentos (duração, situação, última etapa concluída) e de
+    checkpoints por arquivo de saída. Cada operação abre a sua conexão, então
+    as threads de gravação podem registrar checkpoints sem compartilhar estado.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or caminho_historico()
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.executescript("""
+                CREATE TABLE IF NOT EXISTS processamentos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    assinatura TEXT NOT NULL,
+                    caminho_servidor TEXT,
+                    caminho_conta TEXT,
+                    caminho_saida TEXT,
+                    data_pagamento TEXT,
+                    iniciado_em TEXT NOT NULL,
+                    finalizado_em TEXT,
+                    duracao_s REAL,
+                    situacao TEXT NOT NULL,
+                    etapa TEXT,
+                    registros INTEGER,
+                    mensagem TEXT
+                );
+                CREATE INDEX IF NOT EXISTS ix_processamentos_assinatura ON processamentos (assinatura);
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    processamento_id INTEGER NOT NULL REFERENCES processamentos (id),
+                    arquivo TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    gravado_em TEXT NOT NULL,
+                    PRIMARY KEY (processamento_id, arquivo)
+                );
+            """)
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def iniciar(self, assinatura, caminho_servidor, caminho_conta, caminho_saida, data_pagamento):
+        """
+        Abre um processamento. Se o último com a mesma assinatura não terminou,
+        ele é retomado: retorna (id, {arquivo: estado do último checkpoint}).
+        """
+        agora = datetime.datetime.now().isoformat(timespec='seconds')
+        with self._conectar() as conexao:
+            anterior = conexao.execute(
+                "SELECT id, situacao FROM processamentos WHERE assinatura = ? ORDER BY id DESC LIMIT 1",
+                (assinatura,),
+            ).fetchone()
+            if anterior and anterior[1] != 'concluido':
+                checkpoints = {
+                    arquivo: json.loads(estado)
+                    for arquivo, estado in conexao.execute(
+                        "SELECT arquivo, estado FROM checkpoints WHERE processamento_id = ?", (anterior[0],)
+                    )
+                }
+                conexao.execute(
+                    "UPDATE processamentos SET situacao = 'em_andamento', iniciado_em = ?, mensagem = ? WHERE id = ?",
+                    (agora, f"Retomado ({anterior[1]})", anterior[0]),
+                )
+                return anterior[0], checkpoints
+            cursor = conexao.execute(
+                "INSERT INTO processamentos (assinatura, caminho_servidor, caminho_conta, caminho_saida,"
+                " data_pagamento, iniciado_em, situacao) VALUES (?, ?, ?, ?, ?, ?, 'em_andamento')",
+                (assinatura, caminho_servidor, caminho_conta, caminho_saida, data_pagamento, agora),
+            )
+            return cursor.lastrowid, {}
+
+    def etapa(self, processamento_id, etapa):
+        with self._conectar() as conexao:
+            conexao.execute("UPDATE processamentos SET etapa = ? WHERE id = ?", (etapa, processamento_id))
+
+    def checkpoint(self, processamento_id, arquivo, estado):
+        with self._conectar() as conexao:
+            conexao.execute(
+                "INSERT OR REPLACE INTO checkpoints (processamento_id, arquivo, estado, gravado_em) VALUES (?, ?, ?, ?)",
+                (processamento_id, arquivo, json.dumps(estado),
+                 datetime.datetime.now().isoformat(timespec='seconds')),
+            )
+
+    def finalizar(self, processamento_id, situacao, duracao_s, registros=None, mensagem=None):
+        with self._conectar() as conexao:
+            conexao.execute(
+                "UPDATE processamentos SET situacao = ?, finalizado_em = ?, duracao_s = ?, registros = ?,"
+                " mensagem = COALESCE(?, mensagem) WHERE id = ?",
+                (situacao, datetime.datetime.now().isoformat(timespec='seconds'), duracao_s,
+                 registros, mensagem, processamento_id),
+            )
+            if situacao == 'concluido':
+                conexao.execute("DELETE FROM checkpoints WHERE processamento_id = ?", (processamento_id,))
+
+    def ultimos(self, quantidade=20):
+        with self._conectar() as conexao:
+            return conexao.execute(
+                "SELECT id, iniciado_em, situacao, etapa, registros, duracao_s, caminho_saida, mensagem"
+                " FROM processamentos ORDER BY id DESC LIMIT ?", (quantidade,),
+            ).fetchall()
+
+
+# ==============================================================================
+#  ARQUIVO HISTÓRICO DA FOLHA (Parquet particionado por data e CNPJ)
+# ==============================================================================
+
+def caminho_arquivo_folha():
+    """Pasta do arquivo histórico (LEOPOLDO_ARQUIVO ou 'arquivo_folha' ao lado do histórico)."""
+    caminho = os.environ.get('LEOPOLDO_ARQUIVO')
+    if caminho:
+        return caminho
+    return os.path.join(os.path.dirname(os.path.abspath(caminho_historico())), 'arquivo_folha')
+
+
+def _data_meses_atras(meses, hoje=None):
+    """AAAAMMDD do primeiro dia do mês `meses` meses antes de hoje."""
+    hoje = hoje or datetime.date.today()
+    ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - meses, 12)
+    return f"{ano:04d}{mes + 1:02d}01"
+
+
+class ArquivoFolha:
+    """
+    Arquivo colunar de todos os pagamentos gerados: um dataset Parquet
+    particionado (data_pagamento=AAAAMMDD/cnpj_pagador=...) com uma linha por
+    servidor, já cruzada e com os campos como saíram no arquivo (cpf com 11
+    dígitos, dados bancários com zeros à esquerda, salário em centavos).
+
+    Cada geração grava um arquivo na sua partição; gerar de novo a mesma
+    data/CNPJ substitui o anterior. O arquivo inteiro é ordenado por cpf (no
+    modo fora da memória, com uma OrdenacaoExterna passada a abrir), então as
+    estatísticas dos row groups deixam o filtro por cpf pular quase tudo, e o
+    filtro por data nem abre as outras partições.
+
+    Erros de gravação não interrompem o processamento: viram um aviso no
+    status_callback e o arquivo histórico é deixado de lado nesta execução.
+    """
+
+    COLUNAS = ('cpf', 'matricula', 'nome', 'banco', 'agencia', 'conta', 'salario_centavos',
+               'regra_conta', 'origem', 'arquivo')
+    LINHAS_POR_GRUPO = 65536
+
+    def __init__(self, pasta=None, status_callback=None):
+        self.pasta = pasta or caminho_arquivo_folha()
+        self.status_callback = status_callback or (lambda mensagem: None)
+        self.particionamento = pa_ds.partitioning(
+            pa.schema([('data_pagamento', pa.string()), ('cnpj_pagador', pa.string())]), flavor='hive')
+        self.esquema = pa.schema([(coluna, pa.int64() if coluna == 'salario_centavos' else pa.string())
+                                  for coluna in self.COLUNAS])
+        self._gravador = None
+        self._ordenacao = None
+        self._arquivo_saida = None
+        self.registros = 0
+
+    def _pasta_particao(self, data_pagamento, cnpj):
+        return os.path.join(self.pasta, f"data_pagamento={data_pagamento}", f"cnpj_pagador={cnpj}")
+
+    def _falhar(self, erro):
+        self.status_callback(f"Aviso: arquivo histórico da folha indisponível ({erro}).")
+        self.descartar()
+
+    def abrir(self, data_pagamento, cnpj, arquivo_saida, ordenacao=None):
+        """
+        Começa o arquivo da partição. Com `ordenacao` (OrdenacaoExterna vazia),
+        os blocos de acrescentar são ordenados por ela e só vão para o Parquet
+        em concluir; sem ela, cada bloco é gravado na hora (um bloco só, ou
+        blocos que já chegam em ordem de cpf).
+        """
+        self._particao = self._pasta_particao(data_pagamento, cnpj)
+        self._ordenacao = ordenacao
+        # '_' no início: o dataset ignora o arquivo enquanto ele não termina
+        self._parcial = os.path.join(self._particao, f"_{os.getpid()}_{threading.get_ident()}.parquet.parcial")
+        self._arquivo_saida = os.path.basename(arquivo_saida)
+        self.registros = 0
+        try:
+            os.makedirs(self._particao, exist_ok=True)
+            self._gravador = pa_pq.ParquetWriter(self._parcial, self.esquema, compression='zstd')
+        except (OSError, pa.ArrowException) as e:
+            self._falhar(e)
+
+    def acrescentar(self, df):
+        """Acrescenta um bloco do DataFrame final (nomes já convertidos)."""
+        if self._gravador is None or df.empty:
+            return
+        campos = extrair_campos_vetorizado(df)
+        tabela = pd.DataFrame({
+            'cpf': campos['cpf'].str.rjust(11, '0'),
+            'matricula': _normalizar_matriculas(campos['matricula']).to_numpy(),
+            'nome': campos['nome'],
+            'banco': campos['banco'].str.rjust(3, '0'),
+            'agencia': campos['agencia'].str.rjust(4, '0'),
+            'conta': campos['conta'].str.rjust(10, '0'),
+            'salario_centavos': campos['salario'],
+            'regra_conta': df['regra_conta'].map(str) if 'regra_conta' in df else '',
+            'origem': df['origem_servidor'].map(str) if 'origem_servidor' in df else '',
+            'arquivo': self._arquivo_saida,
+        }).sort_values('cpf', kind='stable')
+        try:
+            if self._ordenacao is not None:
+                self._ordenacao.adicionar(tabela)
+            else:
+                self._gravar(tabela)
+        except (OSError, pa.ArrowException) as e:
+            self._falhar(e)
+            return
+        self.registros += len(tabela)
+
+    def _gravar(self, tabela):
+        self._gravador.write_table(pa.Table.from_pandas(tabela, schema=self.esquema, preserve_index=False),
+                                   row_group_size=self.LINHAS_POR_GRUPO)
+
+    def concluir(self):
+        """Fecha o arquivo e substitui o que havia na partição."""
+        if self._gravador is None:
+            return
+        destino = os.path.join(self._particao, f"{os.path.splitext(self._arquivo_saida)[0]}.parquet")
+        try:
+            if self._ordenacao is not None:
+                for tabela in self._ordenacao.blocos():
+                    self._gravar(tabela.drop(columns='_chave'))
+                self._ordenacao = None
+            self._gravador.close()
+            self._gravador = None
+            # Primeiro o arquivo novo entra no lugar; só então saem os das gerações anteriores
+            os.replace(self._parcial, destino)
+            for nome in os.listdir(self._particao):
+                caminho = os.path.join(self._particao, nome)
+                if nome.endswith('.parquet') and not nome.startswith('_') and caminho != destino:
+                    os.remove(caminho)
+        except (OSError, pa.ArrowException) as e:
+            self._falhar(e)
+            return
+        self.status_callback(f"Arquivo histórico: {self.registros} linhas em {self._particao}")
+
+    def descartar(self):
+        if self._gravador is not None:
+            try:
+                self._gravador.close()
+            except (OSError, pa.ArrowException):
+                pass
+            self._gravador = None
+        self._ordenacao = None
+        if self._arquivo_saida is not None and os.path.exists(self._parcial):
+            os.remove(self._parcial)
+
+    def arquivar(self, df, data_pagamento, cnpj, arquivo_saida):
+        self.abrir(data_pagamento, cnpj, arquivo_saida)
+        self.acrescentar(df)
+        self.concluir()
+
+    # --- Consultas ---
+
+    def consultar(self, filtro=None, colunas=None):
+        """Lê do dataset só as partições/row groups que podem satisfazer o filtro (expressão pyarrow)."""
+        if not os.path.isdir(self.pasta):
+            return pd.DataFrame(columns=[*self.COLUNAS, 'data_pagamento', 'cnpj_pagador'])
+        dataset = pa_ds.dataset(self.pasta, format='parquet', partitioning=self.particionamento)
+        return dataset.to_table(filter=filtro, columns=colunas).to_pandas()
+
+    def datas(self):
+        """Datas de pagamento arquivadas, em ordem."""
+        if not os.path.isdir(self.pasta):
+            return []
+        return sorted(nome.split('=', 1)[1] for nome in os.listdir(self.pasta) if nome.startswith('data_pagamento='))
+
+    def historico_cpf(self, cpf, meses=24):
+        """Pagamentos de um CPF nos últimos `meses` meses (salário, conta e origem), do mais antigo ao mais recente."""
+        cpf = _normalizar_cpfs([cpf]).iat[0]
+        filtro = (pa_ds.field('cpf') == cpf) & (pa_ds.field('data_pagamento') >= _data_meses_atras(meses))
+        df = self.consultar(filtro)
+        return df.sort_values(['data_pagamento', 'cnpj_pagador', 'matricula'], ignore_index=True)
+
+    def contas_alteradas(self, data_pagamento):
+        """
+        Servidores (cpf + matrícula) cuja conta em data_pagamento é diferente
+        da do pagamento arquivado imediatamente anterior.
+        """
+        anteriores = [data for data in self.datas() if data < data_pagamento]
+        if not anteriores:
+            return pd.DataFrame()
+        colunas = ['cpf', 'matricula', 'nome', 'banco', 'agencia', 'conta', 'cnpj_pagador']
+        atual = self.consultar(pa_ds.field('data_pagamento') == data_pagamento, colunas)
+        anterior = self.consultar(pa_ds.field('data_pagamento') == anteriores[-1], colunas)
+        df = atual.merge(anterior, on=['cpf', 'matricula', 'cnpj_pagador'], suffixes=('', '_anterior'))
+        alterada = ((df['banco'] != df['banco_anterior']) | (df['agencia'] != df['agencia_anterior'])
+                    | (df['conta'] != df['conta_anterior']))
+        df = df[alterada].drop(columns='nome_anterior')
+        df.insert(0, 'data_anterior', anteriores[-1])
+        return df.sort_values('nome', ignore_index=True)
+
+
+# ==============================================================================
+#  LEITURA DAS ENTRADAS (várias planilhas e abas, em paralelo)
+# ==============================================================================
+
+SEPARADOR_ENTRADAS = ';'
+SEPARADOR_ABA = '::'
+EXTENSOES_TEXTO = ('.csv', '.txt')
+EXTENSOES_ENTRADA = ('.xls', '.xlsx') + EXTENSOES_TEXTO
+EXTENSAO_PACOTE = '.zip'
+EXTENSOES_COMPACTADAS = ('.gz',)
+
+
+def dividir_pacote(caminho):
+    """('pacote.zip', 'pasta/membro.csv') para um membro de .zip; (caminho, None) para os demais."""
+    partes = re.match(r'(?i)^(.*?\.zip)[/\\](.+)$', caminho)
+    if partes and os.path.isfile(partes.group(1)):
+        return partes.group(1), partes.group(2).replace('\\', '/')
+    return caminho, None
+
+
+def extensao_entrada(caminho):
+    """Extensão do conteúdo da entrada: 'folha.csv.gz' -> '.csv'; 'pacote.zip/dados.xlsx' -> '.xlsx'."""
+    base, extensao = os.path.splitext(caminho.lower())
+    if extensao in EXTENSOES_COMPACTADAS:
+        extensao = os.path.splitext(base)[1]
+    return extensao
+
+
+def entrada_compactada(caminho):
+    return dividir_pacote(caminho)[1] is not None or os.path.splitext(caminho.lower())[1] in EXTENSOES_COMPACTADAS
+
+
+def membros_pacote(caminho):
+    """Planilhas e CSV/TXT de um .zip (sem pastas nem arquivos ocultos), em ordem de nome."""
+    with zipfile.ZipFile(caminho) as pacote:
+        return sorted(
+            info.filename for info in pacote.infolist()
+            if not info.is_dir() and extensao_entrada(info.filename) in EXTENSOES_ENTRADA
+            and not any(parte.startswith(('.', '__MACOSX')) for parte in info.filename.split('/')))
+
+
+def abrir_entrada(caminho):
+    """
+    Arquivo binário com o conteúdo da entrada. Um membro de .zip ou um .gz é
+    descompactado em streaming à medida que é lido, sem extrair para o disco;
+    os dois aceitam seek() (para trás, a descompactação recomeça do início).
+    """
+    arquivo, membro = dividir_pacote(caminho)
+    if membro is not None:
+        # O membro aberto mantém o .zip aberto até ser fechado
+        with zipfile.ZipFile(arquivo) as pacote:
+            return pacote.open(membro)
+    if os.path.splitext(arquivo.lower())[1] in EXTENSOES_COMPACTADAS:
+        return gzip.open(arquivo, 'rb')
+    return open(arquivo, 'rb')
+
+
+@contextlib.contextmanager
+def fonte_entrada(caminho):
+    """O próprio caminho de um arquivo comum, ou o fluxo descompactado de uma entrada compactada."""
+    if not entrada_compactada(caminho):
+        yield caminho
+        return
+    with abrir_entrada(caminho) as fluxo:
+        yield fluxo
+
+
+def arquivo_fisico(caminho):
+    """Arquivo em disco de uma entrada (o .zip, para um membro)."""
+    return dividir_pacote(caminho)[0]
+
+
+def expandir_entradas(caminhos):
+    """
+    Converte a especificação de entrada em uma lista de (caminho, abas).
+    Aceita um texto ou uma lista, com caminhos separados por ';'. Cada caminho
+    pode indicar abas: 'folha.xlsx::Saúde,Educação' ou 'folha.xlsx::*' (todas).
+    Sem indicação, lê só a primeira aba.
+
+    Entradas compactadas são lidas sem extração: 'folha.csv.gz', um membro
+    'pacote.zip/folha.xlsx' ou 'pacote.zip', que vira uma entrada por
+    planilha/CSV do pacote (com as mesmas abas).
+    """
+    if isinstance(caminhos, str):
+        caminhos = [caminhos]
+    entradas = []
+    for caminho in (parte for item in caminhos for parte in item.split(SEPARADOR_ENTRADAS)):
+        caminho = caminho.strip()
+        if not caminho:
+            continue
+        if SEPARADOR_ABA in caminho:
+            caminho, abas = caminho.rsplit(SEPARADOR_ABA, 1)
+            abas = None if abas.strip() == '*' else [aba.strip() for aba in abas.split(',')]
+        else:
+            abas = [0]
+        caminho = caminho.strip()
+        if caminho.lower().endswith(EXTENSAO_PACOTE) and zipfile.is_zipfile(caminho):
+            membros = membros_pacote(caminho)
+            if membros:
+                entradas.extend((f"{caminho}/{membro}", abas) for membro in membros)
+                continue
+        entradas.append((caminho, abas))
+    return entradas
+
+
+def descrever_entradas(entradas):
+    return "; ".join(caminho if abas == [0] else f"{caminho}{SEPARADOR_ABA}{'*' if abas is None else ','.join(abas)}"
+                     for caminho, abas in entradas)
+
+
+# Colunas que o leiaute usa de cada entrada, com o tipo forçado na leitura
+# (None = deixa o pandas inferir, como sempre foi). As demais colunas da
+# exportação do RH (cargo, lotação, endereço...) não são lidas.
+COLUNAS_SERVIDORES = {'cpf': str, 'nome': None, 'matricula': None, 'salario': None, 'cnpj_pagador': str}
+COLUNAS_CONTAS = {'cpf': str, 'banco': str, 'agencia': str, 'conta': str}
+# O nome do titular da conta só é lido para as sugestões de conta (sugerir_contas)
+COLUNAS_CONTAS_COM_NOME = {**COLUNAS_CONTAS, 'nome_conta': str}
+# Colunas que podem faltar na planilha: são lidas como vazias
+COLUNAS_OPCIONAIS = ('cnpj_pagador', 'nome_conta')
+
+# Outros nomes aceitos para cada coluna, já normalizados (ver normalizar_cabecalho)
+APELIDOS_COLUNAS = {
+    'nome': ('nome servidor', 'nome do servidor'),
+    'matricula': ('matr', 'mat'),
+    'salario': ('valor liquido', 'salario liquido'),
+    'banco': ('cod banco', 'codigo banco'),
+    'agencia': ('ag',),
+    'conta': ('conta corrente', 'cc'),
+    'cnpj_pagador': ('cnpj pagador', 'cnpj', 'cnpj empregador', 'cnpj orgao'),
+    'nome_conta': ('nome conta', 'titular', 'nome titular', 'nome do titular', 'favorecido', 'nome favorecido'),
+}
+
+
+def normalizar_cabecalho(texto):
+    """'Nº Matrícula ' -> 'matricula'; 'CPF' -> 'cpf'. Sem acentos, caixa ou prefixos de número."""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r'[^a-z0-9]+', ' ', texto).strip()
+    return re.sub(r'^(n|no|num|numero) ', '', texto)
+
+
+def resolver_colunas(cabecalhos, colunas, avisos=None):
+    """
+    Mapeia os cabeçalhos da planilha para os nomes do leiaute: {cabeçalho: nome}.
+    O nome exato da coluna vale mais que um apelido ('Salario' e 'Valor
+    Liquido': paga pelo 'Salario'). Levanta ValueError se dois cabeçalhos
+    servem para a mesma coluna obrigatória com a mesma prioridade, e KeyError
+    com o nome da primeira coluna obrigatória que não existir. As
+    COLUNAS_OPCIONAIS podem faltar; se forem ambíguas ('CNPJ' e 'CNPJ Orgao'),
+    ficam de fora, com a mensagem acrescentada a `avisos` (ver avisos_colunas).
+    """
+    exatos, por_apelido = {}, {}
+    for cabecalho in dict.fromkeys(cabecalhos):
+        normalizado = normalizar_cabecalho(cabecalho)
+        for nome in colunas:
+            if normalizado == normalizar_cabecalho(nome):  # 'Nome Conta' é o nome exato de 'nome_conta'
+                exatos.setdefault(nome, []).append(cabecalho)
+                break
+            if normalizado in APELIDOS_COLUNAS.get(nome, ()):
+                por_apelido.setdefault(nome, []).append(cabecalho)
+                break
+    mapa = {}
+    for nome in colunas:
+        candidatos = exatos.get(nome) or por_apelido.get(nome, [])
+        if len(candidatos) > 1:
+            mensagem = f"Colunas ambíguas para '{nome}': " + ", ".join(f"'{cabecalho}'" for cabecalho in candidatos)
+            if nome not in COLUNAS_OPCIONAIS:
+                raise ValueError(mensagem)
+            if avisos is not None:
+                avisos.append(f"{mensagem}; a coluna opcional foi ignorada")
+            continue
+        if candidatos:
+            mapa[candidatos[0]] = nome
+    for nome in colunas:
+        if nome not in mapa.values() and nome not in COLUNAS_OPCIONAIS:
+            raise KeyError(nome)
+    return mapa
+
+
+NS_PLANILHA = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_RELACOES = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+NS_DOCUMENTO = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _numero_xlsx(texto):
+    """Número como o pandas recebe do openpyxl: int quando não tem parte fracionária."""
+    if '.' in texto or 'E' in texto or 'e' in texto:
+        valor = float(texto)
+        return int(valor) if int(valor) == valor else valor
+    return int(texto)
+
+
+class PlanilhaXlsx:
+    """
+    Leitor de .xlsx que percorre o XML da aba em streaming e só converte as
+    células das colunas do leiaute; as demais são descartadas sem virar
+    objeto Python. Os valores são convertidos como o openpyxl + pandas fazem
+    (inteiros, datas pelo estilo da célula, erros como NaN) e o DataFrame sai
+    do mesmo TextParser do pd.read_excel, então o resultado é idêntico.
+    """
+
+    def __init__(self, caminho):
+        # caminho também pode ser um arquivo aberto (entrada compactada), fechado junto com a planilha
+        self._fonte = caminho if hasattr(caminho, 'read') else None
+        self.zip = zipfile.ZipFile(caminho)
+        try:
+            self._ler_pasta_de_trabalho()
+        except Exception:
+            self.zip.close()
+            raise
+        self._textos = None
+        self._datas = None
+
+    @classmethod
+    def abrir(cls, caminho):
+        """PlanilhaXlsx, ou None se o arquivo não for um .xlsx comum (ex.: .xls)."""
+        if not zipfile.is_zipfile(caminho):
+            return None
+        try:
+            planilha = cls(caminho)
+        except (KeyError, ET.ParseError):
+            return None
+        if not planilha.sheet_names:
+            planilha.close()
+            return None
+        return planilha
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+        if self._fonte is not None:
+            self._fonte.close()
+
+    def _xml(self, caminho):
+        with self.zip.open(caminho) as arquivo:
+            return ET.parse(arquivo).getroot()
+
+    def _relacoes(self, caminho_parte):
+        pasta, nome = posixpath.split(caminho_parte)
+        caminho_rels = posixpath.join(pasta, '_rels', nome + '.rels')
+        relacoes = {}
+        for rel in self._xml(caminho_rels).iter(NS_RELACOES + 'Relationship'):
+            alvo = rel.get('Target')
+            alvo = alvo.lstrip('/') if alvo.startswith('/') else posixpath.normpath(posixpath.join(pasta, alvo))
+            relacoes[rel.get('Id')] = (rel.get('Type', ''), alvo)
+        return relacoes
+
+    def _ler_pasta_de_trabalho(self):
+        documento = next(alvo for tipo, alvo in self._relacoes('').values() if tipo.endswith('/officeDocument'))
+        relacoes = self._relacoes(documento)
+        raiz = self._xml(documento)
+        propriedades = raiz.find(NS_PLANILHA + 'workbookPr')
+        data_1904 = propriedades is not None and propriedades.get('date1904') in ('1', 'true')
+        self.epoca = CALENDAR_MAC_1904 if data_1904 else CALENDAR_WINDOWS_1900
+        self.abas = {aba.get('name'): relacoes[aba.get(NS_DOCUMENTO + 'id')][1]
+                     for aba in raiz.iter(NS_PLANILHA + 'sheet')}
+        self.sheet_names = list(self.abas)
+        self.partes = {tipo.rsplit('/', 1)[-1]: alvo for tipo, alvo in relacoes.values()}
+
+    def textos_compartilhados(self):
+        if self._textos is None:
+            self._textos = []
+            caminho = self.partes.get('sharedStrings')
+            if caminho in self.zip.namelist():
+                with self.zip.open(caminho) as arquivo:
+                    for _, elemento in ET.iterparse(arquivo):
+                        if elemento.tag == NS_PLANILHA + 'si':
+                            self._textos.append(Text.from_tree(elemento).content.replace('x005F_', ''))
+                            elemento.clear()
+        return self._textos
+
+    def formatos_data(self):
+        """(estilos de data, estilos de duração): índices de cellXfs, como o openpyxl calcula."""
+        if self._datas is None:
+            datas, duracoes = set(), set()
+            caminho = self.partes.get('styles')
+            if caminho in self.zip.namelist():
+                raiz = self._xml(caminho)
+                formatos = dict(BUILTIN_FORMATS)
+                for formato in raiz.iter(NS_PLANILHA + 'numFmt'):
+                    formatos[int(formato.get('numFmtId'))] = formato.get('formatCode')
+                xfs = raiz.find(NS_PLANILHA + 'cellXfs')
+                for indice, xf in enumerate(xfs if xfs is not None else ()):
+                    codigo = formatos.get(int(xf.get('numFmtId', 0)))
+                    if codigo and is_date_format(codigo):
+                        datas.add(indice)
+                        if is_timedelta_format(codigo):
+                            duracoes.add(indice)
+            self._datas = (datas, duracoes)
+        return self._datas
+
+    def _valor(self, celula):
+        tipo = celula.get('t', 'n')
+        if tipo == 'inlineStr':
+            texto = celula.find(NS_PLANILHA + 'is')
+            return '' if texto is None else Text.from_tree(texto).content
+        valor = celula.findtext(NS_PLANILHA + 'v') or None
+        if valor is None:
+            return ''
+        if tipo == 'n':
+            estilo = int(celula.get('s', 0))
+            datas, duracoes = self.formatos_data()
+            if estilo in datas:
+                try:
+                    return from_excel(float(valor), self.epoca, timedelta=estilo in duracoes)
+                except (OverflowError, ValueError):
+                    return np.nan
+            return _numero_xlsx(valor)
+        if tipo == 's':
+            return self.textos_compartilhados()[int(valor)]
+        if tipo == 'b':
+            return bool(int(valor))
+        if tipo == 'd':
+            return from_ISO8601(valor)
+        if tipo == 'e':
+            return np.nan
+        return valor
+
+    def _celulas(self, linha):
+        """(índice da coluna a partir de 0, elemento) de cada célula da linha."""
+        coluna = -1
+        for celula in linha:
+            referencia = celula.get('r')
+            coluna = column_index_from_string(referencia.rstrip('0123456789')) - 1 if referencia else coluna + 1
+            yield coluna, celula
+
+    def _registros(self, aba, colunas):
+        """
+        Gera as linhas de dados de uma aba, cada uma uma lista na ordem de
+        `colunas` (a primeira linha da aba é o cabeçalho). Linhas vazias só são
+        entregues se houver dados depois delas: as do fim são descartadas, como
+        no leitor do pandas.
+        """
+        tag_linha = NS_PLANILHA + 'row'
+        posicoes = None
+        pendentes = []
+        proxima = 1
+        with self.zip.open(self.abas[aba]) as arquivo:
+            for _, elemento in ET.iterparse(arquivo):
+                if elemento.tag != tag_linha:
+                    continue
+                numero = int(elemento.get('r', proxima))
+                if posicoes is None:
+                    # Cabeçalho: a linha 1 da aba, mesmo que vazia (igual ao header=0 do pandas)
+                    cabecalhos = {} if numero != 1 else {
+                        coluna: self._valor(celula) for coluna, celula in self._celulas(elemento)}
+                    mapa = resolver_colunas([cabecalhos[c] for c in sorted(cabecalhos)], colunas)
+                    posicao_por_nome = {nome: i for i, nome in enumerate(colunas)}
+                    posicoes = {}
+                    for coluna in sorted(cabecalhos):
+                        nome = mapa.get(cabecalhos[coluna])
+                        if nome is not None and posicao_por_nome[nome] not in posicoes.values():
+                            posicoes[coluna] = posicao_por_nome[nome]
+                    if numero == 1:
+                        proxima = 2
+                        elemento.clear()
+                        continue
+                vazia = [''] * len(colunas)
+                pendentes.extend(list(vazia) for _ in range(proxima, numero))
+                registro = list(vazia)
+                for coluna, celula in self._celulas(elemento):
+                    if coluna in posicoes:
+                        registro[posicoes[coluna]] = self._valor(celula)
+                proxima = numero + 1
+                elemento.clear()
+                if all(valor == '' for valor in registro):
+                    pendentes.append(registro)
+                    continue
+                yield from pendentes
+                pendentes.clear()
+                yield registro
+        if posicoes is None:
+            resolver_colunas([], colunas)
+
+    def cabecalhos(self, aba):
+        """Cabeçalhos de uma aba (a linha 1), na ordem das colunas, sem ler os dados."""
+        tag_linha = NS_PLANILHA + 'row'
+        with self.zip.open(self.abas[aba]) as arquivo:
+            for _, elemento in ET.iterparse(arquivo):
+                if elemento.tag != tag_linha:
+                    continue
+                if int(elemento.get('r', 1)) != 1:
+                    return []
+                cabecalhos = {coluna: self._valor(celula) for coluna, celula in self._celulas(elemento)}
+                return [cabecalhos[c] for c in sorted(cabecalhos)]
+        return []
+
+    @staticmethod
+    def _montar(dados, colunas):
+        """DataFrame das linhas lidas, com a inferência de tipos do pd.read_excel."""
+        if not dados:
+            return pd.DataFrame(columns=list(colunas))
+        dtype = {nome: tipo for nome, tipo in colunas.items() if tipo is not None}
+        parser = TextParser(dados, names=list(colunas), header=None, dtype=dtype, skip_blank_lines=False)
+        return parser.read()
+
+    def ler(self, aba, colunas):
+        """Lê de uma aba só as colunas do leiaute (a primeira linha é o cabeçalho)."""
+        return self._montar(list(self._registros(aba, colunas)), colunas)
+
+    def ler_blocos(self, aba, colunas, linhas):
+        """Como ler(), mas entrega DataFrames de até `linhas` linhas, sem juntar a aba inteira."""
+        registros = self._registros(aba, colunas)
+        while True:
+            dados = list(itertools.islice(registros, linhas))
+            if not dados:
+                return
+            yield self._montar(dados, colunas)
+
+
+class ExcelCompactado(pd.ExcelFile):
+    """pd.ExcelFile de uma entrada compactada: fecha também o fluxo descompactado."""
+
+    def __init__(self, fonte):
+        self._fonte = fonte
+        super().__init__(fonte)
+
+    def close(self):
+        super().close()
+        self._fonte.close()
+
+
+def abrir_planilha(caminho):
+    """
+    PlanilhaXlsx (leitura em streaming) para .xlsx; pd.ExcelFile para os demais
+    formatos. Planilhas compactadas são lidas do fluxo descompactado (abrir_entrada).
+    """
+    if extensao_entrada(caminho) == EXTENSAO_PACOTE and zipfile.is_zipfile(caminho):
+        raise ValueError(f"Nenhuma planilha ou CSV/TXT em '{caminho}'.")
+    if not entrada_compactada(caminho):
+        return PlanilhaXlsx.abrir(caminho) or pd.ExcelFile(caminho)
+    fonte = abrir_entrada(caminho)
+    try:
+        return PlanilhaXlsx.abrir(fonte) or ExcelCompactado(fonte)
+    except BaseException:
+        fonte.close()
+        raise
+
+
+def _ler_aba(arquivo, aba, colunas):
+    """Lê de uma aba só as colunas do leiaute, já renomeadas."""
+    if isinstance(arquivo, PlanilhaXlsx):
+        return arquivo.ler(aba, colunas)
+    cabecalhos = arquivo.parse(aba, nrows=0).columns
+    mapa = resolver_colunas(cabecalhos, colunas)
+    dtype = {cabecalho: colunas[nome] for cabecalho, nome in mapa.items() if colunas[nome] is not None}
+    df = arquivo.parse(aba, usecols=lambda cabecalho: cabecalho in mapa, dtype=dtype)
+    return df.rename(columns=mapa).reindex(columns=list(colunas))
+
+
+def _formato_texto(caminho):
+    """(separador, decimal, codificação) de um CSV/TXT, pela amostra do início do arquivo."""
+    with abrir_entrada(caminho) as arquivo:
+        amostra = arquivo.read(1 << 20)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(amostra)
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacao = 'cp1252'  # Exportação do Excel/RH no Windows
+    cabecalho = amostra.split(b'\n', 1)[0].decode(codificacao, errors='replace')
+    # ';' é o padrão do Excel em português, que usa vírgula como separador
+    # decimal; o decimal daqui só desempata valores como '1.500' (ver _separador_decimal)
+    if ';' in cabecalho or extensao_entrada(caminho) == '.txt':
+        return ';', ',', codificacao
+    return ',', '.', codificacao
+
+
+def _opcoes_pyarrow(separador, codificacao, mapa, tamanho_bloco=None):
+    """Argumentos de pyarrow.csv.read_csv/open_csv: só as colunas do mapa, todas como texto."""
+    leitura = pa_csv.ReadOptions(encoding='utf8' if codificacao == 'utf-8-sig' else codificacao)
+    if tamanho_bloco:
+        leitura.block_size = tamanho_bloco
+    return dict(
+        read_options=leitura,
+        parse_options=pa_csv.ParseOptions(delimiter=separador),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=list(mapa), column_types={cabecalho: pa.string() for cabecalho in mapa},
+            null_values=sorted(STR_NA_VALUES), strings_can_be_null=True),
+    )
+
+
+# Números como texto, por separador decimal (com o outro como separador de milhar)
+NUMERO_TEXTO = re.compile(r'[+-]?[\d.,]*\d[\d.,]*(?:[eE][+-]?\d+)?')
+NUMERO_POR_DECIMAL = {
+    ',': r'[+-]?(?:\d{1,3}(?:\.\d{3})+|\d*)(?:,\d*)?',
+    '.': r'[+-]?(?:\d{1,3}(?:,\d{3})+|\d*)(?:\.\d*)?(?:[eE][+-]?\d+)?',
+}
+
+
+def _separador_decimal(nome, valores, padrao, decimais):
+    """
+    Separador decimal de uma coluna numérica lida como texto, pelos próprios
+    valores: '1500,50' e '1.500,50' só podem ter vírgula decimal; '1500.50' e
+    '1,500.50', só ponto. Quando todos servem para os dois ('150050', '1.500'),
+    vale o que a coluna já usou em blocos anteriores (`decimais`) ou o
+    `padrao` do arquivo. Retorna None se a coluna não é numérica (fica texto)
+    e levanta ValueError se os valores misturam os dois separadores.
+    """
+    valores = valores.dropna().str.strip()
+    valores = valores[valores != '']
+    if valores.empty or not valores.str.fullmatch(NUMERO_TEXTO).all():
+        return None
+    com_separador = valores[valores.str.contains(r'[.,]')]
+    if com_separador.empty:
+        return decimais.get(nome, padrao)
+    servem = [decimal for decimal, padrao_numero in NUMERO_POR_DECIMAL.items()
+              if com_separador.str.fullmatch(padrao_numero).all()]
+    if not servem or (len(servem) == 1 and decimais.get(nome, servem[0]) != servem[0]):
+        exemplos = ", ".join(f"'{valor}'" for valor in com_separador.drop_duplicates().head(3))
+        raise ValueError(f"Coluna '{nome}' mistura vírgula e ponto como separador decimal ({exemplos}); "
+                         f"corrija a planilha antes de gerar o pagamento.")
+    decimal = servem[0] if len(servem) == 1 else decimais.get(nome, padrao)
+    decimais[nome] = decimal
+    return decimal
+
+
+def _tipar_texto(df, mapa, colunas, decimal, decimais=None):
+    """
+    Renomeia as colunas lidas como texto e aplica os tipos do leiaute (ver
+    ler_texto). O separador decimal de cada coluna numérica sai dos valores
+    (_separador_decimal); `decimal` é o do arquivo, para desempate, e
+    `decimais` guarda a decisão entre os blocos de um mesmo arquivo.
+    """
+    decimais = {} if decimais is None else decimais
+    df = df.rename(columns=mapa).reindex(columns=list(colunas))
+
+    # Células vazias continuam NaN, como na leitura do Excel: astype(str) as
+    # transformaria em 'nan' em algumas versões do pandas
+    for nome, tipo in colunas.items():
+        if tipo is not None:
+            df[nome] = df[nome].map(tipo, na_action='ignore')
+            continue
+        separador = _separador_decimal(nome, df[nome], decimal, decimais) if df[nome].notna().any() else None
+        if separador is None:
+            try:
+                df[nome] = pd.to_numeric(df[nome])
+            except (ValueError, TypeError):
+                df[nome] = df[nome].map(str, na_action='ignore')
+            continue
+        milhar = '.' if separador == ',' else ','
+        df[nome] = pd.to_numeric(df[nome].str.strip().str.replace(milhar, '', regex=False)
+                                 .str.replace(separador, '.', regex=False))
+    return df
+
+
+def _abrir_texto(caminho, colunas):
+    separador, decimal, codificacao = _formato_texto(caminho)
+    with fonte_entrada(caminho) as fonte:
+        cabecalhos = pd.read_csv(fonte, sep=separador, nrows=0, encoding=codificacao).columns
+    return separador, decimal, codificacao, resolver_colunas(cabecalhos, colunas)
+
+
+def ler_texto(caminho, colunas):
+    """
+    Lê um CSV (',' ou ';') ou TXT (';') com as mesmas colunas e tipos da
+    leitura do Excel. Todas as colunas são lidas como texto, o que preserva os
+    zeros à esquerda de cpf/banco/agência/conta; as colunas sem tipo fixo
+    (matrícula, salário) são convertidas para número como o pandas faria,
+    com o separador decimal deduzido dos valores (_separador_decimal).
+    Com pyarrow instalado, o parse é multithread.
+    """
+    separador, decimal, codificacao, mapa = _abrir_texto(caminho, colunas)
+    with fonte_entrada(caminho) as fonte:
+        if pa is not None:
+            df = pa_csv.read_csv(fonte, **_opcoes_pyarrow(separador, codificacao, mapa)).to_pandas()
+        else:
+            df = pd.read_csv(fonte, sep=separador, encoding=codificacao, usecols=list(mapa),
+                             dtype={cabecalho: str for cabecalho in mapa})
+    return _tipar_texto(df, mapa, colunas, decimal)
+
+
+def ler_texto_blocos(caminho, colunas, linhas):
+    """Como ler_texto, mas entrega DataFrames de aproximadamente `linhas` linhas."""
+    separador, decimal, codificacao, mapa = _abrir_texto(caminho, colunas)
+    decimais = {}  # O mesmo separador decimal no arquivo inteiro
+    with fonte_entrada(caminho) as fonte:
+        if pa is not None:
+            opcoes = _opcoes_pyarrow(separador, codificacao, mapa, tamanho_bloco=max(1 << 20, linhas * 128))
+            for lote in pa_csv.open_csv(fonte, **opcoes):
+                if lote.num_rows:
+                    yield _tipar_texto(lote.to_pandas(), mapa, colunas, decimal, decimais)
+        else:
+            with pd.read_csv(fonte, sep=separador, encoding=codificacao, usecols=list(mapa),
+                             dtype={cabecalho: str for cabecalho in mapa}, chunksize=linhas) as leitor:
+                for df in leitor:
+                    yield _tipar_texto(df, mapa, colunas, decimal, decimais)
+
+
+def _abas(arquivo, abas):
+    """Nomes das abas a ler: todas (None), a primeira ([0]) ou as indicadas."""
+    if abas is None:
+        return arquivo.sheet_names
+    if abas == [0]:
+        # Nome real da primeira aba, para a coluna de origem
+        return arquivo.sheet_names[:1]
+    return abas
+
+
+def _ler_planilha(caminho, abas, colunas):
+    """Lê as abas de uma planilha: {nome da aba: DataFrame}. Função de módulo para rodar em outro processo."""
+    if extensao_entrada(caminho) in EXTENSOES_TEXTO:
+        return {None: ler_texto(caminho, colunas)}
+    with abrir_planilha(caminho) as arquivo:
+        return {aba: _ler_aba(arquivo, aba, colunas) for aba in _abas(arquivo, abas)}
+
+
+def avisos_colunas(entradas, colunas):
+    """
+    Lê só os cabeçalhos das entradas e retorna os avisos de resolver_colunas
+    (colunas opcionais ambíguas, que a leitura ignora), com a planilha/aba
+    de origem. A leitura roda em outros processos, então os avisos são
+    levantados aqui, antes dela.
+    """
+    avisos = []
+    for caminho, abas in entradas:
+        origem = os.path.basename(caminho)
+        if extensao_entrada(caminho) in EXTENSOES_TEXTO:
+            separador, _, codificacao = _formato_texto(caminho)
+            with fonte_entrada(caminho) as fonte:
+                cabecalhos = {origem: pd.read_csv(fonte, sep=separador, nrows=0, encoding=codificacao).columns}
+        else:
+            with abrir_planilha(caminho) as arquivo:
+                cabecalhos = {
+                    f"{origem}{SEPARADOR_ABA}{aba}": arquivo.cabecalhos(aba) if isinstance(arquivo, PlanilhaXlsx)
+                    else arquivo.parse(aba, nrows=0).columns
+                    for aba in _abas(arquivo, abas)}
+        for descricao, cabecalhos_aba in cabecalhos.items():
+            da_aba = []
+            resolver_colunas(cabecalhos_aba, colunas, da_aba)
+            avisos.extend(f"{descricao}: {aviso}" for aviso in da_aba)
+    return avisos
+
+
+def juntar_planilhas(entradas, resultados, coluna_origem):
+    """
+    Concatena as planilhas/abas lidas de uma entrada em um DataFrame, com a
+    coluna `coluna_origem` ('arquivo::aba', ou só 'arquivo' para CSV/TXT) para
+    rastrear de onde veio cada linha.
+    """
+    partes = []
+    for (caminho, _), planilhas in zip(entradas, resultados):
+        for aba, df in planilhas.items():
+            origem = os.path.basename(caminho)
+            df[coluna_origem] = origem if aba is None else f"{origem}{SEPARADOR_ABA}{aba}"
+            partes.append(df)
+    if len(partes) == 1:
+        return partes[0]
+    return pd.concat(partes, ignore_index=True)
+
+
+class LeituraEntradas:
+    """
+    Lê todas as entradas (servidores e contas) ao mesmo tempo. Só as `colunas`
+    do leiaute são lidas, aceitando variações de cabeçalho ("CPF", "Cpf ",
+    "Nº Matrícula").
+
+    Havendo mais de uma planilha Excel, cada uma é lida em um processo
+    separado (o parse do XLSX é Python puro e não se beneficia de threads);
+    CSV/TXT (pyarrow/pandas liberam o GIL) e a junção de cada entrada ficam em
+    threads. ler() retorna um Future com o DataFrame de uma entrada, então
+    quem chama pode tratar cada uma assim que ficar pronta, e o tempo total
+    fica próximo ao da leitura mais lenta.
+    """
+
+    def __init__(self, *listas_de_entradas):
+        entradas = [entrada for lista in listas_de_entradas for entrada in lista]
+        planilhas = sum(1 for caminho, _ in entradas if not self._texto(caminho))
+        self.threads = ThreadPoolExecutor(max_workers=len(entradas) + len(listas_de_entradas))
+        self.processos = None
+        nucleos = os.cpu_count() or 1
+        if planilhas > 1 and nucleos > 1:
+            self.processos = ProcessPoolExecutor(max_workers=min(planilhas, nucleos))
+
+    @staticmethod
+    def _texto(caminho):
+        return extensao_entrada(caminho) in EXTENSOES_TEXTO
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.threads.shutdown(cancel_futures=True)
+        if self.processos is not None:
+            self.processos.shutdown(cancel_futures=True)
+
+    def ler(self, entradas, colunas, coluna_origem):
+        futuros = [
+            (self.threads if self.processos is None or self._texto(caminho) else self.processos)
+            .submit(_ler_planilha, caminho, abas, colunas)
+            for caminho, abas in entradas
+        ]
+        return self.threads.submit(
+            lambda: juntar_planilhas(entradas, [futuro.result() for futuro in futuros], coluna_origem))
+
+
+def medir_leitura(entradas, colunas):
+    """
+    Compara a leitura completa (todas as colunas) com a leitura podada para as
+    mesmas planilhas. Retorna uma linha de texto por planilha/aba.
+    """
+    linhas = []
+    for caminho, abas in entradas:
+        if extensao_entrada(caminho) in EXTENSOES_TEXTO:
+            separador, _, codificacao = _formato_texto(caminho)
+            inicio = time.perf_counter()
+            with fonte_entrada(caminho) as fonte:
+                completo = pd.read_csv(fonte, sep=separador, encoding=codificacao)
+            tempo_completo = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            ler_texto(caminho, colunas)
+            tempo_podado = time.perf_counter() - inicio
+            linhas.append(
+                f"{os.path.basename(caminho)}: {formatar_milhar(len(completo))} linhas, "
+                f"{len(completo.columns)} -> {len(colunas)} colunas; "
+                f"completa {tempo_completo:.2f}s, podada {tempo_podado:.2f}s "
+                f"({tempo_completo / max(tempo_podado, 1e-9):.1f}x, {'pyarrow' if pa is not None else 'pandas'})")
+            continue
+        with fonte_entrada(caminho) as fonte, pd.ExcelFile(fonte) as completo_arquivo, \
+                abrir_planilha(caminho) as arquivo:
+            for aba in _abas(arquivo, abas):
+                inicio = time.perf_counter()
+                completo = completo_arquivo.parse(aba)
+                tempo_completo = time.perf_counter() - inicio
+                inicio = time.perf_counter()
+                _ler_aba(arquivo, aba, colunas)
+                tempo_podado = time.perf_counter() - inicio
+                linhas.append(
+                    f"{os.path.basename(caminho)}{SEPARADOR_ABA}{aba}: {formatar_milhar(len(completo))} linhas, "
+                    f"{len(completo.columns)} -> {len(colunas)} colunas; "
+                    f"completa {tempo_completo:.2f}s, podada {tempo_podado:.2f}s "
+                    f"({tempo_completo / max(tempo_podado, 1e-9):.1f}x)")
+    return linhas
+
+
+# ==============================================================================
+#  MODO FORA DA MEMÓRIA (ordenação externa e merge-join por CPF)
+# ==============================================================================
+
+def ler_blocos(entradas, colunas, coluna_origem, linhas):
+    """
+    Lê as entradas em DataFrames de até `linhas` linhas, com a coluna de
+    origem. XLSX e CSV/TXT são lidos em streaming; .xls é lido inteiro e fatiado.
+    """
+    for caminho, abas in entradas:
+        origem = os.path.basename(caminho)
+        if extensao_entrada(caminho) in EXTENSOES_TEXTO:
+            for df in ler_texto_blocos(caminho, colunas, linhas):
+                df[coluna_origem] = origem
+                yield df
+            continue
+        with abrir_planilha(caminho) as arquivo:
+            for aba in _abas(arquivo, abas):
+                if isinstance(arquivo, PlanilhaXlsx):
+                    blocos = arquivo.ler_blocos(aba, colunas, linhas)
+                else:
+                    df = _ler_aba(arquivo, aba, colunas)
+                    blocos = (df.iloc[i:i + linhas] for i in range(0, len(df), linhas))
+                for df in blocos:
+                    df[coluna_origem] = f"{origem}{SEPARADOR_ABA}{aba}"
+                    yield df
+
+
+class OrdenacaoExterna:
+    """
+    Ordenação estável de DataFrames maiores que a memória. Os blocos
+    adicionados ficam em memória até somarem `memoria` bytes; então são
+    ordenados e despejados em um arquivo temporário (um "run", gravado em
+    blocos com pickle). blocos() faz o merge k-vias dos runs, bloco a bloco,
+    e entrega os DataFrames em ordem, com a coluna '_chave'; pode ser lido
+    mais de uma vez. Se tudo coube na memória, nada vai para o disco.
+
+    `chave(df)` retorna uma Series de texto; a ordem é a das strings.
+    """
+
+    def __init__(self, chave, memoria, pasta, linhas_por_bloco):
+        self.chave = chave
+        self.memoria = memoria
+        self.pasta = pasta
+        self.linhas_por_bloco = linhas_por_bloco
+        self.runs = []
+        self._buffer = []
+        self._bytes = 0
+
+    def adicionar(self, df):
+        if df.empty:
+            return
+        df = df.assign(_chave=self.chave(df))
+        self._buffer.append(df)
+        self._bytes += int(df.memory_usage(deep=True).sum())
+        if self._bytes > self.memoria:
+            self._despejar()
+
+    def _ordenar_buffer(self):
+        df = pd.concat(self._buffer, ignore_index=True)
+        self._buffer = []
+        self._bytes = 0
+        return df.sort_values('_chave', kind='stable', ignore_index=True)
+
+    def _fatiar(self, df):
+        for inicio in range(0, len(df), self.linhas_por_bloco):
+            yield df.iloc[inicio:inicio + self.linhas_por_bloco]
+
+    def _despejar(self):
+        df = self._ordenar_buffer()
+        descritor, caminho = tempfile.mkstemp(suffix='.run', dir=self.pasta)
+        with os.fdopen(descritor, 'wb') as arquivo:
+            for bloco in self._fatiar(df):
+                pickle.dump(bloco, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(caminho)
+
+    def descartar(self):
+        """Libera o buffer e apaga os runs: a ordenação não será mais lida."""
+        self._buffer = []
+        self._bytes = 0
+        for caminho in self.runs:
+            with contextlib.suppress(OSError):
+                os.remove(caminho)
+        self.runs = []
+
+    @staticmethod
+    def _ler_run(caminho):
+        with open(caminho, 'rb') as arquivo:
+            while True:
+                try:
+                    yield pickle.load(arquivo)
+                except EOFError:
+                    return
+
+    def blocos(self):
+        if not self.runs:
+            if self._buffer:
+                # Fica ordenado no buffer: blocos() pode ser lido de novo
+                self._buffer = [self._ordenar_buffer()]
+                yield from self._fatiar(self._buffer[0])
+            return
+        if self._buffer:
+            self._despejar()
+        fontes = [self._ler_run(caminho) for caminho in self.runs]
+        atuais = [next(fonte, None) for fonte in fontes]
+        while True:
+            ativos = [i for i, bloco in enumerate(atuais) if bloco is not None]
+            if not ativos:
+                return
+            # Tudo até a menor "última chave" dos blocos atuais já pode sair:
+            # nenhum run tem chave menor que essa mais adiante
+            limite = min(atuais[i]['_chave'].iat[-1] for i in ativos)
+            partes = []
+            for i in ativos:
+                bloco = atuais[i]
+                corte = bloco['_chave'].searchsorted(limite, side='right')
+                partes.append(bloco.iloc[:corte].assign(_run=i))
+                atuais[i] = bloco.iloc[corte:] if corte < len(bloco) else next(fontes[i], None)
+            # Empate de chave: primeiro o run mais antigo (ordenação estável)
+            df = pd.concat(partes, ignore_index=True)
+            yield df.sort_values(['_chave', '_run'], kind='stable', ignore_index=True).drop(columns='_run')
+
+
+def chave_cpf(df):
+    return df['cpf'].map(str, na_action='ignore').fillna('')
+
+
+def chave_nome(df):
+    # Pelo nome como vai sair no arquivo; nomes vazios por último, como em
+    # sort_values(na_position='last'). Nomes iguais ficam na ordem da planilha
+    # de servidores ('_posicao'): o '\x00' vem antes de qualquer caractere do nome.
+    nome = ('0' + normalizar_nomes_banco(df['nome'])).fillna('1')
+    return nome + '\x00' + df['_posicao'].map('{:012d}'.format)
+
+
+def juntar_por_cpf(blocos_servidores, blocos_contas, colunas_contas):
+    """
+    Merge-join (left) de dois fluxos de blocos ordenados por '_chave' (cpf):
+    o mesmo resultado de pd.merge(servidores, contas, on='cpf', how='left'),
+    bloco a bloco. Só as contas com cpf dentro da faixa do bloco de
+    servidores atual ficam em memória.
+    """
+    blocos_contas = iter(blocos_contas)
+    pendentes = pd.DataFrame(columns=[*colunas_contas, '_chave'])
+    esgotado = False
+    for bloco in blocos_servidores:
+        maximo = bloco['_chave'].iat[-1]
+        partes = [pendentes]
+        while not esgotado and (partes[-1].empty or partes[-1]['_chave'].iat[-1] <= maximo):
+            proximo = next(blocos_contas, None)
+            if proximo is None:
+                esgotado = True
+            else:
+                partes.append(proximo)
+        partes = [parte for parte in partes if not parte.empty] or [pendentes]
+        contas = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+        corte = contas['_chave'].searchsorted(maximo, side='right')
+        df = pd.merge(bloco, contas.iloc[:corte].drop(columns='cpf'), on='_chave', how='left')
+        # O próximo bloco de servidores ainda pode ter cpf igual ao último deste
+        pendentes = contas.iloc[contas['_chave'].searchsorted(maximo, side='left'):]
+        yield df.drop(columns='_chave')
+
+
+def processar_fora_da_memoria(entradas_servidor, entradas_conta, caminho_saida, constantes, status_callback,
+                              progresso, memoria, gerar_cnab240, regras_contas, interativo, bloquear_em_erro,
+                              arquivo_folha=None, mapa_cnpj=None, limites=None):
+    """
+    Passos 3 a 9 de processar_arquivos para entradas maiores que a memória.
+    Contas e servidores são lidos em blocos e ordenados por cpf com
+    OrdenacaoExterna; o cruzamento é um merge-join desses dois fluxos, e o
+    resultado (com as regras de contas) passa por uma segunda ordenação
+    externa, por nome. Essa ordenação é lida duas vezes: a primeira valida
+    bloco a bloco, e a decisão (continuar ou bloquear) vem antes de qualquer
+    gravação, como no modo em memória; a segunda converte os nomes e grava
+    cada bloco direto nos escritores (e no índice e no arquivo_folha). Os runs
+    ficam em uma pasta temporária ao lado da saída, removida no fim.
+
+    Nomes iguais ficam na ordem das planilhas de servidores (chave_nome),
+    como no modo em memória.
+
+    O orçamento `memoria` é dividido entre as três ordenações que convivem
+    durante o cruzamento (contas, servidores e por nome); as duas primeiras
+    são liberadas logo depois dele, e a parte delas vai para a reordenação
+    do arquivo histórico durante a gravação.
+
+    limites ({'limite_registros': ..., 'limite_bytes': ...}) divide as saídas
+    em partes, como em processar_arquivos.
+
+    Retorna os escritores, ou None se a validação bloqueou a geração.
+    """
+    memoria_ordenacao = memoria // 3
+    linhas = max(1000, memoria_ordenacao // (4 * 1024))
+    with tempfile.TemporaryDirectory(prefix='leopoldo_', dir=os.path.dirname(os.path.abspath(caminho_saida))) as pasta:
+        # --- 3. CONTAS, ordenadas por cpf ---
+        progresso.iniciar(f"Lendo e ordenando '{descrever_entradas(entradas_conta)}'")
+        contas = OrdenacaoExterna(chave_cpf, memoria_ordenacao, pasta, linhas)
+        lidas = 0
+        for df in ler_blocos(entradas_conta, COLUNAS_CONTAS, 'origem_conta', linhas):
+            df['cpf'] = df['cpf'].apply(lambda x: str(int(x)).zfill(11) if pd.notnull(x) else x)
+            contas.adicionar(df)
+            lidas += len(df)
+            progresso.atualizar(lidas)
+        progresso.concluir(lidas)
+        status_callback(f"Contas: {lidas} linhas lidas ({len(contas.runs)} run(s) em disco).")
+
+        # --- 4. SERVIDORES, ordenados por cpf ---
+        progresso.iniciar(f"Lendo e ordenando '{descrever_entradas(entradas_servidor)}'")
+        servidores = OrdenacaoExterna(chave_cpf, memoria_ordenacao, pasta, linhas)
+        lidas = 0
+        for df in ler_blocos(entradas_servidor, COLUNAS_SERVIDORES, 'origem_servidor', linhas):
+            df['_posicao'] = np.arange(lidas, lidas + len(df))
+            servidores.adicionar(df)
+            lidas += len(df)
+            progresso.atualizar(lidas)
+        progresso.concluir(lidas)
+        status_callback(f"Servidores: {lidas} linhas lidas ({len(servidores.runs)} run(s) em disco).")
+
+        # --- 6/7/8. Cruzar, aplicar as regras de contas e ordenar por nome ---
+        status_callback("Cruzando dados (merge-join por CPF) e ordenando por nome...")
+        por_nome = OrdenacaoExterna(chave_nome, memoria_ordenacao, pasta, linhas)
+        contagens_regras = {regra.nome: 0 for regra in regras_contas}
+        cnpjs = set()
+        total = 0
+        for df in juntar_por_cpf(servidores.blocos(), contas.blocos(), [*COLUNAS_CONTAS, 'origem_conta']):
+            for col in ['banco', 'agencia', 'conta']:
+                df[col] = df[col].fillna('0')
+            df['cnpj_pagador'] = resolver_cnpj_pagador(df, constantes['CNPJ_PAGADOR'], mapa_cnpj)
+            cnpjs.update(df['cnpj_pagador'].unique())
+            df, contagens = aplicar_regras_contas(df, regras_contas)
+            for nome_regra, quantidade in contagens.items():
+                contagens_regras[nome_regra] += quantidade
+            por_nome.adicionar(df)
+            total += len(df)
+        contas.descartar()
+        servidores.descartar()
+        del contas, servidores
+        for nome_regra, quantidade in contagens_regras.items():
+            status_callback(f"Regra '{nome_regra}': {quantidade} linha(s).")
+
+        # --- 8.1 Validação prévia, bloco a bloco, antes de gravar qualquer linha ---
+        relatorios = []
+        validados = 0
+        progresso.iniciar("Validando", total=total)
+        for df in por_nome.blocos():
+            relatorios.append(validar_dados(df, constantes['DATA_PAGAMENTO'], regras_contas,
+                                            primeiro_registro=validados + 1))
+            validados += len(df)
+            progresso.atualizar(validados)
+        progresso.concluir(validados)
+        if not relatorios:
+            # Nenhuma linha: só a data do pagamento é conferida
+            relatorios.append(validar_dados(pd.DataFrame(columns=[*{**COLUNAS_SERVIDORES, **COLUNAS_CONTAS}]),
+                                            constantes['DATA_PAGAMENTO']))
+        relatorio = pd.concat([relatorio for relatorio in relatorios if not relatorio.empty] or relatorios[:1],
+                              ignore_index=True)
+        relatorio = relatorio.sort_values(['severidade', 'registro'], kind='stable', ignore_index=True)
+        del relatorios
+        if registrar_validacao(relatorio, caminho_saida, status_callback, interativo, bloquear_em_erro):
+            return None
+
+        # --- 9. Converter os nomes e gravar, bloco a bloco (arquivos por CNPJ) ---
+        escritores_cnpj = escritores_por_cnpj(caminho_saida, constantes, sorted(cnpjs) or [constantes['CNPJ_PAGADOR']],
+                                              gerar_cnab240, **(limites or {}))
+        escritores = [escritor for lista in escritores_cnpj.values() for escritor in lista]
+        for escritor in escritores:
+            escritor.abrir()
+        arquivos_folha = {}
+        if arquivo_folha is not None:
+            for cnpj, (escritor_banrisul, *_) in escritores_cnpj.items():
+                arquivos_folha[cnpj] = ArquivoFolha(arquivo_folha.pasta, arquivo_folha.status_callback)
+                # Os blocos chegam por nome: o arquivo histórico é reordenado por cpf no disco
+                ordenacao = OrdenacaoExterna(chave_cpf, (memoria - memoria_ordenacao) // len(escritores_cnpj),
+                                             pasta, linhas)
+                arquivos_folha[cnpj].abrir(constantes['DATA_PAGAMENTO'], cnpj, escritor_banrisul.caminho, ordenacao)
+        gravados = 0
+        progresso.iniciar("Formatando e gravando", total=total)
+        try:
+            for df in por_nome.blocos():
+                df = df.drop(columns=['_chave', '_posicao'])
+                df['nome'] = normalizar_nomes_banco(df['nome'])
+                grupos = df.groupby('cnpj_pagador', sort=False).indices
+                for cnpj, posicoes in grupos.items():
+                    df_cnpj = df if len(grupos) == 1 else df.iloc[posicoes]
+                    destino = escritores_cnpj[cnpj]
+                    if gerar_cnab240:
+                        rota_banrisul = rotear_banrisul(df_cnpj)
+                        destino[0].gravar_bloco(df_cnpj[rota_banrisul])
+                        destino[1].gravar_bloco(df_cnpj[~rota_banrisul])
+                    else:
+                        destino[0].gravar_bloco(df_cnpj)
+                    if cnpj in arquivos_folha:
+                        arquivos_folha[cnpj].acrescentar(df_cnpj)
+                gravados += len(df)
+                progresso.atualizar(gravados)
+        except BaseException:
+            for escritor in escritores:
+                escritor.abandonar()
+            for arquivo in arquivos_folha.values():
+                arquivo.descartar()
+            raise
+        progresso.concluir(gravados)
+
+        for escritor in escritores:
+            escritor.fechar()
+        for arquivo in arquivos_folha.values():
+            arquivo.concluir()
+        return escritores
+
 
 # ==============================================================================
 #  PASSO 1: A LÓGICA CORRIGIDA
 # ==============================================================================
 
-def processar_arquivos(caminho_servidor, caminho_conta, caminho_saida, data_pagamento, status_callback):
-    """
-    Função principal que executa toda a lógica de processamento de arquivos.
+def processar_arquivos(caminho_servidor, caminho_conta, caminho_saida, data_pagamento, status_callback,
+                       gerar_cnab240=False, interativo=True, frequencia_progresso=10, usar_historico=True,
+                       gravacao_posicional=False, bloquear_em_erro=False, caminho_regras=None, memoria_mb=None,
+                       cnpj_pagador=None, caminho_mapa_cnpj=None, limite_registros=None, limite_bytes=None,
+                       caminho_empresa_cnab240=None):
+    """
+    Função principal que executa toda a lógica de processamento de arquivos.
+
+    caminho_servidor e caminho_conta aceitam uma lista de planilhas (ou texto
+    separado por ';') e abas com 'arquivo.xlsx::Aba1,Aba2' ou '::*'; ver
+    expandir_entradas. As planilhas são lidas em paralelo e concatenadas.
+
+    Com gerar_cnab240=True, as linhas de outros bancos (banco diferente de 041)
+    saem em um arquivo CNAB 240 separado (<saida>_cnab240.txt), com a empresa
+    pagadora de caminho_empresa_cnab240 (ver carregar_empresa_cnab240) e um
+    NSA novo por arquivo (SequenciaCnab240).
+
+    O progresso de leitura e de gravação chega ao status_callback no máximo
+    frequencia_progresso vezes por segundo. Com interativo=False (linha de
+    comando) nenhuma caixa de mensagem é aberta.
+
+    Cada execução fica registrada no histórico (HistoricoProcessamentos). Se a
+    última execução com as mesmas entradas e parâmetros foi interrompida durante
+    a gravação, a saída é retomada do último checkpoint em '<saida>.parcial'.
+
+    Com gravacao_posicional=True o arquivo Banrisul é pré-alocado e gravado em
+    paralelo via mmap (EscritorBanrisulPosicional), sem checkpoints.
+
+    As regras de exclusão/substituição de contas vêm de caminho_regras (ou do
+    arquivo padrão, ver carregar_regras_contas) e são aplicadas ao DataFrame
+    inteiro antes da ordenação, com a contagem por regra no log.
+
+    Antes da gravação todos os campos passam pela validação prévia; os problemas
+    vão para '<saida>_validacao.csv'. Havendo erros, a interface pergunta se
+    deve continuar; sem interface, bloquear_em_erro=True interrompe a geração.
+
+    Com o histórico ligado e o pyarrow instalado, as linhas geradas também vão
+    para o arquivo histórico da folha (ArquivoFolha, Parquet por data/CNPJ).
+
+    O CNPJ pagador vem de cada linha (coluna cnpj_pagador dos servidores, ou o
+    mapa por origem de caminho_mapa_cnpj), com cnpj_pagador (ou
+    CNPJ_PAGADOR_PADRAO) para o resto; ver resolver_cnpj_pagador. Havendo mais
+    de um, cada CNPJ tem os seus arquivos ('<saida>_<cnpj>.txt'), gravados em
+    paralelo, e o seu resumo.
+
+    Com limite_registros ou limite_bytes (limites do portal do banco), cada
+    saída é dividida em partes numeradas com um manifesto ('<saida>_manifesto.csv');
+    ver EscritorEmPartes.
+
+    Os servidores que ficam sem conta recebem candidatos (CPF com um dígito
+    diferente ou dígitos trocados, nome parecido) em '<saida>_sugestoes_contas.csv';
+    ver sugerir_contas.
+
+    Com memoria_mb, as entradas são processadas em blocos dentro desse limite
+    de memória (ver processar_fora_da_memoria), sem checkpoints e sem as
+    sugestões de conta; não combina com gravacao_posicional.
+
+    Retorna a lista de arquivos gerados (o Banrisul primeiro), ou None em caso de erro.
     """
+    progresso = ReportadorProgresso(status_callback, frequencia_progresso)
+    inicio = time.perf_counter()
+    processamento_id = None
+    checkpoints = {}
+    concluido = False
+    falha = None
+    entradas_servidor = expandir_entradas(caminho_servidor)
+    entradas_conta = expandir_entradas(caminho_conta)
+    limites = {'limite_registros': limite_registros, 'limite_bytes': limite_bytes}
+
+    def resumir(escritor, total):
+        resumo = f"{escritor.caminho} ({total} linhas, {formatar_centavos(escritor.total_centavos)})"
+        if isinstance(escritor, EscritorEmPartes) and len(escritor.arquivos) > 1:
+            resumo += f" em {len(escritor.arquivos)} partes, manifesto {escritor.caminho_manifesto}"
+        return resumo
+
+    def finalizar_historico(situacao, registros=None, mensagem=None):
+        # Como em iniciar: uma falha do histórico não pode esconder o resultado do processamento
+        try:
+            historico.finalizar(processamento_id, situacao, time.perf_counter() - inicio, registros, mensagem)
+        except (sqlite3.Error, OSError) as e:
+            status_callback(f"Aviso: histórico de processamentos indisponível ({e}).")
+
+    def concluir(escritores, totais):
+        nonlocal concluido
+        total_linhas = sum(totais)
+        resumo_arquivos = "\n".join(resumir(escritor, total) for escritor, total in zip(escritores, totais))
+        cnpjs = list(dict.fromkeys(escritor.constantes['CNPJ_PAGADOR'] for escritor in escritores))
+        if len(cnpjs) > 1:
+            # Um resumo por CNPJ pagador
+            resumos = []
+            for cnpj in cnpjs:
+                do_cnpj = [(escritor, total) for escritor, total in zip(escritores, totais)
+                           if escritor.constantes['CNPJ_PAGADOR'] == cnpj]
+                centavos = sum(escritor.total_centavos for escritor, _ in do_cnpj)
+                resumos.append(f"CNPJ {cnpj}: {sum(total for _, total in do_cnpj)} linhas, {formatar_centavos(centavos)}\n"
+                               + "\n".join(f"  {resumir(escritor, total)}" for escritor, total in do_cnpj))
+            resumo_arquivos = "\n".join(resumos)
+
+        if processamento_id is not None:
+            finalizar_historico('concluido', total_linhas)
+        concluido = True
+
+        status_callback(f"Processo concluído! {total_linhas} linhas salvas.")
+        if interativo:
+            messagebox.showinfo("Sucesso", f"Processo concluído!\n{total_linhas} linhas salvas em:\n{resumo_arquivos}")
+        else:
+            status_callback(resumo_arquivos)
+        return [arquivo for escritor in escritores for arquivo in escritor.arquivos]
+
     try:
+        # Limite em que não cabe nem um registro: falha já, antes de ler e cruzar as planilhas
+        if limite_registros or limite_bytes:
+            for classe in (EscritorBanrisul, EscritorCnab240) if gerar_cnab240 else (EscritorBanrisul,):
+                classe.capacidade(limite_registros, limite_bytes)
+        if memoria_mb and gravacao_posicional:
+            raise ValueError("a gravação posicional precisa do DataFrame inteiro e não funciona com memoria_mb")
+        empresa_cnab240 = carregar_empresa_cnab240(caminho_empresa_cnab240) if gerar_cnab240 else None
+        if usar_historico:
+            try:
+                historico = HistoricoProcessamentos()
+                assinatura = assinatura_entradas(entradas_servidor, entradas_conta, caminho_saida,
+                                                 data_pagamento, gerar_cnab240, gravacao_posicional, memoria_mb,
+                                                 conteudo_configuracao(caminho_regras), cnpj_pagador,
+                                                 conteudo_configuracao(caminho_mapa_cnpj),
+                                                 limite_registros, limite_bytes, empresa_cnab240)
+                processamento_id, checkpoints = historico.iniciar(
+                    assinatura, descrever_entradas(entradas_servidor), descrever_entradas(entradas_conta),
+                    caminho_saida, data_pagamento)
+            except (sqlite3.Error, OSError) as e:
+                status_callback(f"Aviso: histórico de processamentos indisponível ({e}).")
+        if checkpoints:
+            status_callback(f"Retomando o processamento #{processamento_id} do último checkpoint...")
+
         # --- 2. Constantes de Layout ---
         DATA_PAGAMENTO = data_pagamento
         TIPO_EMPREGO = 'J'
         COD_OCORRENCIA = ' ' * 2
         DESC_OCORRENCIA = ' ' * 82
         DATA_AGENDAMENTO = ' ' * 8
-        CNPJ_PAGADOR = '88131164000107'
+        CNPJ_PAGADOR = cnpj_pagador or CNPJ_PAGADOR_PADRAO  # Padrão das linhas sem CNPJ próprio
         REMOVE_DUPLICADOS = False
+        constantes = {
+            'DATA_PAGAMENTO': DATA_PAGAMENTO,
+            'TIPO_EMPREGO': TIPO_EMPREGO,
+            'COD_OCORRENCIA': COD_OCORRENCIA,
+            'DESC_OCORRENCIA': DESC_OCORRENCIA,
+            'DATA_AGENDAMENTO': DATA_AGENDAMENTO,
+            'CNPJ_PAGADOR': CNPJ_PAGADOR,
+            'EMPRESA_CNAB240': empresa_cnab240,
+        }
+        # Arquivo histórico em Parquet: junto com o histórico, se o pyarrow estiver instalado
+        arquivo_folha = ArquivoFolha(status_callback=status_callback) if usar_historico and pa is not None else None
+        mapa_cnpj = carregar_mapa_cnpj(caminho_mapa_cnpj)
+        for entradas, colunas in ((entradas_servidor, COLUNAS_SERVIDORES),
+                                  (entradas_conta, COLUNAS_CONTAS if memoria_mb else COLUNAS_CONTAS_COM_NOME)):
+            for aviso in avisos_colunas(entradas, colunas):
+                status_callback(f"Aviso: {aviso}")
+
+        if memoria_mb:
+            # Entradas maiores que a memória: ordenação externa + merge-join por CPF
+            escritores = processar_fora_da_memoria(
+                entradas_servidor, entradas_conta, caminho_saida, constantes, status_callback, progresso,
+                memoria_mb * 1024 * 1024, gerar_cnab240, carregar_regras_contas(caminho_regras),
+                interativo, bloquear_em_erro, arquivo_folha, mapa_cnpj, limites)
+            if escritores is None:
+                falha = "Geração bloqueada pela validação"
+                return None
+            return concluir(escritores, [escritor.registros for escritor in escritores])
 
-        # --- 3. Carregar o arquivo de CONTAS ---
-        status_callback(f"Lendo '{caminho_conta}'...")
-        colunas_como_texto_contas = {'cpf': str, 'banco': str, 'agencia': str, 'conta': str}
-        df_contas = pd.read_excel(caminho_conta, dtype=colunas_como_texto_contas)
-        # Normalizar o CPF para ter 11 dígitos com zeros à esquerda
-        df_contas['cpf'] = df_contas['cpf'].apply(lambda x: str(int(x)).zfill(11) if pd.notnull(x) else x)
+        # --- 3/4. Carregar CONTAS e SERVIDORES (GP) ao mesmo tempo ---
+        # As duas leituras começam juntas e cada uma é tratada assim que termina,
+        # enquanto a outra continua.
+        progresso.iniciar(f"Lendo '{descrever_entradas(entradas_conta)}' e '{descrever_entradas(entradas_servidor)}'")
+        with LeituraEntradas(entradas_conta, entradas_servidor) as leitura:
+            futuro_contas = leitura.ler(entradas_conta, COLUNAS_CONTAS_COM_NOME, 'origem_conta')
+            futuro_dados = leitura.ler(entradas_servidor, COLUNAS_SERVIDORES, 'origem_servidor')
+            for futuro in as_completed([futuro_contas, futuro_dados]):
+                if futuro is futuro_contas:
+                    # --- 3. CONTAS: normalizar o CPF para ter 11 dígitos com zeros à esquerda ---
+                    df_contas = futuro.result()
+                    df_contas['cpf'] = df_contas['cpf'].apply(lambda x: str(int(x)).zfill(11) if pd.notnull(x) else x)
+                    status_callback(f"Contas: {len(df_contas)} linhas lidas.")
+                else:
+                    # --- 4. SERVIDORES (GP) ---
+                    df_dados = futuro.result()
+                    status_callback(f"Servidores: {len(df_dados)} linhas lidas.")
+        progresso.concluir(len(df_contas) + len(df_dados))
+        if processamento_id is not None:
+            historico.etapa(processamento_id, 'leitura')
         # df_contas_ordenado = df_contas.sort_values(by='cpf', ascending=False)
 
         #JUST FOR DEBUGGING PURPOSES
@@ -37,17 +3126,15 @@ def processar_arquivos(caminho_servidor, caminho_conta, caminho_saida, data_paga
         #     print(f"Conta carregada: CPF {linha['cpf']} Banco {linha['banco']} Agência {linha['agencia']} Conta {linha['conta']}")
 
 
-        # --- 4. Carregar o arquivo de SERVIDORES (GP) ---
-        status_callback(f"Lendo '{caminho_servidor}'...")
-        df_dados = pd.read_excel(caminho_servidor, dtype={'cpf': str})
-
-
         #JUST FOR DEBUGGING PURPOSES
         # for indice, linha in df_dados.iterrows():
             # cpf_formatado = str(linha['cpf']).zfill(11) 
             # print(f"Conta carregada: CPF {linha['cpf']} Nome {linha['nome']} Matrícula {linha['matricula']} Salário {linha['salario']}")
 
 
+        # Posição de cada servidor nas planilhas: desempata nomes iguais (ver chave_nome)
+        df_dados['_posicao'] = np.arange(len(df_dados))
+
         if(REMOVE_DUPLICADOS):
             # --- 5. Filtrar o 'df_dados' para manter a maior matrícula ---
             status_callback("Filtrando CPFs duplicados (maior matrícula)...")
@@ -62,98 +3149,761 @@ def processar_arquivos(caminho_servidor, caminho_conta, caminho_saida, data_paga
         
         # CORREÇÃO AQUI: Invertemos a ordem. df_dados_limpo fica na esquerda.
         # Isso garante que TODOS os funcionários fiquem no resultado.
-        df_final = pd.merge(df_dados_limpo, df_contas, on='cpf', how='left')
+        df_final = pd.merge(df_dados_limpo, df_contas.drop(columns='nome_conta'), on='cpf', how='left')
+
+        # --- 6.1 Sugestões de conta para quem ficou sem (CPF digitado errado de um dos lados) ---
+        registrar_sugestoes(sugerir_contas(df_dados_limpo, df_contas), caminho_saida, status_callback)
 
         # --- 7. Tratar quem ficou sem conta (Preencher com '0') ---
         # Quem não tinha conta ficou com NaN (vazio). Vamos colocar '0'.
         cols_bancarias = ['banco', 'agencia', 'conta']
         for col in cols_bancarias:
             df_final[col] = df_final[col].fillna('0')
+        df_final['cnpj_pagador'] = resolver_cnpj_pagador(df_final, CNPJ_PAGADOR, mapa_cnpj)
+
+        # --- 7.1 Regras de exclusão de contas (compiladas em máscaras) ---
+        regras_contas = carregar_regras_contas(caminho_regras)
+        df_final, contagens_regras = aplicar_regras_contas(df_final, regras_contas)
+        for nome_regra, quantidade in contagens_regras.items():
+            status_callback(f"Regra '{nome_regra}': {quantidade} linha(s).")
 
         # --- 8. Ordenar o resultado final por nome ---
+        # Pelo nome como vai sair no arquivo ('Álvaro' e 'ana' antes de 'ZULMIRA');
+        # a validação ainda precisa do nome original
         status_callback("Ordenando resultado por nome...")
-        df_final_ordenado = df_final.sort_values(by='nome', ascending=True, na_position='last')
+        # (a mesma chave da ordenação externa do modo fora da memória)
+        df_final_ordenado = (df_final.assign(_chave=chave_nome(df_final))
+                             .sort_values('_chave', kind='stable', ignore_index=True)
+                             .drop(columns=['_chave', '_posicao']))
+        if processamento_id is not None:
+            historico.etapa(processamento_id, 'cruzamento')
 
-        # --- 9. Formatar e Salvar no Arquivo TXT ---
-        status_callback("Gerando arquivo de saída formatado...")
-        total_linhas = len(df_final_ordenado)
+        # --- 8.1 Validação prévia (máscaras sobre todas as colunas) ---
+        status_callback("Validando campos...")
+        relatorio = validar_dados(df_final_ordenado, DATA_PAGAMENTO, regras_contas)
+        falha = registrar_validacao(relatorio, caminho_saida, status_callback, interativo, bloquear_em_erro)
+        if falha:
+            return None
 
-        with open(caminho_saida, 'w', encoding='utf-8') as f:
-            
-            for indice, linha in df_final_ordenado.iterrows():
-                
-                # Dados do Funcionário (Sempre existem agora)
-                nome = str(linha['nome'])
-                cpf = str(linha['cpf'])
-                if pd.isna(linha['matricula']):
-                    matricula = '0'
-                elif type(linha['matricula']) == float:
-                    matricula = str(int(linha['matricula']))
-                else:
-                    matricula = str(linha['matricula'])
-                # Salário
-                salario_val = 0.0 if pd.isna(linha['salario']) else float(linha['salario'])
-                
-                # Dados Bancários
-                # Se não tinha conta, o fillna colocou '0'
-                conta_orig = str(linha['conta']).strip()
-                # print(f"Processando CPF {cpf}: Conta original = '{conta_orig}' Banco = '{linha['banco']}' Agencia = '{linha['agencia']}'")
-                banco_orig = str(linha['banco']).strip()
-                agencia_orig = str(linha['agencia']).strip()
-                
-                # Lógica para Zerar Dados Bancários
-                # Se a conta for '0' (não encontrada) OU cair nas regras de exclusão (38/39)
-                if conta_orig == '0' or conta_orig.startswith('39') or conta_orig.startswith('38'):
-                    # print(f"Zerando dados bancários para CPF {cpf} (Conta: {conta_orig}) Banco: {banco_orig} Agência: {agencia_orig}")
-                    banco = '041'         # Mantém o banco Banrisul
-                    agencia = '0000'      # Zera agência
-                    conta = '0000000000'  # Zera conta
-                else:
-                    # print(f"Mantendo dados bancários para CPF {cpf} (Conta: {conta_orig}) Banco: {banco_orig} Agência: {agencia_orig}")
-                    banco = banco_orig
-                    agencia = agencia_orig
-                    conta = conta_orig
-                
-                # Aplica a máscara/padding
-                nome_fmt = nome[:46].ljust(46, ' ') 
-                cpf_fmt = cpf.rjust(11, '0')
-                banco_fmt = banco.rjust(3, '0')
-                agencia_fmt = agencia.rjust(4, '0')
-                conta_fmt = conta.rjust(10, '0')
-                matricula_fmt = str(matricula).rjust(15, '0')
-                valor_salario_fmt = str(int(salario_val)).rjust(15, '0')
-
-                linha_formatada = (
-                    f"{nome_fmt}{cpf_fmt}{banco_fmt}{agencia_fmt}{conta_fmt}"
-                    f"{matricula_fmt}{valor_salario_fmt}{valor_salario_fmt}"
-                    f"{COD_OCORRENCIA}{DESC_OCORRENCIA}{DATA_AGENDAMENTO}"
-                    f"{DATA_PAGAMENTO}{TIPO_EMPREGO}{CNPJ_PAGADOR}"
-                )
-                
-                f.write(linha_formatada + '\n')
+        # --- 8.2 Nomes no conjunto de caracteres do banco (um byte por caractere) ---
+        df_final_ordenado['nome'] = normalizar_nomes_banco(df_final_ordenado['nome'])
 
-        status_callback(f"Processo concluído! {total_linhas} linhas salvas.")
-        messagebox.showinfo("Sucesso", f"Processo concluído!\n{total_linhas} linhas salvas em:\n{caminho_saida}")
+        # --- 9. Formatar e Salvar os Arquivos de Saída ---
+        # Um único passe de leitura/cruzamento/ordenação alimenta todos os
+        # leiautes. As linhas são roteadas pela coluna 'banco' e cada escritor
+        # grava o seu arquivo em paralelo.
+        # Um grupo por CNPJ pagador (um passe), cada um na ordem por nome
+        classe_banrisul = EscritorBanrisulPosicional if gravacao_posicional else EscritorBanrisul
+        grupos = df_final_ordenado.groupby('cnpj_pagador', sort=True).indices
+        escritores_cnpj = escritores_por_cnpj(caminho_saida, constantes, list(grupos) or [CNPJ_PAGADOR],
+                                              gerar_cnab240, classe_banrisul, **limites)
+        destinos = []
+        particoes = []
+        for cnpj, escritores in escritores_cnpj.items():
+            df_cnpj = df_final_ordenado if len(grupos) <= 1 else df_final_ordenado.iloc[grupos[cnpj]]
+            particoes.append((cnpj, escritores[0].caminho, df_cnpj))
+            if gerar_cnab240:
+                rota_banrisul = rotear_banrisul(df_cnpj)
+                destinos += [(escritores[0], df_cnpj[rota_banrisul]), (escritores[1], df_cnpj[~rota_banrisul])]
+            else:
+                destinos.append((escritores[0], df_cnpj))
+
+        if processamento_id is not None:
+            historico.etapa(processamento_id, 'gravacao')
+            registrar_checkpoint = lambda escritor, estado: historico.checkpoint(
+                processamento_id, escritor.caminho, estado)
+        else:
+            registrar_checkpoint = None
+
+        # As threads só contam registros; o progresso é publicado daqui (thread do Tk)
+        progresso.iniciar("Formatando e gravando", total=len(df_final_ordenado))
+        with ThreadPoolExecutor(max_workers=min(len(destinos), 8)) as executor:
+            futuros = [
+                executor.submit(escritor.gravar, df_destino, checkpoints.get(escritor.caminho), registrar_checkpoint)
+                for escritor, df_destino in destinos
+            ]
+            while wait(futuros, timeout=progresso.intervalo).not_done:
+                progresso.atualizar(sum(escritor.registros for escritor, _ in destinos))
+            totais = [futuro.result() for futuro in futuros]
+        progresso.concluir(sum(totais))
+
+        # --- 10. Arquivo histórico da folha (Parquet por data de pagamento e CNPJ) ---
+        if arquivo_folha is not None:
+            for cnpj, caminho_cnpj, df_cnpj in particoes:
+                arquivo_folha.arquivar(df_cnpj, DATA_PAGAMENTO, cnpj, caminho_cnpj)
+        return concluir([escritor for escritor, _ in destinos], totais)
 
     except FileNotFoundError as e:
+        falha = f"Arquivo não encontrado - {e.filename}"
         status_callback(f"Erro: Arquivo não encontrado - {e.filename}")
-        messagebox.showerror("Erro de Arquivo", f"Erro: Arquivo não encontrado:\n{e.filename}")
+        if interativo:
+            messagebox.showerror("Erro de Arquivo", f"Erro: Arquivo não encontrado:\n{e.filename}")
     except KeyError as e:
+        falha = f"Coluna não encontrada {e}"
         status_callback(f"Erro: Coluna não encontrada {e}. Verifique os arquivos XLS.")
-        messagebox.showerror("Erro de Coluna", f"Erro: Coluna não encontrada: {e}\n\nVerifique se os arquivos XLS têm os cabeçalhos corretos (cpf, nome, matricula, etc).")
+        if interativo:
+            messagebox.showerror("Erro de Coluna", f"Erro: Coluna não encontrada: {e}\n\nVerifique se os arquivos XLS têm os cabeçalhos corretos (cpf, nome, matricula, etc).")
     except Exception as e:
+        falha = f"Erro inesperado: {e}"
         status_callback(f"Erro inesperado: {e}")
-        messagebox.showerror("Erro", f"Ocorreu um erro inesperado:\n{e}")
+        if interativo:
+            messagebox.showerror("Erro", f"Ocorreu um erro inesperado:\n{e}")
+    finally:
+        # Erro ou interrupção: a saída fica em '.parcial' e os checkpoints permitem retomar
+        if processamento_id is not None and not concluido:
+            finalizar_historico('erro' if falha else 'interrompido', mensagem=falha)
+
+# ==============================================================================
+#  DIAGNÓSTICO (cProfile + tracemalloc por processamento)
+# ==============================================================================
+
+VARIAVEL_DIAGNOSTICO = 'LEOPOLDO_DIAGNOSTICO'
+DIAGNOSTICO_TOP = 30  # Locais de alocação e funções listados no relatório
+
+
+def diagnostico_pelo_ambiente():
+    """Diagnóstico ligado pela variável de ambiente LEOPOLDO_DIAGNOSTICO=1."""
+    return os.environ.get(VARIAVEL_DIAGNOSTICO, '').strip().lower() in ('1', 'sim', 'true', 'on')
+
+
+def processar_com_diagnostico(caminho_servidor, caminho_conta, caminho_saida, data_pagamento, status_callback,
+                              top=DIAGNOSTICO_TOP, **opcoes):
+    """
+    Executa processar_arquivos sob cProfile e tracemalloc e grava ao lado da saída:
+    '<saida>_perfil.prof' (pstats/snakeviz), com a thread principal e as
+    threads de gravação (até o Python 3.11, um cProfile por thread; a partir
+    do 3.12 só pode haver um cProfile ativo, e ele já enxerga todas as
+    threads), e '<saida>_diagnostico.txt', com o pico de memória,
+    os `top` locais que mais tinham memória alocada perto do pico e as `top`
+    funções por tempo acumulado. Os processos de leitura de planilhas não
+    entram no perfil.
+    """
+    base = os.path.splitext(caminho_saida)[0]
+    caminho_perfil = base + '_perfil.prof'
+    caminho_relatorio = base + '_diagnostico.txt'
+    perfis_threads = []
+    trava = threading.Lock()
+    # Snapshot da memória refeito a cada mensagem em que ela cresceu 25%:
+    # no fim do processamento os DataFrames já foram liberados.
+    pico = {'bytes': 0, 'snapshot': None, 'mensagem': ''}
+
+    perfil_por_thread = sys.version_info < (3, 12)
+
+    def perfilar_thread(*_):
+        # Primeiro evento de cada thread nova: troca este gancho por um cProfile só dela
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Outro perfilador já ativo: a thread segue sem perfil
+            sys.setprofile(None)
+            return
+        with trava:
+            perfis_threads.append(perfil)
+
+    def registrar(mensagem):
+        atual = tracemalloc.get_traced_memory()[0]
+        if atual > pico['bytes'] * 1.25:
+            pico.update(bytes=atual, snapshot=tracemalloc.take_snapshot(), mensagem=mensagem)
+        status_callback(mensagem)
+
+    perfil = cProfile.Profile()
+    tracemalloc.start(1)
+    if perfil_por_thread:
+        threading.setprofile(perfilar_thread)
+    inicio = time.perf_counter()
+    perfil.enable()
+    try:
+        return processar_arquivos(caminho_servidor, caminho_conta, caminho_saida, data_pagamento, registrar,
+                                  **opcoes)
+    finally:
+        perfil.disable()
+        duracao = time.perf_counter() - inicio
+        if perfil_por_thread:
+            threading.setprofile(None)
+        atual, maximo = tracemalloc.get_traced_memory()
+        if pico['snapshot'] is None:
+            pico.update(snapshot=tracemalloc.take_snapshot(), mensagem='fim do processamento')
+        tracemalloc.stop()
+
+        relatorio = io.StringIO()
+        estatisticas = pstats.Stats(perfil, stream=relatorio)
+        for perfil_thread in perfis_threads:
+            estatisticas.add(perfil_thread)
+        estatisticas.dump_stats(caminho_perfil)
+
+        mib = 1024 * 1024
+        relatorio.write(f"Diagnóstico de {caminho_saida} - {datetime.datetime.now():%Y-%m-%d %H:%M:%S}\n")
+        threads = len(perfis_threads) + 1 if perfil_por_thread else "todas"
+        relatorio.write(f"Duração: {formatar_duracao(duracao)}; threads perfiladas: {threads}\n")
+        relatorio.write(f"Memória (tracemalloc): pico {maximo / mib:.1f} MiB, ao final {atual / mib:.1f} MiB\n\n")
+        relatorio.write(f"Top {top} locais de alocação (snapshot com {pico['bytes'] / mib:.1f} MiB, "
+                        f"em \"{pico['mensagem']}\"):\n")
+        snapshot = pico['snapshot'].filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        for posicao, estatistica in enumerate(snapshot.statistics('lineno')[:top], start=1):
+            quadro = estatistica.traceback[0]
+            relatorio.write(f"{posicao:>4}. {quadro.filename}:{quadro.lineno}: "
+                            f"{estatistica.size / mib:.2f} MiB em {estatistica.count} blocos\n")
+        relatorio.write(f"\nTop {top} funções por tempo acumulado:\n")
+        estatisticas.sort_stats('cumulative').print_stats(top)
+
+        with open(caminho_relatorio, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(relatorio.getvalue())
+        status_callback(f"Diagnóstico salvo em {caminho_perfil} e {caminho_relatorio}")
+
+
+# ==============================================================================
+#  VISUALIZAÇÃO DA SAÍDA (renderiza só as linhas visíveis)
+# ==============================================================================
+
+class FonteRegistros:
+    """
+    Acesso aleatório às linhas de uma saída formatada: uma lista em memória ou
+    um arquivo mapeado em memória (mmap). Nada é lido além da linha pedida.
+    """
+
+    def __init__(self, linhas=None, caminho=None):
+        self.caminho = caminho
+        self.total = len(linhas) if linhas is not None else 0
+        self._linhas = linhas
+        self._arquivo = None
+        self._mmap = None
+        self._tamanho_registro = None
+        self._inicios = None
+        if caminho is not None:
+            self._abrir(caminho)
+
+    def _abrir(self, caminho):
+        self._arquivo = open(caminho, 'rb')
+        if os.path.getsize(caminho) == 0:
+            return
+        self._mmap = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        tamanho_arquivo = len(self._mmap)
+        bytes_arquivo = np.frombuffer(self._mmap, dtype=np.uint8)
+        fim = self._mmap.find(b'\n')
+        tamanho = fim + 1 if fim >= 0 else tamanho_arquivo
+        if tamanho_arquivo % tamanho == 0 and (bytes_arquivo[tamanho - 1::tamanho] == ord('\n')).all():
+            # Registros de tamanho fixo: offset = índice * tamanho do registro
+            self._tamanho_registro = tamanho
+            self.total = tamanho_arquivo // tamanho
+        else:
+            # Tamanho variável (ex.: fim de registro misturado): indexa as quebras de linha uma vez
+            quebras = np.flatnonzero(bytes_arquivo == ord('\n'))
+            self._inicios = np.concatenate(([0], quebras + 1))
+            if self._inicios[-1] >= tamanho_arquivo:
+                self._inicios = self._inicios[:-1]
+            self.total = len(self._inicios)
+        del bytes_arquivo  # Libera o buffer para o mmap poder ser fechado
+
+    def linha(self, indice):
+        if self._linhas is not None:
+            return self._linhas[indice]
+        if self._tamanho_registro is not None:
+            inicio = indice * self._tamanho_registro
+            fim = inicio + self._tamanho_registro
+        else:
+            inicio = int(self._inicios[indice])
+            fim = int(self._inicios[indice + 1]) if indice + 1 < self.total else len(self._mmap)
+        return self._mmap[inicio:fim].decode(CODIFICACAO_SAIDA, errors='replace').rstrip('\r\n')
+
+    def fechar(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+
+def montar_regua(campos):
+    """Monta as duas linhas da régua: nomes dos campos e escala de colunas."""
+    nomes = "".join(nome[:largura].ljust(largura, '.') for nome, largura in campos)
+    return nomes + "\n" + montar_escala(len(nomes))
+
+
+def montar_escala(tamanho):
+    escala = ""
+    for coluna in range(10, tamanho + 10, 10):
+        marca = str(coluna)
+        escala = escala.ljust(coluna - len(marca), '.') + marca
+    return escala[:tamanho]
+
+
+class PreviewRegistros(tk.LabelFrame):
+    """
+    Painel de pré-visualização da saída. Só as linhas visíveis são renderizadas;
+    a barra de rolagem trabalha sobre o índice do registro, então o custo de
+    rolar é o mesmo com 100 ou com 1 milhão de linhas.
+    """
+
+    def __init__(self, parent, campos=CAMPOS_BANRISUL):
+        super().__init__(parent, text="Visualizar saída", padx=5, pady=5)
+        self.campos = campos
+        self.fonte = None
+        self.primeira = 0
+        self.visiveis = 10
+
+        fonte_tk = tkfont.Font(family="Courier", size=9)
+        self.altura_linha = fonte_tk.metrics("linespace")
+
+        self.txt_regua = tk.Text(self, height=2, wrap=tk.NONE, font=fonte_tk, bg="#EEEEEE", fg="#555555")
+        self.txt_registros = tk.Text(self, height=self.visiveis, wrap=tk.NONE, font=fonte_tk,
+                                     xscrollcommand=self._sincronizar_x)
+        self.scroll_y = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._rolar)
+        self.scroll_x = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self._rolar_x)
+        self.lbl_info = tk.Label(self, text="Nenhum arquivo carregado.", anchor="w")
+
+        self.txt_regua.grid(row=0, column=0, sticky="ew")
+        self.txt_registros.grid(row=1, column=0, sticky="nsew")
+        self.scroll_y.grid(row=1, column=1, sticky="ns")
+        self.scroll_x.grid(row=2, column=0, sticky="ew")
+        self.lbl_info.grid(row=3, column=0, columnspan=2, sticky="ew")
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.txt_regua.insert("1.0", montar_regua(self.campos))
+        self.txt_regua.config(state=tk.DISABLED)
+        self.txt_registros.config(state=tk.DISABLED)
+
+        self.txt_registros.bind("<Configure>", self._redimensionar)
+        self.txt_registros.bind("<MouseWheel>", self._roda_mouse)
+        self.txt_registros.bind("<Button-4>", lambda e: self._rolar("scroll", -3, "units"))
+        self.txt_registros.bind("<Button-5>", lambda e: self._rolar("scroll", 3, "units"))
+
+    def carregar(self, fonte):
+        self.limpar()
+        self.fonte = fonte
+        self.primeira = 0
+        self._renderizar()
+
+    def ir_para(self, registro):
+        """Rola até o registro (a partir de 0) e o destaca na primeira linha visível."""
+        if self.fonte is None:
+            return
+        self.primeira = max(0, min(registro, self.fonte.total - 1))
+        self._renderizar()
+        self.txt_registros.tag_add("destaque", "1.0", "1.end")
+        self.txt_registros.tag_config("destaque", background="#FFF59D")
+
+    def limpar(self):
+        """Fecha o arquivo mapeado (necessário antes de sobrescrevê-lo no Windows)."""
+        if self.fonte is not None:
+            self.fonte.fechar()
+            self.fonte = None
+        self._renderizar()
+
+    def _renderizar(self):
+        total = self.fonte.total if self.fonte is not None else 0
+        fim = min(self.primeira + self.visiveis, total)
+        linhas = [self.fonte.linha(i) for i in range(self.primeira, fim)]
+
+        posicao_x = self.txt_registros.xview()[0]
+        self.txt_registros.config(state=tk.NORMAL)
+        self.txt_registros.delete("1.0", tk.END)
+        self.txt_registros.insert("1.0", "\n".join(linhas))
+        self.txt_registros.config(state=tk.DISABLED)
+        self.txt_registros.xview_moveto(posicao_x)
+
+        if total:
+            self.scroll_y.set(self.primeira / total, fim / total)
+            self.lbl_info.config(text=f"{self.fonte.caminho or 'Memória'}: registros {self.primeira + 1}-{fim} de {total}")
+        else:
+            self.scroll_y.set(0, 1)
+            self.lbl_info.config(text="Nenhum arquivo carregado." if self.fonte is None else "Arquivo vazio.")
+
+    def _rolar(self, acao, *args):
+        if self.fonte is None:
+            return
+        total = self.fonte.total
+        if acao == "moveto":
+            self.primeira = int(float(args[0]) * total)
+        elif acao == "scroll":
+            passo = int(args[0]) * (self.visiveis if args[1] == "pages" else 1)
+            self.primeira += passo
+        self.primeira = max(0, min(self.primeira, total - self.visiveis))
+        self._renderizar()
+
+    def _roda_mouse(self, evento):
+        self._rolar("scroll", -3 if evento.delta > 0 else 3, "units")
+        return "break"
+
+    def _rolar_x(self, *args):
+        self.txt_registros.xview(*args)
+
+    def _sincronizar_x(self, primeira, ultima):
+        self.scroll_x.set(primeira, ultima)
+        self.txt_regua.xview_moveto(primeira)
+
+    def _redimensionar(self, evento):
+        visiveis = max(1, evento.height // self.altura_linha)
+        if visiveis != self.visiveis:
+            self.visiveis = visiveis
+            self._renderizar()
+
+
+# ==============================================================================
+#  ÍNDICE DE CONSULTA POR CPF / MATRÍCULA
+# ==============================================================================
+
+def caminho_indice(caminho_saida):
+    return caminho_saida + '.idx'
+
+
+def _normalizar_cpfs(cpfs):
+    return pd.Series(list(cpfs), dtype=object).map(str).str.replace(r'\D', '', regex=True).str.zfill(11)
+
+
+def _normalizar_matriculas(matriculas):
+    normalizadas = pd.Series(list(matriculas), dtype=object).map(str).str.strip().str.lstrip('0')
+    return normalizadas.mask(normalizadas == '', '0')
+
+
+def _montar_indice(df, primeiro_registro=0):
+    return pd.DataFrame({
+        'cpf': df['cpf'].map(str).str.rjust(11, '0').to_numpy(),
+        'matricula': _normalizar_matriculas(_texto_matricula(df['matricula'])).to_numpy(),
+        'registro': np.arange(primeiro_registro, primeiro_registro + len(df)),
+    })
+
+
+def gravar_indice(caminho_saida, df):
+    """
+    Grava o índice do arquivo Banrisul a partir do DataFrame que acabou de ser
+    gravado (a linha i do DataFrame é o registro i do arquivo): cpf e matrícula
+    como aparecem no registro, e o número do registro (a partir de 0).
+    """
+    caminho = caminho_indice(caminho_saida)
+    _montar_indice(df).to_csv(caminho + '.parcial', sep=';', index=False)
+    os.replace(caminho + '.parcial', caminho)
+
+
+def acrescentar_indice(caminho_saida, df, primeiro_registro):
+    """Acrescenta ao índice parcial o trecho de um bloco gravado (finalizar com concluir_indice)."""
+    caminho = caminho_indice(caminho_saida) + '.parcial'
+    _montar_indice(df, primeiro_registro).to_csv(caminho, sep=';', index=False, mode='a' if primeiro_registro else 'w',
+                                                 header=not primeiro_registro)
+
+
+def concluir_indice(caminho_saida):
+    caminho = caminho_indice(caminho_saida)
+    if os.path.exists(caminho + '.parcial'):
+        os.replace(caminho + '.parcial', caminho)
+
+
+def indexar_arquivo_saida(caminho_saida):
+    """Reconstrói o índice lendo um arquivo Banrisul já gerado (arquivos antigos, sem .idx)."""
+    inicio_cpf, fim_cpf = posicao_campo('CPF')
+    inicio_mat, fim_mat = posicao_campo('MATRICULA')
+    fonte = FonteRegistros(caminho=caminho_saida)
+    try:
+        linhas = [fonte.linha(i) for i in range(fonte.total)]
+    finally:
+        fonte.fechar()
+    indice = pd.DataFrame({
+        'cpf': [linha[inicio_cpf:fim_cpf] for linha in linhas],
+        'matricula': _normalizar_matriculas(linha[inicio_mat:fim_mat] for linha in linhas).to_numpy(),
+        'registro': np.arange(len(linhas)),
+    })
+    indice.to_csv(caminho_indice(caminho_saida), sep=';', index=False)
+    return indice
+
+
+def carregar_indice(caminho_saida):
+    caminho = caminho_indice(caminho_saida)
+    if not os.path.exists(caminho) or os.path.getmtime(caminho) < os.path.getmtime(caminho_saida):
+        return indexar_arquivo_saida(caminho_saida)
+    return pd.read_csv(caminho, sep=';', dtype={'cpf': str, 'matricula': str, 'registro': 'int64'},
+                       keep_default_na=False)
+
+
+def consultar_registros(caminho_saida, cpfs=(), matriculas=()):
+    """
+    Consulta em lote: localiza pelo índice os registros dos CPFs/matrículas
+    informados e lê só essas linhas do arquivo (acesso direto pela posição).
+    Retorna (DataFrame com cpf, matricula, registro e linha; lista do que não
+    foi encontrado).
+    """
+    indice = carregar_indice(caminho_saida)
+    cpfs = _normalizar_cpfs(cpfs)
+    matriculas = _normalizar_matriculas(matriculas)
+    encontrados = indice[indice['cpf'].isin(cpfs) | indice['matricula'].isin(matriculas)].copy()
+    nao_encontrados = (sorted(set(cpfs) - set(encontrados['cpf']))
+                       + sorted(set(matriculas) - set(encontrados['matricula'])))
+
+    fonte = FonteRegistros(caminho=caminho_saida)
+    try:
+        encontrados['linha'] = [fonte.linha(registro) for registro in encontrados['registro']]
+    finally:
+        fonte.fechar()
+    return encontrados, nao_encontrados
+
+
+# ==============================================================================
+#  REDATAR UM ARQUIVO JÁ GERADO (alteração no lugar)
+# ==============================================================================
+
+def _data_valida(texto):
+    return len(texto) == 8 and texto.isdigit() and not pd.isna(pd.to_datetime(texto, format='%Y%m%d', errors='coerce'))
+
+
+def redatar_arquivo(caminho, data_pagamento=None, data_agendamento=None, cnpj=None):
+    """
+    Troca a data de pagamento (e, opcionalmente, a data de agendamento e o CNPJ
+    pagador) de um arquivo Banrisul já gerado, sem refazer o processamento: o
+    arquivo é mapeado em memória como uma matriz registros x bytes e cada campo
+    é sobrescrito na sua coluna em todos os registros de uma vez.
+
+    Antes de alterar qualquer byte confere o leiaute: tamanho múltiplo do
+    registro, quebra de linha no fim de cada registro e datas/CNPJ atuais com
+    o formato esperado. O terminador (LF ou CRLF) vem do primeiro registro.
+
+    Depois da alteração o SHA-256 do arquivo é refeito no manifesto da saída
+    dividida (atualizar_manifesto). O índice '.idx' só guarda cpf, matrícula
+    e número do registro, que não mudam: ele continua valendo e só tem a data
+    de modificação renovada, para carregar_indice não o reconstruir.
+    Retorna o número de registros alterados.
+    """
+    alteracoes = []
+    if data_pagamento is not None:
+        if not _data_valida(data_pagamento):
+            raise ValueError(f"Data de pagamento inválida: '{data_pagamento}' (esperado AAAAMMDD).")
+        alteracoes.append(('DT PGTO', data_pagamento))
+    if data_agendamento is not None:
+        if data_agendamento.strip() and not _data_valida(data_agendamento):
+            raise ValueError(f"Data de agendamento inválida: '{data_agendamento}' (AAAAMMDD ou vazio).")
+        alteracoes.append(('DT AGEND', data_agendamento.strip().ljust(8, ' ')))
+    if cnpj is not None:
+        if not (len(cnpj) == 14 and cnpj.isdigit()):
+            raise ValueError(f"CNPJ inválido: '{cnpj}' (14 dígitos).")
+        alteracoes.append(('CNPJ PAGADOR', cnpj))
+    if not alteracoes:
+        raise ValueError("Nada para alterar.")
+
+    tamanho_arquivo = os.path.getsize(caminho)
+    if tamanho_arquivo == 0:
+        return 0
+    tamanho = bytes_por_registro(caminho)
+    if tamanho_arquivo % tamanho:
+        raise ValueError("O arquivo não tem registros de tamanho fixo do leiaute Banrisul "
+                         "(acentos em UTF-8 ou outro leiaute); gere o arquivo novamente.")
+
+    with open(caminho, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mapa:
+        registros = np.frombuffer(mapa, dtype=np.uint8).reshape(-1, tamanho)
+        try:
+            # --- Conferência do leiaute (nada é alterado se falhar) ---
+            if not ((registros[:, -1] == ord('\n')).all()
+                    and (tamanho == TAMANHO_REGISTRO_BANRISUL + 1 or (registros[:, -2] == ord('\r')).all())):
+                raise ValueError("Quebras de linha fora da posição do leiaute Banrisul.")
+            digitos = (registros >= ord('0')) & (registros <= ord('9'))
+            inicio, fim = posicao_campo('DT PGTO')
+            if not digitos[:, inicio:fim].all():
+                raise ValueError("Há registros sem data de pagamento numérica na posição do leiaute.")
+            inicio, fim = posicao_campo('CNPJ PAGADOR')
+            if not digitos[:, inicio:fim].all():
+                raise ValueError("Há registros sem CNPJ numérico na posição do leiaute.")
+            inicio, fim = posicao_campo('DT AGEND')
+            if not (digitos[:, inicio:fim] | (registros[:, inicio:fim] == ord(' '))).all():
+                raise ValueError("Há registros com data de agendamento inválida na posição do leiaute.")
+            del digitos
+
+            # --- Alteração no lugar ---
+            for campo, valor in alteracoes:
+                inicio, fim = posicao_campo(campo)
+                registros[:, inicio:fim] = np.frombuffer(valor.encode('ascii'), dtype=np.uint8)
+            quantidade = len(registros)
+        finally:
+            del registros  # Libera o buffer antes de fechar o mmap
+        mapa.flush()
+        sha256 = hashlib.sha256(mapa).hexdigest()
+    atualizar_manifesto(caminho, sha256)
+    if os.path.exists(caminho_indice(caminho)):
+        os.utime(caminho_indice(caminho))
+    return quantidade
+
+
+# ==============================================================================
+#  COMPARAÇÃO ENTRE FOLHAS (o que mudou desde o último pagamento)
+# ==============================================================================
+
+# Categorias do relatório de diferenças, na ordem de prioridade da conferência
+CATEGORIAS_DIFERENCA = {
+    'conta_alterada': 'conta bancária alterada',
+    'salario_alterado': 'salário alterado acima do limite',
+    'novo': 'servidor novo',
+    'ausente': 'servidor ausente na folha atual',
+}
+LIMITE_VARIACAO_SALARIO = 10.0  # % sobre o salário anterior
+
+
+def ler_registros_banrisul(caminho):
+    """
+    Campos de um arquivo Banrisul já gerado, em um DataFrame (cpf, matricula,
+    nome, banco, agencia, conta, salario_centavos, data_pagamento,
+    cnpj_pagador). O arquivo é lido como uma matriz registros x bytes e cada
+    campo sai da sua coluna de uma vez, sem laço por linha. O terminador
+    (LF ou CRLF) vem do primeiro registro.
+    """
+    tamanho = bytes_por_registro(caminho)
+    with open(caminho, 'rb') as f:
+        dados = f.read()
+    if len(dados) % tamanho:
+        raise ValueError(f"{caminho}: o arquivo não tem registros de tamanho fixo do leiaute Banrisul.")
+    registros = np.frombuffer(dados, dtype=np.uint8).reshape(-1, tamanho)
+
+    def campo(nome):
+        inicio, fim = posicao_campo(nome)
+        return np.ascontiguousarray(registros[:, inicio:fim]).view(f'S{fim - inicio}').ravel()
+
+    def texto(nome):
+        valores = campo(nome)
+        try:
+            # Campos numéricos e nomes já convertidos são ASCII: conversão direta do numpy
+            return pd.Series(valores.astype(f'U{valores.itemsize}'))
+        except UnicodeDecodeError:
+            return pd.Series(valores).str.decode(CODIFICACAO_SAIDA)
+
+    return pd.DataFrame({
+        'cpf': texto('CPF'),
+        'matricula': _normalizar_matriculas(texto('MATRICULA')),
+        'nome': texto('NOME').str.rstrip(),
+        'banco': texto('BCO'),
+        'agencia': texto('AG'),
+        'conta': texto('CONTA'),
+        'salario_centavos': campo('VALOR').astype(np.int64),
+        'data_pagamento': texto('DT PGTO'),
+        'cnpj_pagador': texto('CNPJ PAGADOR'),
+    })
+
+
+def carregar_folha(fonte, arquivo_folha=None):
+    """
+    Uma folha para comparar: um arquivo Banrisul gerado, ou uma partição do
+    arquivo histórico ('AAAAMMDD' ou 'AAAAMMDD/CNPJ').
+    """
+    if os.path.isfile(fonte):
+        return ler_registros_banrisul(fonte)
+    particao = re.fullmatch(r'(\d{8})(?:/(\d{14}))?', fonte)
+    if not particao:
+        raise ValueError(f"'{fonte}' não é um arquivo nem uma partição do arquivo histórico (AAAAMMDD[/CNPJ]).")
+    if pa is None:
+        raise ValueError("Comparar partições do arquivo histórico precisa do pyarrow instalado.")
+    arquivo_folha = arquivo_folha or ArquivoFolha()
+    filtro = pa_ds.field('data_pagamento') == particao.group(1)
+    if particao.group(2):
+        filtro &= pa_ds.field('cnpj_pagador') == particao.group(2)
+    df = arquivo_folha.consultar(filtro, ['cpf', 'matricula', 'nome', 'banco', 'agencia', 'conta', 'salario_centavos',
+                                          'data_pagamento', 'cnpj_pagador'])
+    if df.empty:
+        raise ValueError(f"Nada arquivado para '{fonte}' em {arquivo_folha.pasta}.")
+    return df
+
+
+def comparar_folhas(anterior, atual, limite_percentual=LIMITE_VARIACAO_SALARIO):
+    """
+    Cruza duas folhas (hash join por cpf + matrícula) e retorna o relatório de
+    diferenças, uma linha por mudança: categoria (CATEGORIAS_DIFERENCA), cpf,
+    matrícula, nome, dados bancários e salário (em reais) antes e depois, e a
+    variação do salário em %. O salário só entra se variar mais que
+    limite_percentual. CPF + matrícula repetidos são pareados pela ordem em
+    que aparecem.
+    """
+    colunas = ['cpf', 'matricula', 'nome', 'banco', 'agencia', 'conta', 'salario_centavos']
+
+    # Chave inteira a partir dos códigos de cpf e matrícula (factorize é por hash):
+    # o join e o agrupamento não ordenam texto, o que dominava o tempo em folhas grandes
+    def codigos(coluna):
+        codigos, _ = pd.factorize(pd.concat([anterior[coluna], atual[coluna]], ignore_index=True))
+        return codigos[:len(anterior)].astype(np.int64), codigos[len(anterior):].astype(np.int64)
+
+    cpf_anterior, cpf_atual = codigos('cpf')
+    matricula_anterior, matricula_atual = codigos('matricula')
+    largura = max(matricula_anterior.max(initial=0), matricula_atual.max(initial=0)) + 1
+    chaves = []
+    for df, cpf, matricula in ((anterior, cpf_anterior, matricula_anterior), (atual, cpf_atual, matricula_atual)):
+        chave = pd.Series(cpf * largura + matricula, index=df.index)
+        chaves.append(df[colunas].assign(_chave=chave, _ocorrencia=chave.groupby(chave, sort=False).cumcount()))
+    df = pd.merge(*chaves, on=['_chave', '_ocorrencia'], how='outer', suffixes=('_anterior', '_atual'), indicator=True)
+    df['cpf'] = df['cpf_atual'].fillna(df['cpf_anterior'])
+    df['matricula'] = df['matricula_atual'].fillna(df['matricula_anterior'])
+
+    ambos = df['_merge'] == 'both'
+    conta_alterada = ambos & ((df['banco_anterior'] != df['banco_atual']) | (df['agencia_anterior'] != df['agencia_atual'])
+                              | (df['conta_anterior'] != df['conta_atual']))
+    salario_anterior = df['salario_centavos_anterior'].astype(float)
+    salario_atual = df['salario_centavos_atual'].astype(float)
+    variacao = (salario_atual - salario_anterior) / salario_anterior.where(salario_anterior != 0) * 100
+    variacao = variacao.mask(ambos & (salario_anterior == 0) & (salario_atual != 0), np.inf)
+    salario_alterado = ambos & (variacao.abs() > limite_percentual)
+
+    partes = []
+    for categoria, mascara in (('conta_alterada', conta_alterada), ('salario_alterado', salario_alterado),
+                               ('novo', df['_merge'] == 'right_only'), ('ausente', df['_merge'] == 'left_only')):
+        partes.append(df[mascara].assign(categoria=categoria, variacao_percentual=variacao[mascara].round(2)))
+    relatorio = pd.concat(partes, ignore_index=True)
+    relatorio['nome'] = relatorio['nome_atual'].fillna(relatorio['nome_anterior'])
+    for momento in ('anterior', 'atual'):
+        relatorio[f'salario_{momento}'] = relatorio[f'salario_centavos_{momento}'] / 100
+    relatorio['categoria'] = pd.Categorical(relatorio['categoria'], categories=list(CATEGORIAS_DIFERENCA), ordered=True)
+    relatorio = relatorio.sort_values(['categoria', 'nome'], kind='stable', ignore_index=True)
+    return relatorio[['categoria', 'cpf', 'matricula', 'nome',
+                      'banco_anterior', 'agencia_anterior', 'conta_anterior',
+                      'banco_atual', 'agencia_atual', 'conta_atual',
+                      'salario_anterior', 'salario_atual', 'variacao_percentual']]
+
+
+def resumir_diferencas(relatorio):
+    """Uma linha por categoria, com a contagem (contas alteradas primeiro)."""
+    contagem = relatorio['categoria'].value_counts(sort=False)
+    return [f"{CATEGORIAS_DIFERENCA[categoria]}: {contagem.get(categoria, 0)}" for categoria in CATEGORIAS_DIFERENCA]
+
+
+def gerar_relatorio_diferencas(fonte_anterior, fonte_atual, caminho_relatorio=None,
+                               limite_percentual=LIMITE_VARIACAO_SALARIO):
+    """
+    Compara duas folhas (arquivos gerados ou partições do arquivo histórico) e
+    grava o relatório em CSV; por padrão '<atual>_diferencas.csv' ao lado do
+    arquivo atual (ou 'diferencas_<partição>.csv' na subpasta '_diferencas'
+    do arquivo histórico, e não na pasta de onde o programa foi chamado; o '_'
+    deixa a subpasta fora do dataset). Retorna (caminho, relatório).
+    """
+    relatorio = comparar_folhas(carregar_folha(fonte_anterior), carregar_folha(fonte_atual), limite_percentual)
+    if caminho_relatorio is None:
+        if os.path.isfile(fonte_atual):
+            caminho_relatorio = os.path.splitext(fonte_atual)[0] + '_diferencas.csv'
+        else:
+            pasta = os.path.join(caminho_arquivo_folha(), '_diferencas')
+            os.makedirs(pasta, exist_ok=True)
+            caminho_relatorio = os.path.join(pasta, f"diferencas_{fonte_atual.replace('/', '_')}.csv")
+    relatorio.to_csv(caminho_relatorio, sep=';', index=False, encoding='utf-8-sig', decimal=',')
+    return caminho_relatorio, relatorio
+
 
 # ==============================================================================
 #  PASSO 2: A INTERFACE GRÁFICA (Tkinter)
 # ==============================================================================
 
+# Filtros dos diálogos de entrada (as compactadas são lidas sem extrair)
+TIPOS_ENTRADA = (("Arquivos Excel", "*.xls *.xlsx"), ("Arquivos CSV/TXT", "*.csv *.txt"),
+                 ("Compactados", "*.zip *.gz"), ("Todos os arquivos", "*.*"))
+
+
 class App:
     def __init__(self, root):
         self.root = root
         self.root.title("Processador de Arquivos Banrisul")
-        self.root.geometry("600x300")
+        self.root.geometry("900x620")
+
+        # --- Menu ---
+        self.var_diagnostico = tk.BooleanVar(value=diagnostico_pelo_ambiente())
+        menu = tk.Menu(root)
+        menu_diagnostico = tk.Menu(menu, tearoff=0)
+        menu_diagnostico.add_checkbutton(label="Gravar perfil de desempenho e memória (cProfile/tracemalloc)",
+                                         variable=self.var_diagnostico)
+        menu.add_cascade(label="Diagnóstico", menu=menu_diagnostico)
+        root.config(menu=menu)
 
         # --- Frame principal ---
         frame_main = tk.Frame(root, padx=10, pady=10)
@@ -213,7 +3963,12 @@ class App:
         self.entry_data = tk.Entry(frame_data)
         self.entry_data.pack(side=tk.LEFT,fill=tk.X, expand=True)
         self.entry_data.insert(0,datetime.date.today().strftime("%Y%m%d"))
-        
+
+        # --- 5. Outros bancos (CNAB 240) ---
+        self.var_cnab240 = tk.BooleanVar(value=False)
+        chk_cnab240 = tk.Checkbutton(frame_main, text="Gerar CNAB 240 para servidores de outros bancos",
+                                     variable=self.var_cnab240, anchor="w")
+        chk_cnab240.pack(fill=tk.X, pady=(10, 0))
         
         # --- 4. Botão de Processar ---
         frame_processar = tk.Frame(frame_main)
@@ -223,7 +3978,19 @@ class App:
                                        font=("Helvetica", 12, "bold"), 
                                        command=self.processar,
                                        bg="#4CAF50", fg="white")
-        self.btn_processar.pack()
+        self.btn_processar.pack(side=tk.LEFT)
+
+        btn_visualizar = tk.Button(frame_processar, text="Visualizar arquivo...", command=self.visualizar_arquivo)
+        btn_visualizar.pack(side=tk.LEFT, padx=(10, 0))
+
+        btn_consultar = tk.Button(frame_processar, text="Consultar CPF...", command=self.consultar_cpf)
+        btn_consultar.pack(side=tk.LEFT, padx=(10, 0))
+
+        btn_redatar = tk.Button(frame_processar, text="Alterar data...", command=self.redatar)
+        btn_redatar.pack(side=tk.LEFT, padx=(10, 0))
+
+        btn_comparar = tk.Button(frame_processar, text="Comparar com anterior...", command=self.comparar)
+        btn_comparar.pack(side=tk.LEFT, padx=(10, 0))
 
         # --- 5. Status Bar ---
         frame_status = tk.Frame(frame_main, relief=tk.SUNKEN, bd=1)
@@ -235,23 +4002,28 @@ class App:
         lbl_status = tk.Label(frame_status, textvariable=self.status_var, anchor="w")
         lbl_status.pack(fill=tk.X, padx=5)
 
+        # --- 6. Pré-visualização da saída ---
+        self.preview = PreviewRegistros(frame_main)
+        self.preview.pack(fill=tk.BOTH, expand=True)
+
     def procurar_servidor(self):
-        path = filedialog.askopenfilename(
-            title="Selecione o arquivo de servidores (dados_gp)",
-            filetypes=(("Arquivos Excel", "*.xls *.xlsx"), ("Todos os arquivos", "*.*"))
+        # Vários arquivos podem ser selecionados; ficam separados por ';'
+        paths = filedialog.askopenfilenames(
+            title="Selecione o(s) arquivo(s) de servidores (dados_gp)",
+            filetypes=TIPOS_ENTRADA
         )
-        if path:
+        if paths:
             self.entry_servidor.delete(0, tk.END)
-            self.entry_servidor.insert(0, path)
+            self.entry_servidor.insert(0, "; ".join(paths))
 
     def procurar_contas(self):
-        path = filedialog.askopenfilename(
-            title="Selecione o arquivo de contas (retorno_contas)",
-            filetypes=(("Arquivos Excel", "*.xls *.xlsx"), ("Todos os arquivos", "*.*"))
+        paths = filedialog.askopenfilenames(
+            title="Selecione o(s) arquivo(s) de contas (retorno_contas)",
+            filetypes=TIPOS_ENTRADA
         )
-        if path:
+        if paths:
             self.entry_contas.delete(0, tk.END)
-            self.entry_contas.insert(0, path)
+            self.entry_contas.insert(0, "; ".join(paths))
 
     def procurar_saida(self):
         path = filedialog.asksaveasfilename(
@@ -263,6 +4035,79 @@ class App:
             self.entry_saida.delete(0, tk.END)
             self.entry_saida.insert(0, path)
 
+    def visualizar_arquivo(self):
+        path = filedialog.askopenfilename(
+            title="Selecione o arquivo de saída para visualizar",
+            filetypes=(("Arquivo de Texto", "*.txt"), ("Todos os arquivos", "*.*"))
+        )
+        if path:
+            self.preview.carregar(FonteRegistros(caminho=path))
+
+    def consultar_cpf(self):
+        caminho = self.preview.fonte.caminho if self.preview.fonte is not None else None
+        if not caminho:
+            caminho = filedialog.askopenfilename(
+                title="Selecione o arquivo de saída para consultar",
+                filetypes=(("Arquivo de Texto", "*.txt"), ("Todos os arquivos", "*.*"))
+            )
+            if not caminho:
+                return
+            self.preview.carregar(FonteRegistros(caminho=caminho))
+        cpfs = simpledialog.askstring("Consultar CPF", "CPF(s), separados por vírgula ou espaço:", parent=self.root)
+        if not cpfs:
+            return
+        encontrados, nao_encontrados = consultar_registros(caminho, cpfs=cpfs.replace(',', ' ').split())
+        if encontrados.empty:
+            messagebox.showinfo("Consultar CPF", "Nenhum registro encontrado.")
+            return
+        self.preview.ir_para(int(encontrados['registro'].iloc[0]))
+        resumo = "\n".join(
+            f"Linha {registro + 1}: CPF {cpf} matrícula {matricula}"
+            for cpf, matricula, registro in encontrados[['cpf', 'matricula', 'registro']].head(20).itertuples(index=False)
+        )
+        if nao_encontrados:
+            resumo += "\n\nNão encontrados: " + ", ".join(nao_encontrados)
+        messagebox.showinfo("Consultar CPF", resumo)
+
+    def redatar(self):
+        caminho = filedialog.askopenfilename(
+            title="Selecione o arquivo de saída para alterar a data de pagamento",
+            filetypes=(("Arquivo de Texto", "*.txt"), ("Todos os arquivos", "*.*"))
+        )
+        if not caminho:
+            return
+        data = simpledialog.askstring("Alterar data", "Nova data do pagamento (AAAAMMDD):",
+                                      initialvalue=self.entry_data.get(), parent=self.root)
+        if not data:
+            return
+        # O arquivo pode estar aberto na visualização
+        if self.preview.fonte is not None and self.preview.fonte.caminho == caminho:
+            self.preview.limpar()
+        try:
+            quantidade = redatar_arquivo(caminho, data_pagamento=data)
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Alterar data", str(e))
+            return
+        self.atualizar_status(f"Data de pagamento alterada para {data} em {quantidade} registros.")
+        self.preview.carregar(FonteRegistros(caminho=caminho))
+
+    def comparar(self):
+        tipos = (("Arquivo de Texto", "*.txt"), ("Todos os arquivos", "*.*"))
+        atual = filedialog.askopenfilename(title="Selecione o arquivo gerado agora", filetypes=tipos)
+        if not atual:
+            return
+        anterior = filedialog.askopenfilename(title="Selecione o arquivo do pagamento anterior", filetypes=tipos)
+        if not anterior:
+            return
+        try:
+            caminho, relatorio = gerar_relatorio_diferencas(anterior, atual)
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Comparar", str(e))
+            return
+        resumo = "\n".join(resumir_diferencas(relatorio))
+        self.atualizar_status(f"Diferenças: {len(relatorio)} linha(s) em {caminho}")
+        messagebox.showinfo("Comparar", f"{resumo}\n\nRelatório em:\n{caminho}")
+
     def atualizar_status(self, mensagem):
         self.status_var.set(mensagem)
         self.root.update_idletasks() # Força a GUI a atualizar o texto
@@ -283,17 +4128,415 @@ class App:
         self.btn_processar.config(text="Processando...", state=tk.DISABLED)
         self.atualizar_status("Iniciando processamento...")
         
-        # Chama a função de lógica
-        processar_arquivos(caminho_servidor, caminho_conta, caminho_saida, data_pagamento, self.atualizar_status)
+        # Libera o arquivo visualizado, que pode ser a própria saída
+        self.preview.limpar()
+
+        # Chama a função de lógica (sob cProfile/tracemalloc se o diagnóstico estiver ligado no menu)
+        processar = processar_com_diagnostico if self.var_diagnostico.get() else processar_arquivos
+        arquivos = processar(caminho_servidor, caminho_conta, caminho_saida, data_pagamento,
+                             self.atualizar_status, gerar_cnab240=self.var_cnab240.get())
+        if arquivos:
+            self.preview.carregar(FonteRegistros(caminho=arquivos[0]))
         
         # 4. Reabilitar o botão
         self.btn_processar.config(text="Processar e Salvar Arquivo", state=tk.NORMAL)
 
+# ==============================================================================
+#  MODO PASTA VIGIADA (processamento automático)
+# ==============================================================================
+
+PREFIXO_SERVIDORES = 'dados_gp'
+PREFIXO_CONTAS = 'retorno_contas'
+
+
+def classificar_entrada(nome_arquivo):
+    """
+    Identifica um arquivo de entrada pelo nome. 'dados_gp_2025-10.xlsx' ->
+    ('servidores', '2025-10'); 'retorno_contas_2025-10.xlsx' -> ('contas', '2025-10').
+    A chave (sufixo) casa os dois arquivos do mesmo par. Retorna None para
+    qualquer outro arquivo.
+    """
+    base, extensao = os.path.splitext(nome_arquivo.lower())
+    if extensao in EXTENSOES_COMPACTADAS:
+        base, extensao = os.path.splitext(base)
+    if extensao not in EXTENSOES_ENTRADA + (EXTENSAO_PACOTE,):
+        return None
+    for tipo, prefixo in (('servidores', PREFIXO_SERVIDORES), ('contas', PREFIXO_CONTAS)):
+        if base.startswith(prefixo):
+            return tipo, base[len(prefixo):].strip(' _-')
+    return None
+
+
+def arquivo_liberado(caminho):
+    """Retorna False enquanto outro programa ainda mantém o arquivo aberto para escrita (Windows)."""
+    # 'r+b' pede escrita como 'ab', mas não recria um arquivo que acabou de ser movido
+    try:
+        with open(caminho, 'r+b'):
+            return True
+    except OSError:
+        return False
+
+
+class VigiaPasta:
+    """
+    Monitora uma pasta e processa automaticamente cada par completo
+    dados_gp/retorno_contas. Um arquivo só entra em um par depois de ficar
+    `debounce` segundos sem mudar de tamanho/data e sem estar travado, o que
+    evita ler exportações pela metade. Os pares vão para uma fila atendida por
+    uma única thread, então rajadas de arquivos no fim do mês apenas se
+    acumulam. Após o processamento as entradas são movidas para as
+    subpastas 'processados' ou 'erros'; saídas e logs vão para pasta_saida.
+    """
+
+    def __init__(self, pasta, pasta_saida, status_callback, data_pagamento=None,
+                 gerar_cnab240=False, intervalo=2.0, debounce=5.0, caminho_empresa_cnab240=None):
+        self.pasta = pasta
+        self.pasta_saida = pasta_saida
+        self.status_callback = status_callback
+        self.data_pagamento = data_pagamento
+        self.gerar_cnab240 = gerar_cnab240
+        self.caminho_empresa_cnab240 = caminho_empresa_cnab240
+        self.intervalo = intervalo
+        self.debounce = debounce
+        self.fila = queue.Queue()
+        self._assinaturas = {}   # caminho -> ((tamanho, mtime), instante da última mudança)
+        self._enfileirados = set()
+        self._conflitos = set()  # (chave, tipo, arquivos) já avisados
+
+    def varrer(self):
+        """
+        Faz uma passada na pasta e enfileira os pares completos e estáveis.
+        Arquivos que somem durante a passada (movidos pelo par em andamento)
+        são ignorados; um par com dois arquivos do mesmo tipo (dados_gp_X.xls
+        e dados_gp_X.xlsx) fica parado, com um aviso, até sobrar um só.
+        """
+        agora = time.monotonic()
+        pares = {}
+        candidatos = {}
+        presentes = set()
+        for entrada in os.scandir(self.pasta):
+            try:
+                if not entrada.is_file():
+                    continue
+                classificacao = classificar_entrada(entrada.name)
+                if classificacao is None:
+                    continue
+                tipo, chave = classificacao
+                candidatos.setdefault((chave, tipo), []).append(entrada.name)
+                presentes.add(entrada.path)
+                estado = entrada.stat()
+                assinatura = (estado.st_size, estado.st_mtime)
+                anterior = self._assinaturas.get(entrada.path)
+                if anterior is None or anterior[0] != assinatura:
+                    self._assinaturas[entrada.path] = (assinatura, agora)
+                    continue
+                if agora - anterior[1] < self.debounce or not arquivo_liberado(entrada.path):
+                    continue
+            except OSError:
+                continue
+            pares.setdefault(chave, {})[tipo] = (estado.st_mtime, entrada.path)
+
+        # Dois arquivos do mesmo tipo para a mesma chave: não há como escolher
+        conflitos = set()
+        for (chave, tipo), nomes in candidatos.items():
+            if len(nomes) > 1:
+                conflito = (chave, tipo, tuple(sorted(nomes)))
+                conflitos.add(conflito)
+                pares.pop(chave, None)
+                if conflito not in self._conflitos:
+                    self.status_callback(f"Par '{chave or '(sem sufixo)'}' parado: mais de um arquivo de {tipo} "
+                                         f"({', '.join(conflito[2])}). Deixe só um na pasta.")
+        self._conflitos = conflitos
+
+        # Esquece arquivos que saíram da pasta
+        for caminho in list(self._assinaturas):
+            if caminho not in presentes:
+                del self._assinaturas[caminho]
+
+        # Enfileira por ordem de chegada (o arquivo mais recente do par)
+        completos = [(max(par.values())[0], chave, par) for chave, par in pares.items() if len(par) == 2]
+        for _, chave, par in sorted(completos):
+            identificador = (par['servidores'][1], par['contas'][1])
+            if identificador in self._enfileirados:
+                continue
+            self._enfileirados.add(identificador)
+            self.fila.put((chave, par['servidores'][1], par['contas'][1]))
+            self.status_callback(f"Par '{chave or '(sem sufixo)'}' na fila ({self.fila.qsize()} aguardando).")
+
+    def processar_par(self, chave, caminho_servidor, caminho_conta):
+        carimbo = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        nome_saida = "saida_banrisul" + (f"_{chave}" if chave else "") + f"_{carimbo}"
+        caminho_saida = os.path.join(self.pasta_saida, nome_saida + ".txt")
+        caminho_log = os.path.join(self.pasta_saida, nome_saida + ".log")
+        data_pagamento = self.data_pagamento or datetime.date.today().strftime("%Y%m%d")
+
+        with open(caminho_log, 'w', encoding='utf-8') as log:
+            def registrar(mensagem):
+                log.write(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} {mensagem}\n")
+                log.flush()
+                self.status_callback(f"[{chave or '-'}] {mensagem}")
+
+            registrar(f"Servidores: {caminho_servidor}")
+            registrar(f"Contas: {caminho_conta}")
+            registrar(f"Data do pagamento: {data_pagamento}")
+            processar = processar_com_diagnostico if diagnostico_pelo_ambiente() else processar_arquivos
+            arquivos = processar(caminho_servidor, caminho_conta, caminho_saida, data_pagamento,
+                                 registrar, gerar_cnab240=self.gerar_cnab240, interativo=False,
+                                 caminho_empresa_cnab240=self.caminho_empresa_cnab240)
+
+            destino = os.path.join(self.pasta, 'processados' if arquivos else 'erros')
+            os.makedirs(destino, exist_ok=True)
+            for caminho in (caminho_servidor, caminho_conta):
+                movido = os.path.join(destino, f"{carimbo}_{os.path.basename(caminho)}")
+                shutil.move(caminho, movido)
+                registrar(f"Entrada movida para {movido}")
+
+        self._enfileirados.discard((caminho_servidor, caminho_conta))
+        return arquivos
+
+    def _atender_fila(self):
+        while True:
+            item = self.fila.get()
+            if item is None:
+                break
+            try:
+                self.processar_par(*item)
+            except Exception as e:
+                self.status_callback(f"[{item[0] or '-'}] Erro ao processar o par: {e}")
+            finally:
+                self.fila.task_done()
+
+    def executar(self):
+        """Vigia a pasta até Ctrl+C; o par em andamento termina antes de sair."""
+        os.makedirs(self.pasta_saida, exist_ok=True)
+        trabalhador = threading.Thread(target=self._atender_fila, daemon=True)
+        trabalhador.start()
+        self.status_callback(f"Vigiando '{self.pasta}' (saídas em '{self.pasta_saida}'). Ctrl+C para encerrar.")
+        try:
+            while True:
+                self.varrer()
+                time.sleep(self.intervalo)
+        except KeyboardInterrupt:
+            self.status_callback("Encerrando após o par em andamento...")
+        finally:
+            self.fila.put(None)
+            trabalhador.join()
+
+
+# ==============================================================================
+#  LINHA DE COMANDO
+# ==============================================================================
+
+def positivo(tipo):
+    """Tipo do argparse que só aceita números maiores que zero."""
+    def converter(texto):
+        valor = tipo(texto)
+        if valor <= 0:
+            raise argparse.ArgumentTypeError(f"deve ser maior que zero: {texto}")
+        return valor
+    converter.__name__ = tipo.__name__
+    return converter
+
+
+def executar_cli(argv):
+    """Executa o processamento sem abrir a interface. Retorna o código de saída."""
+    parser = argparse.ArgumentParser(
+        prog="main4.3",
+        description="Gera o arquivo de saída Banrisul a partir das planilhas de servidores e contas.",
+    )
+    parser.add_argument("--servidores", action="append",
+                        help="Arquivo de servidores (dados_gp: .xlsx, .xls, .csv ou .txt); pode repetir, e aceita 'arquivo.xlsx::Aba1,Aba2' ou '::*'")
+    parser.add_argument("--contas", action="append",
+                        help="Arquivo de contas (retorno_contas); pode repetir, mesmo formato de --servidores")
+    parser.add_argument("--saida", help="Arquivo de saída (.txt)")
+    parser.add_argument("--data", help="Data do pagamento AAAAMMDD (padrão: hoje)")
+    parser.add_argument("--cnab240", action="store_true",
+                        help="Gerar CNAB 240 para servidores de outros bancos")
+    parser.add_argument("--empresa-cnab240", metavar="ARQUIVO_JSON",
+                        help=f"Com --cnab240: convênio, agência, conta e nome da empresa pagadora "
+                             f"(padrão: LEOPOLDO_EMPRESA_CNAB240 ou {ARQUIVO_EMPRESA_CNAB240} ao lado do programa)")
+    parser.add_argument("--posicional", action="store_true",
+                        help="Gravar o arquivo Banrisul pré-alocado, em paralelo via mmap")
+    parser.add_argument("--cnpj-pagador", metavar="CNPJ",
+                        help=f"CNPJ pagador das linhas sem CNPJ próprio (padrão: {CNPJ_PAGADOR_PADRAO})")
+    parser.add_argument("--mapa-cnpj", metavar="ARQUIVO_JSON",
+                        help="CNPJ pagador por origem: {\"arquivo.xlsx::Aba\": \"CNPJ\"} (padrões com * e ?)")
+    parser.add_argument("--max-registros", type=positivo(int), metavar="N",
+                        help="Dividir cada saída em partes de até N registros (com manifesto)")
+    parser.add_argument("--max-mb", type=positivo(float), metavar="MB",
+                        help="Dividir cada saída em partes de até MB megabytes (com manifesto)")
+    parser.add_argument("--memoria-mb", type=positivo(int), metavar="N",
+                        help="Processar em blocos com até N MB de dados em memória (ordenação externa em disco)")
+    parser.add_argument("--regras", help="Arquivo JSON com as regras de exclusão/substituição de contas")
+    parser.add_argument("--bloquear-erros", action="store_true",
+                        help="Não gerar a saída se a validação prévia encontrar erros")
+    parser.add_argument("--frequencia-progresso", type=positivo(float), default=2,
+                        help="Máximo de linhas de progresso por segundo (padrão: 2)")
+    parser.add_argument("--vigiar", metavar="PASTA",
+                        help="Processar automaticamente os pares dados_gp*/retorno_contas* que chegarem na pasta")
+    parser.add_argument("--pasta-saida", help="Pasta das saídas e logs do modo --vigiar (padrão: PASTA/saidas)")
+    parser.add_argument("--debounce", type=float, default=5,
+                        help="Segundos sem alteração para considerar um arquivo completo (padrão: 5)")
+    parser.add_argument("--consultar", metavar="ARQUIVO_SAIDA",
+                        help="Consultar registros de um arquivo gerado (use com --cpf/--matricula/--lista-cpfs)")
+    parser.add_argument("--cpf", action="append", default=[], help="CPF a consultar (pode repetir)")
+    parser.add_argument("--matricula", action="append", default=[], help="Matrícula a consultar (pode repetir)")
+    parser.add_argument("--lista-cpfs", help="Arquivo texto com um CPF por linha, para consulta em lote")
+    parser.add_argument("--redatar", metavar="ARQUIVO_SAIDA",
+                        help="Alterar no lugar a data de pagamento (--data) de um arquivo já gerado")
+    parser.add_argument("--data-agendamento", help="Com --redatar: nova data de agendamento (AAAAMMDD)")
+    parser.add_argument("--cnpj", help="Com --redatar: novo CNPJ pagador (14 dígitos)")
+    parser.add_argument("--arquivo-cpf", metavar="CPF",
+                        help="Pagamentos arquivados de um CPF (salário, conta, origem) nos últimos --meses meses")
+    parser.add_argument("--meses", type=int, default=24, help="Com --arquivo-cpf: meses consultados (padrão: 24)")
+    parser.add_argument("--contas-alteradas", metavar="AAAAMMDD",
+                        help="Servidores cuja conta mudou no pagamento dessa data em relação ao anterior arquivado")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTERIOR", "ATUAL"),
+                        help="Relatório do que mudou entre duas folhas: arquivos gerados ou datas do arquivo "
+                             "histórico (AAAAMMDD[/CNPJ]); grava em --saida, '<ATUAL>_diferencas.csv' ou, "
+                             "para datas, 'diferencas_<ATUAL>.csv' junto do arquivo histórico")
+    parser.add_argument("--limite-salario", type=float, default=LIMITE_VARIACAO_SALARIO, metavar="PCT",
+                        help=f"Com --comparar: variação de salário reportada, em %% (padrão: {LIMITE_VARIACAO_SALARIO:g})")
+    parser.add_argument("--historico", action="store_true",
+                        help="Listar os últimos processamentos registrados e sair")
+    parser.add_argument("--diagnostico", action="store_true",
+                        help="Gravar perfil cProfile (.prof) e relatório de memória tracemalloc ao lado da saída "
+                             f"(também ligado por {VARIAVEL_DIAGNOSTICO}=1)")
+    parser.add_argument("--diagnostico-top", type=positivo(int), default=DIAGNOSTICO_TOP,
+                        help=f"Itens listados no relatório de diagnóstico (padrão: {DIAGNOSTICO_TOP})")
+    parser.add_argument("--medir-leitura", action="store_true",
+                        help="Comparar o tempo de leitura completa e podada de --servidores/--contas e sair")
+    args = parser.parse_args(argv)
+    imprimir = lambda mensagem: print(mensagem, flush=True)
+
+    if args.historico:
+        for id_, iniciado, situacao, etapa, registros, duracao, saida, mensagem in HistoricoProcessamentos().ultimos():
+            duracao_fmt = formatar_duracao(duracao) if duracao is not None else '-'
+            imprimir(f"#{id_} {iniciado} {situacao:<12} etapa={etapa or '-'} registros={registros or 0}"
+                     f" duração={duracao_fmt} {saida} {mensagem or ''}")
+        return 0
+
+    if args.arquivo_cpf or args.contas_alteradas:
+        if pa is None:
+            imprimir("Erro: o arquivo histórico da folha precisa do pyarrow instalado.")
+            return 1
+        arquivo_folha = ArquivoFolha()
+        inicio = time.perf_counter()
+        if args.arquivo_cpf:
+            resultado = arquivo_folha.historico_cpf(args.arquivo_cpf, args.meses)
+        else:
+            resultado = arquivo_folha.contas_alteradas(args.contas_alteradas)
+        duracao = time.perf_counter() - inicio
+        if args.saida:
+            resultado.to_csv(args.saida, sep=';', index=False, encoding='utf-8-sig')
+            imprimir(f"{len(resultado)} linhas salvas em {args.saida}")
+        elif not resultado.empty:
+            imprimir(resultado.to_string(index=False))
+        imprimir(f"{len(resultado)} linha(s) em {duracao * 1000:.0f} ms ({arquivo_folha.pasta})")
+        return 0
+
+    if args.comparar:
+        inicio = time.perf_counter()
+        try:
+            caminho, relatorio = gerar_relatorio_diferencas(*args.comparar, caminho_relatorio=args.saida,
+                                                            limite_percentual=args.limite_salario)
+        except (ValueError, OSError) as e:
+            imprimir(f"Erro: {e}")
+            return 1
+        for linha in resumir_diferencas(relatorio):
+            imprimir(linha)
+        imprimir(f"{len(relatorio)} diferença(s) em {caminho} ({time.perf_counter() - inicio:.2f}s)")
+        return 0
+
+    if args.medir_leitura:
+        for entradas, colunas in ((args.servidores, COLUNAS_SERVIDORES), (args.contas, COLUNAS_CONTAS)):
+            if entradas:
+                for linha in medir_leitura(expandir_entradas(entradas), colunas):
+                    imprimir(linha)
+        return 0
+
+    if args.consultar:
+        cpfs = list(args.cpf)
+        if args.lista_cpfs:
+            with open(args.lista_cpfs, encoding='utf-8') as f:
+                cpfs += [linha.strip() for linha in f if linha.strip()]
+        encontrados, nao_encontrados = consultar_registros(args.consultar, cpfs=cpfs, matriculas=args.matricula)
+        if args.saida:
+            encontrados.to_csv(args.saida, sep=';', index=False, encoding='utf-8-sig')
+            imprimir(f"{len(encontrados)} registros salvos em {args.saida}")
+        else:
+            for registro, linha in zip(encontrados['registro'], encontrados['linha']):
+                imprimir(f"{registro + 1}: {linha}")
+        if nao_encontrados:
+            imprimir(f"Não encontrados ({len(nao_encontrados)}): " + ", ".join(nao_encontrados))
+        return 0
+
+    if args.redatar:
+        try:
+            quantidade = redatar_arquivo(args.redatar, data_pagamento=args.data,
+                                         data_agendamento=args.data_agendamento, cnpj=args.cnpj)
+        except (ValueError, OSError) as e:
+            imprimir(f"Erro: {e}")
+            return 1
+        imprimir(f"{quantidade} registros alterados em {args.redatar}.")
+        return 0
+
+    if args.cnab240:
+        # Sem a empresa pagadora o CNAB 240 seria recusado pelo banco: falha antes de ler as planilhas
+        try:
+            carregar_empresa_cnab240(args.empresa_cnab240)
+        except (ValueError, OSError) as e:
+            parser.error(f"--cnab240: {e}")
+
+    if args.vigiar:
+        pasta_saida = args.pasta_saida or os.path.join(args.vigiar, "saidas")
+        VigiaPasta(args.vigiar, pasta_saida, imprimir, data_pagamento=args.data,
+                   gerar_cnab240=args.cnab240, debounce=args.debounce,
+                   caminho_empresa_cnab240=args.empresa_cnab240).executar()
+        return 0
+
+    if not (args.servidores and args.contas and args.saida):
+        parser.error("informe --servidores, --contas e --saida (ou --vigiar PASTA)")
+
+    if args.posicional and args.memoria_mb:
+        parser.error("--posicional não funciona com --memoria-mb")
+    data_pagamento = args.data or datetime.date.today().strftime("%Y%m%d")
+    limite_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb else None
+    if args.max_registros or limite_bytes:
+        try:
+            for classe in (EscritorBanrisul, EscritorCnab240) if args.cnab240 else (EscritorBanrisul,):
+                classe.capacidade(args.max_registros, limite_bytes)
+        except ValueError as e:
+            parser.error(f"--max-mb: {e}")
+    opcoes = dict(gerar_cnab240=args.cnab240, interativo=False,
+                  caminho_empresa_cnab240=args.empresa_cnab240,
+                  gravacao_posicional=args.posicional,
+                  bloquear_em_erro=args.bloquear_erros,
+                  caminho_regras=args.regras,
+                  memoria_mb=args.memoria_mb,
+                  cnpj_pagador=args.cnpj_pagador,
+                  caminho_mapa_cnpj=args.mapa_cnpj,
+                  limite_registros=args.max_registros,
+                  limite_bytes=limite_bytes,
+                  frequencia_progresso=args.frequencia_progresso)
+    if args.diagnostico or diagnostico_pelo_ambiente():
+        arquivos = processar_com_diagnostico(args.servidores, args.contas, args.saida, data_pagamento,
+                                             imprimir, top=args.diagnostico_top, **opcoes)
+    else:
+        arquivos = processar_arquivos(args.servidores, args.contas, args.saida, data_pagamento,
+                                      imprimir, **opcoes)
+    return 0 if arquivos else 1
+
+
 # ==============================================================================
 #  PASSO 3: INICIAR A APLICAÇÃO
 # ==============================================================================
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Pool de leitura no executável do PyInstaller
+    if len(sys.argv) > 1:
+        sys.exit(executar_cli(sys.argv[1:]))
+
     root = tk.Tk()
     app = App(root)
     root.mainloop()
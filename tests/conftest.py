@@ -0,0 +1,19 @@
+"""Os benchmarks (@pytest.mark.benchmark) só rodam com: python -m pytest tests --benchmark"""
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', help='roda também os testes de desempenho')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: teste de desempenho, pulado sem --benchmark')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    pular = pytest.mark.skip(reason='benchmark: rode com --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(pular)
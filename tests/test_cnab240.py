@@ -0,0 +1,126 @@
+"""
+Testes do arquivo CNAB 240 (FEBRABAN): cada campo do header, dos segmentos
+A/B e dos trailers na posição do leiaute, a empresa pagadora configurável e
+o NSA, que não pode se repetir entre arquivos.
+
+Para rodar: python -m pytest tests
+"""
+import json
+
+import pytest
+
+from test_engines import DATA_PAGAMENTO, programa
+
+SERVIDORES = ('cpf,nome,matricula,salario\n'
+              '00012768573,Ana Souza,123,150050\n'
+              '11122233344,BRUNO LIMA,456,98000\n'
+              '55566677788,CARLA DIAS,789,120000\n')
+# Só as contas de outros bancos vão para o CNAB 240
+CONTAS = ('cpf,banco,agencia,conta\n'
+          '00012768573,001,1234,567890\n'
+          '11122233344,237,42,1001\n'
+          '55566677788,041,0100,3512345\n')
+EMPRESA = {'convenio': 'CONV123', 'agencia': '0100', 'conta': '35123456', 'nome': 'PREFEITURA DE TESTE',
+           'nsa_inicial': 7}
+
+
+def campo(registro, inicio, fim):
+    """Campo pelas posições do leiaute FEBRABAN (a partir de 1, fim incluído)."""
+    return registro[inicio - 1:fim]
+
+
+@pytest.fixture
+def entradas(tmp_path, monkeypatch):
+    # O NSA fica no banco do histórico, mesmo com usar_historico=False
+    monkeypatch.setenv('LEOPOLDO_HISTORICO', str(tmp_path / 'historico.db'))
+    (tmp_path / 'servidores.csv').write_text(SERVIDORES, encoding='utf-8')
+    (tmp_path / 'contas.csv').write_text(CONTAS, encoding='utf-8')
+    (tmp_path / 'empresa.json').write_text(json.dumps(EMPRESA), encoding='utf-8')
+    return tmp_path
+
+
+def gerar(pasta, nome='saida', **opcoes):
+    opcoes.setdefault('caminho_empresa_cnab240', str(pasta / 'empresa.json'))
+    return programa.processar_arquivos(
+        str(pasta / 'servidores.csv'), str(pasta / 'contas.csv'), str(pasta / f'{nome}.txt'), DATA_PAGAMENTO,
+        lambda mensagem: None, gerar_cnab240=True, interativo=False, usar_historico=False, **opcoes)
+
+
+def registros(caminho):
+    with open(caminho, encoding='latin-1', newline='') as arquivo:
+        linhas = arquivo.read().split(programa.FIM_DE_REGISTRO)
+    assert linhas[-1] == ''
+    assert all(len(linha) == programa.TAMANHO_REGISTRO_CNAB240 for linha in linhas[:-1])
+    return linhas[:-1]
+
+
+def test_campos_do_arquivo(entradas):
+    gerar(entradas)
+    header, header_lote, *detalhes, trailer_lote, trailer = registros(entradas / 'saida_cnab240.txt')
+    assert len(detalhes) == 4
+
+    for registro in (header, header_lote):
+        assert campo(registro, 1, 3) == '041'
+        assert campo(registro, 18, 18) == '2'
+        assert campo(registro, 19, 32) == programa.CNPJ_PAGADOR_PADRAO
+        assert campo(registro, 33, 52) == 'CONV123'.ljust(20)
+        assert campo(registro, 53, 58) == '00100 '
+        assert campo(registro, 59, 72) == '000035123456  '
+        assert campo(registro, 73, 102) == 'PREFEITURA DE TESTE'.ljust(30)
+    assert campo(header, 4, 8) == '00000'
+    assert campo(header, 103, 132) == 'BANRISUL'.ljust(30)
+    assert campo(header, 143, 143) == '1'
+    assert campo(header, 158, 163) == '000007'
+    assert campo(header, 164, 166) == '089'
+    assert campo(header_lote, 4, 17) == '00011C3041045 '
+
+    segmento_a, segmento_b = detalhes[0], detalhes[1]
+    assert campo(segmento_a, 1, 14) == '0410001300001A'
+    assert campo(segmento_a, 18, 20) == programa.CNAB240_CAMARA_TED
+    assert campo(segmento_a, 21, 23) == '001'
+    assert campo(segmento_a, 24, 29) == '01234 '
+    assert campo(segmento_a, 30, 43) == '000000567890  '
+    assert campo(segmento_a, 44, 73) == 'ANA SOUZA'.ljust(30)
+    assert campo(segmento_a, 74, 93) == '123'.ljust(20)
+    assert campo(segmento_a, 94, 101) == '10012025'
+    assert campo(segmento_a, 102, 104) == 'BRL'
+    assert campo(segmento_a, 120, 134) == '000000000150050'
+    assert campo(segmento_a, 220, 224) == programa.CNAB240_FINALIDADE_TED
+    assert campo(segmento_b, 1, 14) == '0410001300002B'
+    assert campo(segmento_b, 18, 32) == '100000012768573'
+    assert campo(segmento_b, 128, 135) == '10012025'
+    assert campo(segmento_b, 136, 150) == '000000000150050'
+    assert [campo(registro, 9, 14) for registro in detalhes] == ['00001A', '00002B', '00003A', '00004B']
+
+    # Totais: header + 4 detalhes + trailer no lote; mais os dois registros do arquivo
+    assert campo(trailer_lote, 1, 8) == '04100015'
+    assert campo(trailer_lote, 18, 23) == '000006'
+    assert campo(trailer_lote, 24, 41) == f'{150050 + 98000:018d}'
+    assert campo(trailer, 1, 8) == '04199999'
+    assert campo(trailer, 18, 23) == '000001'
+    assert campo(trailer, 24, 29) == '000008'
+
+
+def test_nsa_novo_a_cada_arquivo(entradas):
+    gerar(entradas, 'primeira')
+    gerar(entradas, 'segunda')
+    nsas = [campo(registros(entradas / f'{nome}_cnab240.txt')[0], 158, 163) for nome in ('primeira', 'segunda')]
+    assert nsas == ['000007', '000008']
+    assert programa.SequenciaCnab240().ultimo(programa.CNPJ_PAGADOR_PADRAO) == 8
+
+
+def test_partes_com_nsa_proprio(entradas):
+    arquivos = gerar(entradas, limite_registros=1)
+    partes = [arquivo for arquivo in arquivos if '_cnab240' in arquivo]
+    assert [campo(registros(parte)[0], 158, 163) for parte in partes] == ['000007', '000008']
+
+
+@pytest.mark.parametrize('empresa', [{}, {**EMPRESA, 'convenio': ''}, {**EMPRESA, 'agencia': '12a'}],
+                         ids=['sem_empresa', 'convenio_vazio', 'agencia_invalida'])
+def test_empresa_obrigatoria(entradas, empresa):
+    (entradas / 'empresa.json').write_text(json.dumps(empresa), encoding='utf-8')
+    assert gerar(entradas) is None
+    assert not (entradas / 'saida_cnab240.txt').exists()
+    assert not (entradas / 'saida.txt').exists()
+    with pytest.raises(ValueError, match='empresa pagadora'):
+        programa.carregar_empresa_cnab240(str(entradas / 'empresa.json'))
@@ -0,0 +1,108 @@
+"""
+Testes das regras sobre as contas: exclusão/substituição (RegraConta) e
+sugestões para quem ficou sem conta.
+
+Para rodar: python -m pytest tests
+"""
+import json
+
+import pandas as pd
+import pytest
+
+from test_engines import programa
+
+SERVIDORES = pd.DataFrame({
+    'cpf': ['12345678901', '00012768573', '11122233344', '55566677788', '44444444444'],
+    'nome': ['ANA SOUZA', 'PEDRO PEREIRA', 'JOSE LIMA', 'MARIA JOSE DA SILVA', 'SEM CANDIDATO'],
+    'matricula': [1, 2, 3, 4, 5],
+    'origem_servidor': 'gp.csv',
+})
+CONTAS = pd.DataFrame({
+    'cpf': ['12345678911', '12768573', '11122233434', '99999999999'],
+    'banco': '041', 'agencia': '0001', 'conta': ['1', '2', '3', '4'],
+    'nome_conta': ['FULANO', 'BELTRANO', 'CICLANO', 'MARIA JOSE SILVA'],
+    'origem_conta': 'rc.csv',
+})
+
+
+def test_sugerir_contas():
+    sugestoes = programa.sugerir_contas(SERVIDORES, CONTAS).set_index('cpf')
+    assert sugestoes.loc['12345678901', 'motivo'] == 'CPF com um dígito diferente'
+    assert sugestoes.loc['00012768573', 'motivo'] == 'mesmo CPF com outra formatação'
+    assert sugestoes.loc['11122233344', 'motivo'] == 'CPF com dígitos vizinhos trocados'
+    assert sugestoes.loc['55566677788', 'motivo'] == 'nome parecido'
+    assert sugestoes.loc['55566677788', 'cpf_conta'] == '99999999999'
+    assert sugestoes.loc['55566677788', 'semelhanca_nome'] > 0.5
+    # Sem candidato: a linha aparece com a conta vazia
+    assert pd.isna(sugestoes.loc['44444444444', 'cpf_conta'])
+
+
+def test_sugerir_contas_sem_nome_do_titular():
+    sugestoes = programa.sugerir_contas(SERVIDORES, CONTAS.drop(columns='nome_conta')).set_index('cpf')
+    assert pd.isna(sugestoes.loc['55566677788', 'cpf_conta'])
+    assert sugestoes['semelhanca_nome'].isna().all()
+
+
+def test_sugerir_contas_todos_com_conta():
+    contas = CONTAS.assign(cpf=SERVIDORES['cpf'].iloc[:4].to_numpy())
+    assert programa.sugerir_contas(SERVIDORES.iloc[:4], contas).empty
+
+
+LANCAMENTOS = pd.DataFrame({
+    'cpf': ['111.111.111-11', '22222222222', '33333333333', '44444444444', '5555555555', '66666666666'],
+    'banco': ['41', '001', '001', '041', '041', '104'],
+    'agencia': ['100', '0250', '0900', '0001', '0001', ' 0300 '],
+    'conta': ['0', '3812345', '123', '3912345', '777', '888'],
+})
+
+
+def test_regras_padrao():
+    resultado, contagens = programa.aplicar_regras_contas(LANCAMENTOS, programa.carregar_regras_contas())
+    assert contagens == {'sem_conta': 1, 'conta_38_39': 2}
+    assert resultado['regra_conta'].tolist() == ['sem_conta', 'conta_38_39', '', 'conta_38_39', '', '']
+    zeradas = resultado['regra_conta'] != ''
+    assert (resultado.loc[zeradas, ['banco', 'agencia', 'conta']] == ['041', '0000', '0000000000']).all().all()
+    # As demais só são normalizadas (espaços), e a entrada não muda
+    assert resultado.loc[~zeradas, 'agencia'].tolist() == ['0900', '0001', '0300']
+    assert LANCAMENTOS.loc[0, 'conta'] == '0'
+
+
+def test_regras_combinadas(tmp_path):
+    cpfs = tmp_path / 'cpfs.txt'
+    cpfs.write_text('5555555555\n\n66666666666\n', encoding='utf-8')
+    regras = [programa.RegraConta(definicao) for definicao in [
+        # Critérios combinados com E: banco 001 e agência de 200 a 500 (só o segundo)
+        {'nome': 'faixa', 'bancos': ['1'], 'agencia_faixa': [200, 500], 'acao': 'substituir', 'agencia': '9999'},
+        # CPFs comparados só pelos dígitos, com zeros à esquerda; banco '41' é o 041
+        {'nome': 'lista', 'cpfs': ['11111111111'], 'bancos': ['041'], 'acao': 'substituir', 'conta': '1'},
+        {'nome': 'arquivo', 'cpfs_arquivo': str(cpfs)},
+        # Vale a primeira regra que casar: o segundo já foi alterado por 'faixa'
+        {'nome': 'prefixo', 'conta_prefixos': ['38']},
+    ]]
+    resultado, contagens = programa.aplicar_regras_contas(LANCAMENTOS, regras)
+    assert contagens == {'faixa': 1, 'lista': 1, 'arquivo': 2, 'prefixo': 0}
+    assert resultado['regra_conta'].tolist() == ['lista', 'faixa', '', '', 'arquivo', 'arquivo']
+    assert resultado.loc[0, ['banco', 'agencia', 'conta']].tolist() == ['41', '100', '1']
+    assert resultado.loc[1, ['banco', 'agencia', 'conta']].tolist() == ['001', '9999', '3812345']
+    assert resultado.loc[4, ['banco', 'agencia', 'conta']].tolist() == ['041', '0000', '0000000000']
+
+
+@pytest.mark.parametrize('definicao, mensagem', [
+    ({'nome': 'vazia', 'acao': 'zerar'}, 'sem critério'),
+    ({'nome': 'x', 'bancos': ['041'], 'acao': 'apagar'}, 'ação desconhecida'),
+    ({'nome': 'x', 'bancos': ['041'], 'acao': 'substituir'}, 'sem banco/agencia/conta'),
+], ids=['sem_criterio', 'acao_desconhecida', 'substituir_sem_campos'])
+def test_regra_invalida(definicao, mensagem):
+    with pytest.raises(ValueError, match=mensagem):
+        programa.RegraConta(definicao)
+
+
+def test_carregar_regras_da_variavel(tmp_path, monkeypatch):
+    arquivo = tmp_path / 'regras.json'
+    arquivo.write_text(json.dumps({'regras': [{'nome': 'caixa', 'bancos': ['104']}]}), encoding='utf-8')
+    monkeypatch.setenv('LEOPOLDO_REGRAS', str(arquivo))
+    regras = programa.carregar_regras_contas()
+    assert [regra.nome for regra in regras] == ['caixa']
+    resultado, contagens = programa.aplicar_regras_contas(LANCAMENTOS, regras)
+    assert contagens == {'caixa': 1}
+    assert resultado.loc[5, 'conta'] == '0000000000'
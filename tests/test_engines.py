@@ -0,0 +1,186 @@
+"""
+Testes diferenciais das engines de gravação do arquivo Banrisul.
+
+A referência é tests/dados/esperado.txt, congelado com o laço iterrows da
+versão original (gravação linha a linha) sobre as planilhas de tests/dados:
+matrícula vazia (coluna float), servidor sem conta, conta iniciada por 38/39,
+banco '41' e '001', nome maior que 46 caracteres ou com acentos/minúsculas,
+CPF com zeros à esquerda e salário vazio. Os salários estão em centavos,
+como nas exportações do RH. O arquivo fica fixo no repositório, então uma
+mudança na gravação não consegue mudar a própria referência.
+
+Para rodar: python -m pytest tests (com --benchmark, também as acelerações
+mínimas de cada engine sobre a gravação linha a linha)
+"""
+import importlib.util
+import os
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DADOS = os.path.join(RAIZ, 'tests', 'dados')
+DATA_PAGAMENTO = '20250110'
+
+
+def _carregar_programa():
+    # 'main4.3.py' não é um nome de módulo importável
+    spec = importlib.util.spec_from_file_location('main4_3', os.path.join(RAIZ, 'main4.3.py'))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo  # os processos de leitura precisam achar o módulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+programa = _carregar_programa()
+
+# Aceleração mínima de cada engine sobre a linha a linha, na folha de LINHAS_BENCHMARK linhas
+ACELERACAO_MINIMA_ENGINES = {'vetorizada': 3.0, 'posicional': 3.0, 'blocos': 3.0}
+LINHAS_BENCHMARK = 20000
+
+CONSTANTES = {'DATA_PAGAMENTO': DATA_PAGAMENTO, 'TIPO_EMPREGO': 'J', 'COD_OCORRENCIA': ' ' * 2,
+              'DESC_OCORRENCIA': ' ' * 82, 'DATA_AGENDAMENTO': ' ' * 8,
+              'CNPJ_PAGADOR': programa.CNPJ_PAGADOR_PADRAO}
+
+
+@pytest.fixture(scope='module')
+def esperado():
+    """Saída de referência, com o fim de registro desta plataforma."""
+    with open(os.path.join(DADOS, 'esperado.txt'), 'rb') as f:
+        return f.read().replace(b'\n', programa.FIM_DE_REGISTRO.encode('latin-1'))
+
+
+@pytest.fixture(scope='module')
+def df_final():
+    """O DataFrame que chega aos escritores: passos 3 a 8 de processar_arquivos."""
+    dados = programa.ler_texto(os.path.join(DADOS, 'dados_gp.csv'), programa.COLUNAS_SERVIDORES)
+    contas = programa.ler_texto(os.path.join(DADOS, 'retorno_contas.csv'), programa.COLUNAS_CONTAS)
+    contas['cpf'] = contas['cpf'].apply(lambda x: str(int(x)).zfill(11) if pd.notnull(x) else x)
+    df = pd.merge(dados.sort_values(by='cpf', ascending=False), contas, on='cpf', how='left')
+    for col in ['banco', 'agencia', 'conta']:
+        df[col] = df[col].fillna('0')
+    df, _ = programa.aplicar_regras_contas(df, programa.carregar_regras_contas())
+    df = df.sort_values(by='nome', ascending=True, na_position='last', key=programa.normalizar_nomes_banco)
+    df['nome'] = programa.normalizar_nomes_banco(df['nome'])
+    return df
+
+
+def ler(caminho):
+    with open(caminho, 'rb') as f:
+        return f.read()
+
+
+def gravar_em_blocos(escritor, df, linhas):
+    escritor.abrir()
+    for inicio in range(0, len(df), linhas):
+        escritor.gravar_bloco(df.iloc[inicio:inicio + linhas])
+    escritor.fechar()
+
+
+@pytest.mark.parametrize('formato', ['csv', 'xlsx'])
+@pytest.mark.parametrize('opcoes', [{}, {'gravacao_posicional': True}, {'memoria_mb': 1}],
+                         ids=['sequencial', 'posicional', 'fora_da_memoria'])
+def test_processamento_completo(tmp_path, esperado, formato, opcoes):
+    saida = str(tmp_path / 'saida.txt')
+    arquivos = programa.processar_arquivos(
+        os.path.join(DADOS, f'dados_gp.{formato}'), os.path.join(DADOS, f'retorno_contas.{formato}'),
+        saida, DATA_PAGAMENTO, lambda mensagem: None, interativo=False, usar_historico=False, **opcoes)
+    assert arquivos == [saida]
+    assert ler(saida) == esperado
+
+
+def test_indices_iguais(tmp_path):
+    caminhos = {}
+    for nome, opcoes in (('sequencial', {}), ('posicional', {'gravacao_posicional': True}),
+                         ('fora_da_memoria', {'memoria_mb': 1})):
+        caminhos[nome] = str(tmp_path / f'{nome}.txt')
+        programa.processar_arquivos(
+            os.path.join(DADOS, 'dados_gp.csv'), os.path.join(DADOS, 'retorno_contas.csv'), caminhos[nome],
+            DATA_PAGAMENTO, lambda mensagem: None, interativo=False, usar_historico=False, **opcoes)
+    indice = ler(programa.caminho_indice(caminhos['sequencial']))
+    assert ler(programa.caminho_indice(caminhos['posicional'])) == indice
+    assert ler(programa.caminho_indice(caminhos['fora_da_memoria'])) == indice
+
+
+def gravar_com(engine, saida, df, linhas_por_bloco=37):
+    if engine == 'linha_a_linha':
+        programa.EscritorBanrisul(saida, CONSTANTES).gravar(df)
+    elif engine == 'vetorizada':
+        gravar_em_blocos(programa.EscritorBanrisul(saida, CONSTANTES), df, len(df))
+    elif engine == 'blocos':
+        gravar_em_blocos(programa.EscritorBanrisul(saida, CONSTANTES), df, linhas_por_bloco)
+    else:
+        programa.EscritorBanrisulPosicional(saida, CONSTANTES).gravar(df)
+
+
+@pytest.mark.parametrize('engine', ['linha_a_linha', 'vetorizada', 'blocos', 'posicional'])
+def test_engines_de_gravacao(tmp_path, esperado, df_final, engine):
+    saida = str(tmp_path / f'{engine}.txt')
+    gravar_com(engine, saida, df_final)
+    assert ler(saida) == esperado
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('engine', sorted(ACELERACAO_MINIMA_ENGINES))
+def test_aceleracao_das_engines(tmp_path, df_final, engine):
+    df = pd.concat([df_final] * (LINHAS_BENCHMARK // len(df_final) + 1), ignore_index=True).iloc[:LINHAS_BENCHMARK]
+    tempos = {}
+    for nome in ('linha_a_linha', engine):
+        inicio = time.perf_counter()
+        gravar_com(nome, str(tmp_path / f'{nome}.txt'), df, linhas_por_bloco=5000)
+        tempos[nome] = time.perf_counter() - inicio
+    assert ler(str(tmp_path / f'{engine}.txt')) == ler(str(tmp_path / 'linha_a_linha.txt'))
+    aceleracao = tempos['linha_a_linha'] / tempos[engine]
+    assert aceleracao >= ACELERACAO_MINIMA_ENGINES[engine], \
+        f"{engine}: {aceleracao:.1f}x, mínimo {ACELERACAO_MINIMA_ENGINES[engine]:.1f}x"
+
+
+@pytest.mark.parametrize('opcoes', [{}, {'memoria_mb': 1}], ids=['sequencial', 'fora_da_memoria'])
+def test_saida_por_cnpj(tmp_path, esperado, opcoes):
+    # Um terço dos servidores com CNPJ próprio, um terço com outro e o resto sem (vai para o padrão)
+    dados = pd.read_csv(os.path.join(DADOS, 'dados_gp.csv'), dtype=str)
+    cnpjs = ['11.111.111/0001-11', '22222222000122', '']
+    dados['CNPJ Pagador'] = [cnpjs[i % 3] for i in range(len(dados))]
+    servidores = tmp_path / 'dados_gp.csv'
+    dados.to_csv(servidores, index=False)
+    saida = str(tmp_path / 'saida.txt')
+    arquivos = programa.processar_arquivos(
+        str(servidores), os.path.join(DADOS, 'retorno_contas.csv'), saida, DATA_PAGAMENTO,
+        lambda mensagem: None, interativo=False, usar_historico=False, **opcoes)
+    por_cnpj = {cnpj: programa.caminho_por_cnpj(saida, cnpj)
+                for cnpj in ('11111111000111', '22222222000122', programa.CNPJ_PAGADOR_PADRAO)}
+    assert sorted(arquivos) == sorted(por_cnpj.values())
+    assert not os.path.exists(saida)
+    fim = programa.FIM_DE_REGISTRO.encode('latin-1')
+    registros = []
+    for cnpj, caminho in por_cnpj.items():
+        linhas = ler(caminho).split(fim)[:-1]
+        assert linhas and all(linha[-14:] == cnpj.encode() for linha in linhas)
+        registros += [linha[:-14] for linha in linhas]
+    # As mesmas linhas da saída única, só repartidas
+    assert sorted(registros) == sorted(linha[:-14] for linha in esperado.split(fim)[:-1])
+
+
+def test_nomes_iguais_na_ordem_da_planilha(tmp_path):
+    # Homônimos com grafias que viram o mesmo nome no arquivo: saem na ordem da planilha em todos os modos
+    servidores = tmp_path / 'servidores.csv'
+    servidores.write_text('cpf,nome,matricula,salario\n'
+                          '99999999999,JOSÉ DA SILVA,1,100\n'
+                          '11111111111,Jose da Silva,2,200\n'
+                          '55555555555,JOSE DA SILVA,3,300\n'
+                          '22222222222,ANA,4,400\n', encoding='utf-8')
+    saidas = {}
+    for nome, opcoes in (('sequencial', {}), ('posicional', {'gravacao_posicional': True}),
+                         ('fora_da_memoria', {'memoria_mb': 1})):
+        saidas[nome] = str(tmp_path / f'{nome}.txt')
+        programa.processar_arquivos(str(servidores), os.path.join(DADOS, 'retorno_contas.csv'), saidas[nome],
+                                    DATA_PAGAMENTO, lambda mensagem: None, interativo=False,
+                                    usar_historico=False, **opcoes)
+    conteudo = ler(saidas['sequencial'])
+    assert ler(saidas['posicional']) == conteudo
+    assert ler(saidas['fora_da_memoria']) == conteudo
+    registros = conteudo.split(programa.FIM_DE_REGISTRO.encode('latin-1'))[:-1]
+    assert [registro[46:57] for registro in registros] == [b'22222222222', b'99999999999', b'11111111111',
+                                                            b'55555555555']
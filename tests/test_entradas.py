@@ -0,0 +1,182 @@
+"""
+Testes da leitura das planilhas de entrada: a mesma folha tem de chegar
+igual ao processamento seja qual for o formato em que o RH a exportou,
+compactada (.gz, .zip) ou não.
+
+Para rodar: python -m pytest tests
+"""
+import gzip
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+from test_engines import DADOS, DATA_PAGAMENTO, programa
+
+# Salários em reais, com centavos, milhar e célula vazia
+FOLHA = pd.DataFrame({
+    'cpf': ['00012768573', '00912157906', '12345678901', '98765432100'],
+    'nome': ['PEDRO PEREIRA', 'JOÃO PEREIRA', 'ANA SOUZA', 'MARIA LIMA'],
+    'matricula': [4775282, 4894383, 1234567, 7654321],
+    'salario': [1500.50, None, 12345.67, 980.0],
+})
+
+
+def _texto(valor, decimal, milhar):
+    if pd.isna(valor):
+        return ''
+    inteiro, centavos = f'{valor:,.2f}'.split('.')
+    return inteiro.replace(',', milhar) + decimal + centavos
+
+
+def gravar_csv(caminho, separador, decimal, milhar=''):
+    folha = FOLHA.assign(salario=[_texto(valor, decimal, milhar) for valor in FOLHA['salario']])
+    folha.to_csv(caminho, sep=separador, index=False)
+    return str(caminho)
+
+
+def ler(caminho):
+    (df,) = programa._ler_planilha(caminho, None, programa.COLUNAS_SERVIDORES).values()
+    return df.drop(columns='cnpj_pagador')
+
+
+@pytest.fixture(scope='module')
+def folha_xlsx(tmp_path_factory):
+    caminho = tmp_path_factory.mktemp('xlsx') / 'folha.xlsx'
+    FOLHA.to_excel(caminho, index=False)
+    return ler(str(caminho))
+
+
+@pytest.mark.parametrize('separador, decimal, milhar', [
+    (',', '.', ''), (';', ',', ''), (';', ',', '.'), (';', '.', ''), (';', '.', ',')],
+    ids=['virgula', 'ponto_e_virgula', 'ponto_e_virgula_milhar', 'ponto_e_virgula_decimal_ponto',
+         'ponto_e_virgula_milhar_virgula'])
+def test_csv_igual_ao_xlsx(tmp_path, folha_xlsx, separador, decimal, milhar):
+    csv = ler(gravar_csv(tmp_path / 'folha.csv', separador, decimal, milhar))
+    assert csv['salario'].tolist()[0] == 1500.50
+    pd.testing.assert_frame_equal(csv, folha_xlsx)
+
+
+def test_separador_decimal_misturado(tmp_path):
+    caminho = tmp_path / 'folha.csv'
+    caminho.write_text('cpf;nome;matricula;salario\n'
+                       '00012768573;PEDRO;1;1500.50\n'
+                       '00912157906;JOAO;2;1500,50\n', encoding='utf-8')
+    with pytest.raises(ValueError, match="salario"):
+        programa.ler_texto(str(caminho), programa.COLUNAS_SERVIDORES)
+
+
+def test_milhar_sem_centavos_segue_o_arquivo(tmp_path):
+    # '1.500' só tem um sentido possível depois que o separador do arquivo é conhecido
+    caminho = tmp_path / 'folha.csv'
+    caminho.write_text('cpf;nome;matricula;salario\n00012768573;PEDRO;1;1.500\n', encoding='utf-8')
+    df = programa.ler_texto(str(caminho), programa.COLUNAS_SERVIDORES)
+    assert df['salario'].tolist() == [1500]
+
+
+def test_blocos_usam_o_mesmo_separador(tmp_path):
+    caminho = gravar_csv(tmp_path / 'folha.csv', ';', ',', '.')
+    blocos = list(programa.ler_texto_blocos(caminho, programa.COLUNAS_SERVIDORES, 1))
+    assert pd.concat(blocos)['salario'].tolist()[:1] == [1500.50]
+    # Um bloco com vírgula decimal e outro com ponto decimal no mesmo arquivo
+    with open(caminho, 'a', encoding='utf-8') as arquivo:
+        arquivo.write('11122233344;JOSE;1;2500.75\n')
+    with pytest.raises(ValueError, match='salario'):
+        list(programa.ler_texto_blocos(caminho, programa.COLUNAS_SERVIDORES, 1))
+
+
+def test_coluna_opcional_ambigua_fica_de_fora():
+    avisos = []
+    mapa = programa.resolver_colunas(['CPF', 'Banco', 'Agencia', 'Conta', 'Titular', 'Favorecido'],
+                                     programa.COLUNAS_CONTAS_COM_NOME, avisos)
+    assert 'nome_conta' not in mapa.values()
+    assert len(avisos) == 1 and "'nome_conta'" in avisos[0]
+    # O nome exato vale mais que os apelidos
+    mapa = programa.resolver_colunas(['CPF', 'Banco', 'Agencia', 'Conta', 'Titular', 'Nome_Conta'],
+                                     programa.COLUNAS_CONTAS_COM_NOME)
+    assert mapa['Nome_Conta'] == 'nome_conta'
+
+
+def test_coluna_obrigatoria_ambigua():
+    with pytest.raises(ValueError, match="'salario'"):
+        programa.resolver_colunas(['cpf', 'nome', 'matricula', 'Valor Liquido', 'Salario Liquido'],
+                                  programa.COLUNAS_SERVIDORES)
+
+
+def test_processamento_com_colunas_opcionais_ambiguas(tmp_path):
+    servidores = tmp_path / 'servidores.csv'
+    servidores.write_text('cpf;nome;matricula;salario;CNPJ;CNPJ Orgao\n'
+                          '00012768573;PEDRO PEREIRA;1;1500,50;11111111000111;22222222000122\n', encoding='utf-8')
+    contas = tmp_path / 'contas.csv'
+    contas.write_text('cpf;banco;agencia;conta;Nome;Titular;Favorecido\n'
+                      '00012768573;041;0001;123456;PEDRO;PEDRO PEREIRA;PEDRO P\n', encoding='utf-8')
+    mensagens = []
+    saida = str(tmp_path / 'saida.txt')
+    arquivos = programa.processar_arquivos(str(servidores), str(contas), saida, '20250110', mensagens.append,
+                                           interativo=False, usar_historico=False)
+    assert arquivos == [saida]
+    avisos = [mensagem for mensagem in mensagens if mensagem.startswith('Aviso:')]
+    assert any("'cnpj_pagador'" in aviso and 'servidores.csv' in aviso for aviso in avisos)
+    assert any("'nome_conta'" in aviso and 'contas.csv' in aviso for aviso in avisos)
+    # Sem a coluna, vale o CNPJ pagador padrão
+    with open(saida, encoding='latin-1') as arquivo:
+        assert programa.CNPJ_PAGADOR_PADRAO in arquivo.read()
+
+
+def test_cnpj_pagador_exato_vale_mais_que_apelido():
+    avisos = []
+    mapa = programa.resolver_colunas(['cpf', 'nome', 'matricula', 'salario', 'CNPJ', 'CNPJ Pagador'],
+                                     programa.COLUNAS_SERVIDORES, avisos)
+    assert mapa['CNPJ Pagador'] == 'cnpj_pagador' and 'CNPJ' not in mapa
+    assert avisos == []
+
+
+@pytest.mark.parametrize('formato, compactado', [
+    ('csv', 'folha.csv.gz'), ('xlsx', 'folha.xlsx.gz'), ('csv', 'pacote.zip/folha.csv'),
+    ('xlsx', 'pacote.zip/dados/folha.xlsx')], ids=['csv_gz', 'xlsx_gz', 'csv_no_zip', 'xlsx_em_pasta_do_zip'])
+def test_entrada_compactada_igual_ao_xlsx(tmp_path, folha_xlsx, formato, compactado):
+    original = tmp_path / f'folha.{formato}'
+    if formato == 'csv':
+        gravar_csv(original, ',', '.')
+    else:
+        FOLHA.to_excel(original, index=False)
+    caminho = str(tmp_path / compactado)
+    if compactado.endswith('.gz'):
+        with open(original, 'rb') as entrada, gzip.open(caminho, 'wb') as saida:
+            saida.write(entrada.read())
+    else:
+        pacote, membro = compactado.split('/', 1)
+        with zipfile.ZipFile(tmp_path / pacote, 'w', zipfile.ZIP_DEFLATED) as arquivo:
+            arquivo.write(original, membro)
+    pd.testing.assert_frame_equal(ler(caminho), folha_xlsx)
+
+
+def test_pacote_vira_uma_entrada_por_planilha(tmp_path):
+    pacote = str(tmp_path / 'pacote.zip')
+    with zipfile.ZipFile(pacote, 'w') as arquivo:
+        for membro in ('saude.xlsx', 'educacao/folha.csv.gz', 'leiame.pdf', '.oculto.csv', '__MACOSX/._saude.xlsx'):
+            arquivo.writestr(membro, b'')
+        arquivo.writestr('vazia/', b'')
+    assert programa.expandir_entradas(f'{pacote}::*') == [(f'{pacote}/educacao/folha.csv.gz', None),
+                                                          (f'{pacote}/saude.xlsx', None)]
+    vazio = str(tmp_path / 'vazio.zip')
+    with zipfile.ZipFile(vazio, 'w') as arquivo:
+        arquivo.writestr('leiame.pdf', b'')
+    with pytest.raises(ValueError, match='Nenhuma planilha'):
+        programa.abrir_planilha(programa.expandir_entradas(vazio)[0][0])
+
+
+@pytest.mark.parametrize('opcoes', [{}, {'memoria_mb': 1}], ids=['sequencial', 'fora_da_memoria'])
+def test_processamento_de_entradas_compactadas(tmp_path, opcoes):
+    servidores = str(tmp_path / 'dados_gp.csv.gz')
+    with open(os.path.join(DADOS, 'dados_gp.csv'), 'rb') as entrada, gzip.open(servidores, 'wb') as saida:
+        saida.write(entrada.read())
+    contas = str(tmp_path / 'contas.zip')
+    with zipfile.ZipFile(contas, 'w', zipfile.ZIP_DEFLATED) as arquivo:
+        arquivo.write(os.path.join(DADOS, 'retorno_contas.xlsx'), 'retorno_contas.xlsx')
+    saida = str(tmp_path / 'saida.txt')
+    programa.processar_arquivos(servidores, contas, saida, DATA_PAGAMENTO, lambda mensagem: None,
+                                interativo=False, usar_historico=False, **opcoes)
+    with open(saida, 'rb') as gerado, open(os.path.join(DADOS, 'esperado.txt'), 'rb') as esperado:
+        assert gerado.read() == esperado.read().replace(b'\n', programa.FIM_DE_REGISTRO.encode('latin-1'))
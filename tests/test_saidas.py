@@ -0,0 +1,208 @@
+"""
+Testes das saídas divididas em partes (manifesto) e das operações sobre
+saídas já geradas: a troca de data/CNPJ no lugar (redatar_arquivo), com o
+manifesto e o índice das partes, a leitura delas na pré-visualização e a
+comparação entre duas folhas (relatório de diferenças).
+
+Para rodar: python -m pytest tests
+"""
+import hashlib
+import os
+
+import pandas as pd
+import pytest
+
+from test_engines import DADOS, DATA_PAGAMENTO, ler, programa
+
+
+@pytest.mark.parametrize('opcoes', [{}, {'gravacao_posicional': True}, {'memoria_mb': 1}],
+                         ids=['sequencial', 'posicional', 'fora_da_memoria'])
+def test_manifesto_das_partes(tmp_path, opcoes):
+    saida = str(tmp_path / 'saida.txt')
+    arquivos = programa.processar_arquivos(
+        os.path.join(DADOS, 'dados_gp.csv'), os.path.join(DADOS, 'retorno_contas.csv'), saida, DATA_PAGAMENTO,
+        lambda mensagem: None, interativo=False, usar_historico=False, limite_registros=150, **opcoes)
+    linhas = manifesto(saida)
+    assert list(linhas.index) == [os.path.basename(arquivo) for arquivo in arquivos]
+    assert linhas['registros'].astype(int).tolist() == [150, 150, 100]
+    for arquivo in arquivos:
+        nome = os.path.basename(arquivo)
+        assert linhas.loc[nome, 'sha256'] == hashlib.sha256(ler(arquivo)).hexdigest()
+        assert linhas.loc[nome, 'bytes'] == str(os.path.getsize(arquivo))
+        assert len(registros(arquivo)) == int(linhas.loc[nome, 'registros'])
+
+
+@pytest.fixture
+def partes(tmp_path):
+    """Saída dividida em partes de 150 registros, com o manifesto e os índices."""
+    saida = str(tmp_path / 'saida.txt')
+    arquivos = programa.processar_arquivos(
+        os.path.join(DADOS, 'dados_gp.csv'), os.path.join(DADOS, 'retorno_contas.csv'), saida, DATA_PAGAMENTO,
+        lambda mensagem: None, interativo=False, usar_historico=False, limite_registros=150)
+    assert len(arquivos) == 3
+    return saida, arquivos
+
+
+def manifesto(saida):
+    return pd.read_csv(programa.caminho_manifesto(saida), sep=';', dtype=str, encoding='utf-8-sig').set_index('arquivo')
+
+
+def registros(caminho):
+    return ler(caminho).split(programa.FIM_DE_REGISTRO.encode('latin-1'))[:-1]
+
+
+def test_redatar_parte(partes):
+    saida, arquivos = partes
+    parte = arquivos[1]
+    antes = registros(parte)
+    outras = [ler(arquivo) for arquivo in (arquivos[0], arquivos[2])]
+    linhas_manifesto = manifesto(saida)
+    indice = programa.caminho_indice(parte)
+    os.utime(indice, (0, 0))  # Índice "antigo": precisa ser renovado
+
+    assert programa.redatar_arquivo(parte, data_pagamento='20250215', data_agendamento='20250214',
+                                    cnpj='11222333000181') == len(antes)
+
+    depois = registros(parte)
+    campos = {campo: programa.posicao_campo(campo) for campo in ('DT PGTO', 'DT AGEND', 'CNPJ PAGADOR')}
+    for registro_antes, registro_depois in zip(antes, depois):
+        assert registro_depois[slice(*campos['DT PGTO'])] == b'20250215'
+        assert registro_depois[slice(*campos['DT AGEND'])] == b'20250214'
+        assert registro_depois[slice(*campos['CNPJ PAGADOR'])] == b'11222333000181'
+        # Fora dos três campos, nada muda
+        for inicio, fim in campos.values():
+            registro_antes = registro_antes[:inicio] + b'#' * (fim - inicio) + registro_antes[fim:]
+            registro_depois = registro_depois[:inicio] + b'#' * (fim - inicio) + registro_depois[fim:]
+        assert registro_depois == registro_antes
+    assert [ler(arquivo) for arquivo in (arquivos[0], arquivos[2])] == outras
+
+    # O manifesto confere com a parte alterada; as outras linhas ficam como estavam
+    linhas = manifesto(saida)
+    nome = os.path.basename(parte)
+    assert linhas.loc[nome, 'sha256'] == hashlib.sha256(ler(parte)).hexdigest()
+    assert linhas.loc[nome, 'sha256'] != linhas_manifesto.loc[nome, 'sha256']
+    assert linhas.loc[nome, 'bytes'] == str(os.path.getsize(parte))
+    pd.testing.assert_frame_equal(linhas.drop(index=nome), linhas_manifesto.drop(index=nome))
+    # O índice continua valendo e não é reconstruído
+    assert os.path.getmtime(indice) >= os.path.getmtime(parte)
+    encontrados, _ = programa.consultar_registros(parte, cpfs=[programa.carregar_indice(parte)['cpf'].iat[0]])
+    assert encontrados['registro'].tolist() == [0]
+
+
+def test_redatar_saida_sem_manifesto(tmp_path):
+    saida = tmp_path / 'saida.txt'
+    saida.write_bytes(ler(os.path.join(DADOS, 'esperado.txt')))
+    assert programa.redatar_arquivo(str(saida), data_pagamento='20250301') == 400
+    assert not os.path.exists(programa.caminho_manifesto(str(saida)))
+    inicio, fim = programa.posicao_campo('DT PGTO')
+    assert {registro[inicio:fim] for registro in ler(str(saida)).split(b'\n')[:-1]} == {b'20250301'}
+
+
+@pytest.mark.parametrize('opcoes', [{'data_pagamento': '20251301'}, {'cnpj': '123'}, {}],
+                         ids=['data_invalida', 'cnpj_invalido', 'nada_para_alterar'])
+def test_redatar_recusa_sem_alterar(partes, opcoes):
+    saida, arquivos = partes
+    conteudo, linhas = ler(arquivos[0]), manifesto(saida)
+    with pytest.raises(ValueError):
+        programa.redatar_arquivo(arquivos[0], **opcoes)
+    assert ler(arquivos[0]) == conteudo
+    pd.testing.assert_frame_equal(manifesto(saida), linhas)
+
+
+def test_redatar_recusa_outro_leiaute(tmp_path):
+    saida = tmp_path / 'saida.txt'
+    saida.write_bytes('ÁLVARO'.encode('utf-8') + b' ' * 228 + b'\n')
+    with pytest.raises(ValueError, match='tamanho fixo'):
+        programa.redatar_arquivo(str(saida), data_pagamento='20250301')
+
+
+def test_previa_na_codificacao_da_saida(tmp_path):
+    # Registros com acento gravados em latin-1 continuam com um byte por caractere e aparecem íntegros
+    saida = tmp_path / 'saida.txt'
+    registros = ['JOSÉ DA CONCEIÇÃO'.ljust(234), 'ANA'.ljust(234)]
+    saida.write_bytes(''.join(registro + programa.FIM_DE_REGISTRO for registro in registros)
+                      .encode(programa.CODIFICACAO_SAIDA))
+    fonte = programa.FonteRegistros(caminho=str(saida))
+    try:
+        assert fonte.total == 2
+        assert [fonte.linha(1), fonte.linha(0)] == [registros[1], registros[0]]
+    finally:
+        fonte.fechar()
+
+
+def folha(*linhas):
+    colunas = ['cpf', 'matricula', 'nome', 'banco', 'agencia', 'conta', 'salario_centavos']
+    return pd.DataFrame([dict(zip(colunas, linha)) for linha in linhas], columns=colunas)
+
+
+def test_comparar_folhas():
+    anterior = folha(('11111111111', '1', 'ANA', '041', '0001', '0000000001', 100000),
+                     ('22222222222', '2', 'BIA', '041', '0001', '0000000002', 100000),
+                     ('33333333333', '3', 'CAIO', '041', '0001', '0000000003', 100000),
+                     ('44444444444', '4', 'DORA', '041', '0001', '0000000004', 0),
+                     ('55555555555', '5', 'EDU', '041', '0001', '0000000005', 100000),
+                     # CPF + matrícula repetidos: pareados pela ordem
+                     ('66666666666', '6', 'FABI', '041', '0001', '0000000006', 1000),
+                     ('66666666666', '6', 'FABI', '041', '0001', '0000000006', 2000))
+    atual = folha(('11111111111', '1', 'ANA', '041', '0001', '0000000001', 105000),  # abaixo do limite
+                  ('22222222222', '2', 'BIA', '001', '0001', '0000000002', 100000),
+                  ('33333333333', '3', 'CAIO', '041', '0001', '0000000003', 89000),
+                  ('44444444444', '4', 'DORA', '041', '0001', '0000000004', 50000),
+                  ('66666666666', '6', 'FABI', '041', '0001', '0000000006', 1000),
+                  ('66666666666', '6', 'FABI', '041', '0001', '0000000006', 2000),
+                  ('55555555555', '7', 'EDU', '041', '0001', '0000000005', 100000))
+    relatorio = programa.comparar_folhas(anterior, atual)
+    assert list(zip(relatorio['categoria'], relatorio['cpf'], relatorio['matricula'])) == [
+        ('conta_alterada', '22222222222', '2'),
+        ('salario_alterado', '33333333333', '3'), ('salario_alterado', '44444444444', '4'),
+        ('novo', '55555555555', '7'),
+        ('ausente', '55555555555', '5'),
+    ]
+    caio, dora = relatorio.iloc[1], relatorio.iloc[2]
+    assert (caio['salario_anterior'], caio['salario_atual'], caio['variacao_percentual']) == (1000.0, 890.0, -11.0)
+    assert dora['variacao_percentual'] == float('inf')
+    assert relatorio.loc[0, ['banco_anterior', 'banco_atual']].tolist() == ['041', '001']
+    assert len(programa.comparar_folhas(anterior, atual, limite_percentual=20)) == 4
+
+
+def test_relatorio_diferencas_entre_arquivos(tmp_path):
+    anterior = tmp_path / 'janeiro.txt'
+    anterior.write_bytes(ler(os.path.join(DADOS, 'esperado.txt')))
+    dados = pd.read_csv(os.path.join(DADOS, 'dados_gp.csv'), dtype=str)
+    ausente = dados.loc[0, 'cpf']
+    dados = dados.iloc[1:]
+    servidores = tmp_path / 'dados_gp.csv'
+    dados.to_csv(servidores, index=False)
+    atual = str(tmp_path / 'fevereiro.txt')
+    programa.processar_arquivos(str(servidores), os.path.join(DADOS, 'retorno_contas.csv'), atual, '20250210',
+                                lambda mensagem: None, interativo=False, usar_historico=False)
+    caminho, relatorio = programa.gerar_relatorio_diferencas(str(anterior), atual)
+    assert caminho == str(tmp_path / 'fevereiro_diferencas.csv')
+    assert relatorio[['categoria', 'cpf']].values.tolist() == [['ausente', ausente]]
+    gravado = pd.read_csv(caminho, sep=';', dtype=str, encoding='utf-8-sig')
+    assert gravado[['categoria', 'cpf']].values.tolist() == [['ausente', ausente]]
+
+
+@pytest.mark.skipif(programa.pa is None, reason='o arquivo histórico precisa do pyarrow')
+def test_relatorio_diferencas_do_arquivo_historico(tmp_path, monkeypatch):
+    monkeypatch.setenv('LEOPOLDO_HISTORICO', str(tmp_path / 'historico' / 'processamentos.db'))
+    monkeypatch.setenv('LEOPOLDO_ARQUIVO', str(tmp_path / 'arquivo'))
+    dados = pd.read_csv(os.path.join(DADOS, 'dados_gp.csv'), dtype=str)
+    dados.loc[3, 'salario'] = str(int(dados.loc[3, 'salario']) * 2)
+    servidores = tmp_path / 'dados_gp.csv'
+    dados.to_csv(servidores, index=False)
+    for data, planilha in (('20250110', os.path.join(DADOS, 'dados_gp.csv')), ('20250210', str(servidores))):
+        programa.processar_arquivos(planilha, os.path.join(DADOS, 'retorno_contas.csv'), str(tmp_path / f'{data}.txt'),
+                                    data, lambda mensagem: None, interativo=False)
+    # O relatório vai para o arquivo histórico, não para a pasta de onde o programa foi chamado
+    chamada = tmp_path / 'chamada'
+    chamada.mkdir()
+    monkeypatch.chdir(chamada)
+    caminho, relatorio = programa.gerar_relatorio_diferencas('20250110', f'20250210/{programa.CNPJ_PAGADOR_PADRAO}')
+    assert caminho == os.path.join(str(tmp_path / 'arquivo'), '_diferencas',
+                                   f'diferencas_20250210_{programa.CNPJ_PAGADOR_PADRAO}.csv')
+    assert os.path.isfile(caminho) and not os.listdir(chamada)
+    assert relatorio[['categoria', 'cpf']].values.tolist() == [['salario_alterado', dados.loc[3, 'cpf']]]
+    assert relatorio.loc[0, 'variacao_percentual'] == 100.0
+    # A subpasta '_diferencas' fica fora do dataset: comparar de novo lê as mesmas partições
+    assert programa.gerar_relatorio_diferencas('20250110', '20250210')[1].equals(relatorio)
@@ -0,0 +1,85 @@
+"""
+Testes da validação prévia: o relatório de validar_dados (uma linha por
+problema, erros antes dos avisos) e o bloqueio da geração quando há erros.
+
+Para rodar: python -m pytest tests
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from test_engines import DADOS, DATA_PAGAMENTO, ler, programa
+
+
+def test_validar_dados():
+    df = pd.DataFrame({
+        'cpf': ['11111111111', '2222A', '33333333333'],
+        'nome': ['ANA', 'joão', 'X' * 47],
+        'matricula': ['1', None, '12A'],
+        'salario': [100.0, -5.0, None],
+        'banco': ['041', '041', '0410'],
+        'agencia': ['0001', '0001', '0001'],
+        'conta': ['1', '2', '3'],
+        'origem_servidor': 'gp.csv',
+    })
+    relatorio = programa.validar_dados(df, '20251301')
+    problemas = list(zip(relatorio['severidade'], relatorio['campo'], relatorio['registro']))
+    assert problemas == [
+        ('erro', 'data_pagamento', 0),
+        ('erro', 'cpf', 2), ('erro', 'salario', 2),
+        ('erro', 'banco', 3), ('erro', 'matricula', 3),
+        ('aviso', 'nome', 2), ('aviso', 'matricula', 2),
+        ('aviso', 'nome', 3), ('aviso', 'salario', 3),
+    ]
+    erro_cpf = relatorio.iloc[1]
+    assert (erro_cpf['cpf'], erro_cpf['nome'], erro_cpf['valor'], erro_cpf['origem']) == ('2222A', 'joão', '2222A',
+                                                                                           'gp.csv')
+
+
+def test_validar_bloco():
+    # Nos blocos seguintes o registro continua a contagem e a data não é conferida de novo
+    df = pd.DataFrame({'cpf': ['1', '2'], 'nome': ['ANA', 'BIA'], 'matricula': ['1', '2'], 'salario': [1.0, -1.0],
+                       'banco': '041', 'agencia': '0001', 'conta': '1'})
+    relatorio = programa.validar_dados(df, 'invalida', primeiro_registro=101)
+    assert relatorio[['campo', 'registro']].values.tolist() == [['salario', 102]]
+    assert programa.validar_dados(df.iloc[:1], DATA_PAGAMENTO).empty
+
+
+@pytest.fixture
+def servidores_com_erros(tmp_path):
+    """Planilha de servidores com uma matrícula não numérica e um salário negativo."""
+    dados = pd.read_csv(os.path.join(DADOS, 'dados_gp.csv'), dtype=str)
+    dados.loc[5, 'matricula'] = '12A'
+    dados.loc[7, 'salario'] = '-300'
+    caminho = tmp_path / 'servidores.csv'
+    dados.to_csv(caminho, index=False)
+    return str(caminho), {'12A': dados.loc[5, 'cpf'], '-300.0': dados.loc[7, 'cpf']}
+
+
+@pytest.mark.parametrize('opcoes', [{}, {'memoria_mb': 1}], ids=['sequencial', 'fora_da_memoria'])
+def test_bloqueio_por_erro(tmp_path, servidores_com_erros, opcoes):
+    servidores, cpfs = servidores_com_erros
+    saida = str(tmp_path / 'saida.txt')
+    mensagens = []
+    arquivos = programa.processar_arquivos(
+        servidores, os.path.join(DADOS, 'retorno_contas.csv'), saida, DATA_PAGAMENTO, mensagens.append,
+        interativo=False, usar_historico=False, bloquear_em_erro=True, **opcoes)
+    assert arquivos is None
+    assert not os.path.exists(saida)
+    assert 'Geração bloqueada pela validação (2 erros).' in mensagens
+    relatorio = pd.read_csv(str(tmp_path / 'saida_validacao.csv'), sep=';', dtype=str, keep_default_na=False,
+                            encoding='utf-8-sig')
+    erros = relatorio[relatorio['severidade'] == 'erro']
+    assert list(erros.index) == [0, 1]
+    assert dict(zip(erros['valor'], erros['cpf'])) == cpfs
+    assert set(erros['problema']) == {'não numérica', 'valor negativo'}
+    assert set(relatorio['origem']) == {'servidores.csv'}
+
+    # Sem o bloqueio o arquivo sai, e o registro do relatório é a posição do servidor nele
+    programa.processar_arquivos(
+        servidores, os.path.join(DADOS, 'retorno_contas.csv'), saida, DATA_PAGAMENTO, lambda mensagem: None,
+        interativo=False, usar_historico=False, **opcoes)
+    registros = ler(saida).split(programa.FIM_DE_REGISTRO.encode('latin-1'))[:-1]
+    for registro, cpf in zip(erros['registro'].astype(int), erros['cpf']):
+        assert registros[registro - 1][46:57] == cpf.encode()